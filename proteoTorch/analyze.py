@@ -22,10 +22,10 @@ from sklearn import preprocessing
 import numpy as np
 from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as lda
 import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+import os
 from os.path import splitext
 
-_mp_data = {}
-
 try:
     from proteoTorch_solvers import l2_svm_mfn
     svmlinReady = True
@@ -33,7 +33,8 @@ except:
     print("Loaded all solvers except L2-SVM-MFN")
     svmlinReady = False
 
-from proteoTorch_qvalues import calcQ, qMedianDecoyScore, calcQAndNumIdentified, numIdentifiedAtQ # load cython library
+from proteoTorch_qvalues_np import (calcQ, qMedianDecoyScore, calcQAndNumIdentified, numIdentifiedAtQ, # load cython library
+                                    numTargetsAtQ, numTargetsAtQColumns, estimatePi0)
 # try:
 #     from proteoTorch_qvalues import calcQ, qMedianDecoyScore, calcQAndNumIdentified, numIdentifiedAtQ # load cython library
 # except:
@@ -41,7 +42,11 @@ from proteoTorch_qvalues import calcQ, qMedianDecoyScore, calcQAndNumIdentified,
 #     from proteoTorch.pyfiles.qvalsBase import calcQ, getQValues, qMedianDecoyScore, calcQAndNumIdentified, numIdentifiedAtQ # import unoptimized q-value calculation
 
 import proteoTorch.dnn_code as dnn_code
+import proteoTorch.torch_utils as torch_utils
 import proteoTorch.mini_utils as mini_utils
+import proteoTorch.pin_utils as pin_utils
+import proteoTorch.mp_utils as mp_utils
+from proteoTorch.pin_utils import checkGzip_openfile
 
 
 AUC_fn_001 = mini_utils.AUC_up_to_tol_singleQ(0.01)
@@ -57,11 +62,17 @@ _debug=True
 _mergescore=True
 _includeNegativesInResult=True
 _standardNorm=True
-# Take max wrt sid (TODO: change key from sid to sid+exp_mass)
+# Take max wrt (sid, exp_mass, label)
 _topPsm=False
 # Check if training has converged over past two iterations
 _convergeCheck=False
 _reqIncOver2Iters=0.01
+# Number of feature matrix rows gathered at a time when normalizing or scoring (see FoldRows)
+_blockRows=1 << 16
+# Start method of worker processes (fork, spawn or forkserver), None for the platform default
+_mpStartMethod=None
+# L2-SVM-MFN buffers of each CV fold (in this process), reused over grid points and iterations
+_svmWorkspaces={}
 # General assumed iterators for lists of score tuples
 _scoreInd=0
 _labelInd=1
@@ -99,13 +110,6 @@ def doMergeScores(thresh, testSets, scores, Y, isSvm = False):
 #########################################################
 #########################################################
 
-def checkGzip_openfile(filename, mode = 'r'):
-    if splitext(filename)[1] == '.gz':
-        return gzip.open(filename, mode)
-    else:
-        return open(filename, mode)
-
-
 def subsample_pin(filename, outputFile, outputFile2 = '', sampleRatio = 0.1):
     """ Load all PSMs and features from a percolator PIN file, or any tab-delimited output of a mass-spec experiment with field "Scan" to denote
         the spectrum identification number
@@ -243,7 +247,7 @@ def givenPsmIds_writePin(filename, psmIdFile):
     return np.array(X), Y, featureNames
 
 
-def load_pin_return_featureMatrix(filename, normalize = True):
+def load_pin_return_featureMatrix(filename, normalize = True, dtype = np.float64, memmapFile = None):
     """ Load all PSMs and features from a percolator input (PIN) file
         
         For n input features and m total file fields, the file format is:
@@ -260,140 +264,74 @@ def load_pin_return_featureMatrix(filename, normalize = True):
         header field 4 + n + 3 : Protein id 2
         ...
         header field m : Protein id m - n - 4
+
+        The file is parsed in blocks, with the numeric fields of each block converted in a single
+        call directly into a preallocated feature matrix of type dtype (see pin_utils.load_pin_columns).
+        The returned pepstrings is a pin_utils.StringTable, whose rows index like lists of
+        (psm id, peptide string, protein ids).
+
+        Parsed PIN files are cached in binary form and memory-mapped on later loads,
+        see pin_utils.load_pin_columns_cached() and the --pin_cache options.
+
+        If _topPsm is set, only the top scoring PSM per (scan number, exp mass, label) is kept,
+        reduced while the file is parsed so that memory scales with the number of distinct spectra
+        (see pin_utils.TopPsmTable).
+
+        If memmapFile is given, the normalized feature matrix is written once to a memory-mapped
+        .npy file of type dtype (see normalizeFeatures), which is returned in place of an in-memory X.
     """
-    f = checkGzip_openfile(filename, 'rt')
-    r = csv.DictReader(f, delimiter = '\t', skipinitialspace = True)
-    headerInOrder = r.fieldnames
-    l = headerInOrder
-    sids = [] # keep track of spectrum IDs and exp masses for FDR post-processing
-    expMasses = [] 
-    # Check that header fields follow pin schema
-    # spectrum identification key for PIN files
-    # Note: this string must be stated exactly as the third header field
-    sidKey = "ScanNr"
-    if sidKey not in l:
-        raise ValueError("No %s field, exitting" % (sidKey))
-    expMassKey = "ExpMass"
-    if expMassKey not in l:
-        raise ValueError("No %s field, exitting" % (expMassKey))
-    constKeys = [l[0]]
-
-    # denote charge keys
-    maxCharge = 1
-    chargeKeys = set([])
-    for i in l:
-        m = i.lower()
-        if m[:-1]=='charge':
-            try:
-                c = int(m[-1])
-            except ValueError:
-                print("Could not convert scan number %s on line %d to int, exitting" % (l[sidKey], i+1))
-
-            chargeKeys.add(i)
-            maxCharge = max(maxCharge, int(m[-1]))
-
-    # Check label
-    m = l[1]
-    if m.lower() == 'label':
-        constKeys.append(l[1])
-    # Exclude calcmass and expmass as features
-    constKeys += [sidKey, "CalcMass", "ExpMass"]
-    # Find peptide and protein ID fields
-    psmStrings = [l[0]]
-    isConstKey = False
-    for key in headerInOrder:
-        m = key.lower()
-        if m=="peptide":
-            isConstKey = True
-        if isConstKey:
-            constKeys.append(key)
-            psmStrings.append(key)    
-    constKeys = set(constKeys) # exclude these when reserializing data
-    keys = []
-    for h in headerInOrder: # keep order of keys intact
-        if h not in constKeys:
-            keys.append(h)
-    
-    featureNames = []
-    for k in keys:
-        featureNames.append(k)  
-    targets = {}  # mapping between sids and indices in the feature matrix
-    decoys = {}
-    X = [] # Feature matrix
-    Y = [] # labels
-    pepstrings = []
-    scoreIndex = _scoreInd # column index of the ranking score used by the search algorithm 
-    numRows = 0
-    # for i, l in enumerate(reader):
-    for i, l in enumerate(r):
-        try:
-            sid = int(l[sidKey])
-        except ValueError:
-            print("Could not convert scan number %s on line %d to int, exitting" % (l[sidKey], i+1))
-        # try:
-        #     expMass = float(l[expMassKey])
-        # except ValueError:
-        #     print("Could not convert exp mass %s on line %d to float, exitting" % (l[expMassKey], i+1))
-        expMass = l[expMassKey]
-        try:
-            y = int(l["Label"])
-        except ValueError:
-            print("Could not convert label %s on line %d to int, exitting" % (l["Label"], i+1))
-        if y != 1 and y != -1:
-            print("Error: encountered label value %d on line %d, can only be -1 or 1, exitting" % (y, i+1))
-            exit(-1)
-        el = []
-        for k in keys:
-            try:
-                el.append(float(l[k]))
-            except ValueError:
-                print("Could not convert feature %s with value %s to float, exitting" % (k, l[k]))
-        el_strings = [l[k] for k in psmStrings]
-        if not _topPsm:
-            X.append(el)
-            Y.append(y)
-            pepstrings.append(el_strings)
-            sids.append(sid)
-            expMasses.append(expMass)
-            numRows += 1
-        else:
-            if y == 1:
-                if sid in targets:
-                    featScore = X[targets[sid]][scoreIndex]
-                    if el[scoreIndex] > featScore:
-                        X[targets[sid]] = el
-                        pepstrings[targets[sid]] = el_strings
-                else:
-                    targets[sid] = numRows
-                    X.append(el)
-                    Y.append(1)
-                    pepstrings.append(el_strings)
-                    sids.append(sid)
-                    expMasses.append(expMass)
-                    numRows += 1
-            elif y == -1:
-                if sid in decoys:
-                    featScore = X[decoys[sid]][scoreIndex]
-                    if el[scoreIndex] > featScore:
-                        X[decoys[sid]] = el
-                        pepstrings[decoys[sid]] = el_strings
-                else:
-                    decoys[sid] = numRows
-                    X.append(el)
-                    Y.append(-1)
-                    pepstrings.append(el_strings)
-                    sids.append(sid)
-                    expMasses.append(expMass)
-                    numRows += 1
-    f.close()
+    pepstrings, X, Y, featureNames, sids, expMasses = pin_utils.load_pin_columns_cached(filename, dtype = dtype,
+                                                                                         topPsm = _topPsm, scoreInd = _scoreInd)
     if not normalize:
-        return pepstrings, np.array(X), np.array(Y), featureNames, sids, expMasses
+        return pepstrings, X, Y, featureNames, sids, expMasses
+
+    if memmapFile is not None:
+        out = np.lib.format.open_memmap(memmapFile, mode = 'w+', dtype = dtype, shape = X.shape)
+        return pepstrings, normalizeFeatures(X, out), Y, featureNames, sids, expMasses
 
     if _standardNorm:
-        return pepstrings, preprocessing.scale(np.array(X)), np.array(Y), featureNames, sids, expMasses
+        return pepstrings, preprocessing.scale(X), Y, featureNames, sids, expMasses
     else:
         min_max_scaler = preprocessing.MinMaxScaler()
-        return pepstrings, min_max_scaler.fit_transform(np.array(X)), np.array(Y), featureNames, sids, expMasses
+        return pepstrings, min_max_scaler.fit_transform(X), Y, featureNames, sids, expMasses
+
+def normalizeFeatures(X, out = None, blockRows = None):
+    """ Standard normalize (or min-max scale, if not _standardNorm) the columns of X, as done by
+        sklearn's preprocessing.scale and MinMaxScaler.
+
+        Column statistics are accumulated in float64 over blocks of rows, and normalized blocks
+        written to out, which may be X itself or, e.g., a float32 memmap.  Thus no full-size
+        float64 temporary is created.
+    """
+    if out is None:
+        out = np.empty(X.shape, dtype = X.dtype)
+    if blockRows is None:
+        blockRows = _blockRows
+    n, m = X.shape
+    if not n:
+        return out
+    blocks = [(i, min(i + blockRows, n)) for i in range(0, n, blockRows)]
+    eps = 10 * np.finfo(np.float64).eps
+    if _standardNorm:
+        shift = np.zeros(m)
+        for a, b in blocks:
+            shift += X[a:b].sum(axis = 0, dtype = np.float64)
+        shift /= n
+        scale = np.zeros(m)
+        for a, b in blocks:
+            scale += ((X[a:b] - shift) ** 2).sum(axis = 0)
+        scale = np.sqrt(scale / n)
+    else:
+        shift = np.full(m, np.inf)
+        colMax = np.full(m, -np.inf)
+        for a, b in blocks:
+            shift = np.minimum(shift, X[a:b].min(axis = 0))
+            colMax = np.maximum(colMax, X[a:b].max(axis = 0))
+        scale = colMax - shift
+    scale[scale < eps] = 1. # constant columns
+    for a, b in blocks:
+        out[a:b] = (X[a:b] - shift) / scale
+    return out
 
 def load_pin_return_scanExpmassPairs(filename):
     """ Load PSM scan nr, expmass info without loading feature matrix.  Used for fast TDC post-processing and plotting results
@@ -413,63 +351,8 @@ def load_pin_return_scanExpmassPairs(filename):
         ...
         header field m : Protein id m - n - 4
     """
-    f = checkGzip_openfile(filename, 'rt')
-    r = csv.DictReader(f, delimiter = '\t', skipinitialspace = True)
-    headerInOrder = r.fieldnames
-    l = headerInOrder
-    sids = [] # keep track of spectrum IDs and exp masses for FDR post-processing
-    expMasses = [] 
-    # Check that header fields follow pin schema
-    # spectrum identification key for PIN files
-    # Note: this string must be stated exactly as the third header field
-    sidKey = "ScanNr"
-    if sidKey not in l:
-        raise ValueError("No %s field, exitting" % (sidKey))
-    expMassKey = "ExpMass"
-    if expMassKey not in l:
-        raise ValueError("No %s field, exitting" % (expMassKey))
-    constKeys = [l[0]]
-
-    # Check label
-    m = l[1]
-    if m.lower() == 'label':
-        constKeys.append(l[1])
-    # Exclude calcmass and expmass as features
-    constKeys += [sidKey, "CalcMass", "ExpMass"]
-    # Find peptide and protein ID fields
-    psmStrings = [l[0]]
-    isConstKey = False
-    for key in headerInOrder:
-        m = key.lower()
-        if m=="peptide":
-            isConstKey = True
-        if isConstKey:
-            constKeys.append(key)
-            psmStrings.append(key)    
-    
-    Y = [] # labels
-    pepstrings = []
-    numRows = 0
-    for i, l in enumerate(r):
-        try:
-            sid = int(l[sidKey])
-        except ValueError:
-            print("Could not convert scan number %s on line %d to int, exitting" % (l[sidKey], i+1))
-        expMass = l[expMassKey]
-        try:
-            y = int(l["Label"])
-        except ValueError:
-            print("Could not convert label %s on line %d to int, exitting" % (l["Label"], i+1))
-        if y != 1 and y != -1:
-            print("Error: encountered label value %d on line %d, can only be -1 or 1, exitting" % (y, i+1))
-            exit(-1)
-        el_strings = [l[k] for k in psmStrings]
-        Y.append(y)
-        pepstrings.append(el_strings)
-        sids.append(sid)
-        expMasses.append(expMass)
-    f.close()
-    return pepstrings, np.array(Y), sids, expMasses
+    pepstrings, _, Y, _, sids, expMasses = pin_utils.load_pin_columns_cached(filename, loadFeatures = False)
+    return pepstrings, Y, sids, expMasses
 
 def filterPin_givenPsmIds(pinfile, psmIds, outputpin, gzipOutput = True):
     """ Given Percolator PIN file and set of PSM ids, write
@@ -620,12 +503,27 @@ def clean_noncompliant_tdc_pin(pinfile, outputpin, gzipOutput = True):
     wroteLines = filterPin_givenPsmIds(pinfile, tdcCompliantPsmIds, outputpin, gzipOutput)
     print("Wrote %d TDC PSMs from %s to %s" % (wroteLines, pinfile, outputpin))
 
+def calcMixMaxQ(scores, Y, thresh, skipDecoysPlusOne = False):
+    """ Mix-max q-values, i.e., for PSMs which have not undergone target-decoy competition, such as the
+        top target and top decoy PSM per (scan id, expmass) pair of a search of separate or concatenated
+        target and decoy databases.  The fraction of incorrect targets, pi0, is estimated from the scores.
+
+        Returns the same as calcQ
+    """
+    pi0 = estimatePi0(scores, Y)
+    print("Estimated pi0 = %f" % (pi0))
+    return calcQ(scores, Y, thresh, skipDecoysPlusOne, pi0 = pi0)
+
 #########################################################
 #########################################################
 ################### Initial score direction functions
 #########################################################
 #########################################################
-def findInitDirection(X, Y, thresh, featureNames):
+def findInitDirection(X, Y, thresh, featureNames, numThreads = 1, rows = None):
+    """ Find the feature (and sign) which identifies the most targets at q-value thresh.  All features
+        are evaluated in a single call to numTargetsAtQColumns(), parallelized over numThreads.
+        If rows is given, only rows X[rows] (with labels Y) are evaluated, without copying them.
+    """
     l = X.shape
     m = l[1] # number of columns/features
     initDirection = -1
@@ -633,72 +531,20 @@ def findInitDirection(X, Y, thresh, featureNames):
     # TODO: add check verifying best direction idetnfies more than -1 spectra, otherwise something
     # went wrong
     negBest = False
+    counts = numTargetsAtQColumns(X, Y, thresh, True, rows = rows, numThreads = numThreads)
     for i in range(m):
-        scores = X[:,i]
         # Check scores multiplied by both 1 and positive -1
         for checkNegBest in range(2):
-            if checkNegBest==1:
-                taq, _, _ = calcQ(-1. * scores, Y, thresh, True)
-            else:
-                taq, _, _ = calcQ(scores, Y, thresh, True)
-            if len(taq) > numIdentified:
+            numTaq = counts[i, checkNegBest]
+            if numTaq > numIdentified:
                 initDirection = i
-                numIdentified = len(taq)
+                numIdentified = numTaq
                 negBest = checkNegBest==1
             if _debug and _verb >= 2:
                 if checkNegBest==1:
-                    print("Direction -%d, %s: Could separate %d identifications" % (i, featureNames[i], len(taq)))
+                    print("Direction -%d, %s: Could separate %d identifications" % (i, featureNames[i], numTaq))
                 else:
-                    print("Direction %d, %s: Could separate %d identifications" % (i, featureNames[i], len(taq)))
-    return initDirection, numIdentified, negBest
-
-def evalDirectionInThread(i, scores, Y, thresh, featureNames):
-    negBest = False
-    numIdentified = -1
-    # Check scores multiplied by both 1 and positive -1
-    for checkNegBest in range(2):
-        if checkNegBest==1:
-            taq, _, _ = calcQ(-1. * scores, Y, thresh, True)
-        else:
-            taq, _, _ = calcQ(scores, Y, thresh, True)
-        if len(taq) > numIdentified:
-            numIdentified = len(taq)
-            negBest = checkNegBest==1
-        if _debug and _verb >= 2:
-            if checkNegBest==1:
-                print("Direction -%d, %s: Could separate %d identifications" % (i, featureNames[i], len(taq)))
-            else:
-                print("Direction %d, %s: Could separate %d identifications" % (i, featureNames[i], len(taq)))
-    return (i,numIdentified, negBest)
-
-    
-def findInitDirection_threaded(X, Y, thresh, featureNames, 
-                               numThreads = 1):
-    l = X.shape
-    m = l[1] # number of columns/features
-    initDirection = -1
-    numIdentified = -1
-    # TODO: add check verifying best direction idetnfies more than -1 spectra, otherwise something
-    # went wrong
-    negBest = False
-
-    # create threadpool
-    numThreads = min([mp.cpu_count() - 1, numThreads, m])
-    pool = mp.Pool(processes = numThreads)
-
-    # distribute jobs
-    results = [pool.apply_async(evalDirectionInThread, 
-                                args=(i, X[:,i], Y, thresh, featureNames)) 
-               for i in range(m)]
-    pool.close()
-    pool.join() # wait for jobs to finish before continuing
-
-    for d in results:
-        direction = d.get()
-        if(direction[1] > numIdentified):
-            initDirection = direction[0]
-            numIdentified = direction[1]
-            negBest = direction[2]
+                    print("Direction %d, %s: Could separate %d identifications" % (i, featureNames[i], numTaq))
     return initDirection, numIdentified, negBest
 
 def givenInitialDirection_split(keys, X, Y, q, featureNames, initDir):
@@ -715,11 +561,11 @@ def givenInitialDirection_split(keys, X, Y, q, featureNames, initDir):
         # Check scores multiplied by both 1 and positive -1
         for checkNegBest in range(2):
             if checkNegBest==1:
-                taq, _, _ = calcQ(-1. * currScores, Y[trainSids], q, True)
+                numTaq = numTargetsAtQ(-1. * currScores, Y[trainSids], q, True)
             else:
-                taq, _, _ = calcQ(currScores, Y[trainSids], q, True)
-            if len(taq) > numIdentified:
-                numIdentified = len(taq)
+                numTaq = numTargetsAtQ(currScores, Y[trainSids], q, True)
+            if numTaq > numIdentified:
+                numIdentified = numTaq
                 negBest = checkNegBest==1
         initTaq += numIdentified
         if negBest:
@@ -740,9 +586,9 @@ def splitScoresByCvBins(keys, mergedScores, Y, q):
     # split dataset into thirds for testing/training
     for kFold, trainSids in enumerate(keys):
         currScores = [mergedScores[sid] for sid in trainSids]
-        taq, _, _ = calcQ(currScores, Y[trainSids], q, True)
-        initTaq += len(taq)
-        print("CV fold %d: could separate %d PSMs" % (kFold, len(taq)))
+        numTaq = numTargetsAtQ(currScores, Y[trainSids], q, True)
+        initTaq += numTaq
+        print("CV fold %d: could separate %d PSMs" % (kFold, numTaq))
         scores.append(currScores)
     return scores, initTaq
 
@@ -756,8 +602,7 @@ def load_and_score_dnns(thresh, keys, X, Y, hparams = {}, input_dir = None):
         w = dnn_code.loadDNNSingleFold(num_features, kFold, hparams, input_dir)
         scores = w.decision_function(X[sids])
         # Calculate true positives
-        tp, _, _ = calcQ(scores, Y[sids], thresh, True)
-        totalTaq += len(tp)
+        totalTaq += numTargetsAtQ(scores, Y[sids], thresh, True)
 
         newScores.append(scores)
     return newScores, totalTaq
@@ -771,10 +616,8 @@ def searchForInitialDirection_split(keys, X, Y, q, featureNames, numThreads = 1)
     kFold = 0
     for trainSids in keys:
         # Find initial direction
-        if numThreads <=1:
-            initDir, numIdentified, negBest = findInitDirection(X[trainSids], Y[trainSids], q, featureNames)
-        else:
-            initDir, numIdentified, negBest = findInitDirection_threaded(X[trainSids], Y[trainSids], q, featureNames, numThreads)
+        numThreads = max(1, min([mp.cpu_count(), numThreads, X.shape[1]]))
+        initDir, numIdentified, negBest = findInitDirection(X, Y[trainSids], q, featureNames, numThreads, rows = trainSids)
 
         initTaq += numIdentified
         if negBest:
@@ -800,13 +643,12 @@ def deepDirectionSearch(keys, scores, X, Y,
     for kFold, cvBinSids in enumerate(keys):
         # Find training set using q-value analysis
         taq, daq, _ = calcQ(scores[kFold], Y[cvBinSids], thresh, True)
-        td = [cvBinSids[i] for i in taq]
-        gd = getDecoyIdx(Y, cvBinSids)
+        trainSids = getTrainingIdx(Y, cvBinSids, taq)
         # Debugging check
         if _debug and _verb >= 1:
-            print("CV fold %d: |targets| = %d, |decoys| = %d, |taq|=%d, |daq|=%d" % (kFold, len(cvBinSids) - len(gd), len(gd), len(taq), len(daq)))
-        trainSids = gd + td
-        validation_Sids = cvBinSids
+            numDecoys = len(trainSids) - len(taq)
+            print("CV fold %d: |targets| = %d, |decoys| = %d, |taq|=%d, |daq|=%d" % (kFold, len(cvBinSids) - numDecoys, numDecoys, len(taq), len(daq)))
+        validation_Sids = np.asarray(cvBinSids, dtype = np.intp)
         features = X[trainSids]
         labels = Y[trainSids]
         validation_Features = X[validation_Sids]
@@ -839,15 +681,101 @@ def calculateTargetDecoyRatio(Y):
 
 def sortRowIndicesBySid(sids):
     """ Sort Scan Identification (SID) keys and retain original row indices of feature matrix X
+
+        Rows sharing a SID keep their original order.  Returns the sorted SIDs and the int32 row indices
     """
-    keySids = sorted(list(zip(sids, range(len(sids)))))
-    xRowIndices = [j for (_,j) in keySids]
-    sids = [i for (i,_) in  keySids]
-    return sids, xRowIndices
+    sids = np.asarray(sids)
+    xRowIndices = np.argsort(sids, kind = 'stable').astype(np.int32)
+    return sids[xRowIndices], xRowIndices
+
 
+class FoldRows(object):
+    """ Rows of a (possibly memory-mapped) feature matrix selected by an index array, e.g., a CV fold.
+
+        Functions of the rows (such as a classifier's decision function) are evaluated on blocks of
+        gathered rows, so that the selected rows are never copied all at once.
+    """
+    def __init__(self, X, rows, blockRows = None):
+        self.X = X
+        self.rows = np.asarray(rows, dtype = np.intp)
+        self.blockRows = blockRows if blockRows is not None else _blockRows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def apply(self, f):
+        """ Return the concatenation of f evaluated on each block of rows
+        """
+        out = [f(self.X[self.rows[i:i + self.blockRows]]) for i in range(0, len(self.rows), self.blockRows)]
+        if not out:
+            return np.zeros(0)
+        return np.concatenate(out)
+
+    def toarray(self):
+        return self.X[self.rows]
+
+def evalRows(f, features):
+    """ Evaluate f on a feature matrix or FoldRows
+    """
+    if isinstance(features, FoldRows):
+        return features.apply(f)
+    return f(features)
 
 def getDecoyIdx(labels, ids):
-    return [i for i in ids if labels[i] != 1]
+    """ Return the rows of index array ids which are decoys
+    """
+    ids = np.asarray(ids)
+    return ids[labels[ids] != 1]
+
+def getTrainingIdx(labels, ids, taq):
+    """ Return the training rows of a CV fold: its decoys, followed by the targets passing
+        the q-value threshold (taq, positions in ids as returned by calcQ)
+    """
+    ids = np.asarray(ids)
+    return np.concatenate((getDecoyIdx(labels, ids), ids[taq])).astype(np.intp)
+
+def inverseMapping(oldToNewMapping, numRows):
+    """ Given the old row of each new row, return the new row of each of numRows old rows (-1 if removed)
+    """
+    newRows = np.full(numRows, -1, dtype = np.int64)
+    newRows[np.asarray(oldToNewMapping, dtype = np.int64)] = np.arange(len(oldToNewMapping))
+    return newRows
+
+class Folds(object):
+    """ Disjoint cross-validation folds of the rows of a feature matrix.
+
+        Held as the rows in scan id order along with the fold of each; the test rows of a fold are 
+        its own rows and its training rows are those of all other folds, as int32 (or, for more than 
+        2^31 rows, int64) index arrays in scan id order.
+    """
+    def __init__(self, rows, rowFolds, numFolds):
+        self.rows = rows
+        self.rowFolds = rowFolds
+        self.numFolds = numFolds
+        self.train = [rows[rowFolds != k] for k in range(numFolds)]
+        self.test = [rows[rowFolds == k] for k in range(numFolds)]
+
+    def __len__(self):
+        return self.numFolds
+
+    def decoys(self, kFold, labels):
+        """ Return the training rows of CV fold kFold which are decoys
+        """
+        return getDecoyIdx(labels, self.train[kFold])
+
+    def trainingSet(self, kFold, labels, taq):
+        """ Return the training set of CV fold kFold: its decoys and the targets passing
+            the q-value threshold (taq, positions in the fold's training rows)
+        """
+        return getTrainingIdx(labels, self.train[kFold], taq)
+
+    def subset(self, oldToNewMapping):
+        """ Return the folds of the rows selected by oldToNewMapping, where oldToNewMapping[j] 
+            is the old row of new row j
+        """
+        newRows = inverseMapping(oldToNewMapping, len(self.rows))[self.rows]
+        kept = newRows >= 0
+        return Folds(newRows[kept].astype(self.rows.dtype), self.rowFolds[kept], self.numFolds)
 
 
 def doRand():
@@ -855,52 +783,88 @@ def doRand():
     _seed=(_seed * 279470273) % 4294967291
     return _seed
 
-def partitionCvBins(featureMatRowIndices, sids, folds = 3, seed = 1):
+def lcgStates(seed, count):
+    """ Return the next count states of doRand's generator, starting from state seed
+
+        State k is seed * 279470273^(k+1) mod 4294967291; the powers are computed by doubling,
+        and products of two states fit in 64 bits
+    """
+    powers = np.empty(count, dtype = np.uint64)
+    if count == 0:
+        return powers
+    modulus = np.uint64(4294967291)
+    powers[0] = 279470273
+    filled = 1
+    while filled < count:
+        step = min(filled, count - filled)
+        powers[filled:filled + step] = (powers[:step] * powers[filled - 1]) % modulus
+        filled += step
+    return (powers * np.uint64(seed % 4294967291)) % modulus
+
+def partitionCvBins(featureMatRowIndices, sids, folds = 3, seed = None):
     """ Create disjoint cross-validation train and test sets
 
+        All PSMs of a scan are placed in the same CV fold, drawn at random (doRand) for each
+        scan and redrawn while the drawn fold already holds its share of PSMs.
+
         Inputs:
-            sids - list of scan ids for each feature row
-            featureMatRowIndices - list of indices corresponding to each sid in 
+            sids - sorted scan ids for each feature row
+            featureMatRowIndices - indices corresponding to each sid in 
                                    global feature matrix
             folds - number of CV folds
+            seed - initial state of the random number generator; if None, the module's
+                   state (set by --seed) is used and advanced
         Outputs:
-            trainKeys - list of lists, each of which contains the training indices of a CV fold
-            trainKeys - list of lists, each of which contains the testing indices of a CV fold
+            Folds, whose train and test attributes list the training and testing indices of each CV fold
     """
-    trainKeys = []
-    testKeys = []
-    for i in range(folds):
-        trainKeys.append([])
-        testKeys.append([])
-    remain = []
-    r = len(sids) / folds
-    remain.append(len(sids) - (folds-1) * r)
-    for i in range(folds-1):
-        remain.append(len(sids) / folds)
-    prevSid = sids[0]
-    # seed = doRand(seed)
-    # randIdx = seed % folds
-    randIdx = doRand() % folds
-    it = 0
-    for k,sid in list(zip(featureMatRowIndices, sids)):
-        if (sid!=prevSid):
-            # seed = doRand(seed)
-            # randIdx = seed % folds
-            randIdx = doRand() % folds
-            while remain[randIdx] <= 0:
-                # seed = doRand(seed)
-                # randIdx = seed % folds
-                randIdx = doRand() % folds
-        for i in range(folds):
-            if i==randIdx:
-                testKeys[i].append(k)
-            else:
-                trainKeys[i].append(k)
-
-        remain[randIdx] -= 1
-        prevSid = sid
-        it += 1
-    return trainKeys, testKeys
+    global _seed
+    if folds < 2:
+        raise ValueError('number of CV folds must be at least 2, got {}'.format(folds))
+    rows = np.asarray(featureMatRowIndices, dtype = np.int32 if len(sids) < 2**31 else np.int64)
+    sids = np.asarray(sids)
+    n = len(sids)
+    if n == 0:
+        return Folds(rows, np.zeros(0, dtype = np.intp), folds)
+    scanStarts = np.flatnonzero(np.concatenate(([True], sids[1:] != sids[:-1])))
+    scanSizes = np.diff(np.append(scanStarts, n))
+    numScans = len(scanStarts)
+    # Number of PSMs each fold may hold, as computed (in floating point) by the sequential partitioner
+    remain = np.full(folds, n / folds)
+    remain[0] = n - (folds-1) * (n / folds)
+    placed = np.zeros(folds) # PSMs placed in each fold
+    full = np.zeros(folds, dtype = bool) # folds found to hold their share of PSMs
+    scanFolds = np.empty(numScans, dtype = np.intp)
+    states = lcgStates(_seed if seed is None else seed, numScans)
+    d = 0 # next random draw
+    j = 0 # next scan to place
+    while j < numScans:
+        # Until another fold fills up, scan j+t takes the t-th draw not landing in a full fold
+        drawFolds = (states[d:] % np.uint64(folds)).astype(np.intp)
+        live = np.flatnonzero(~full[drawFolds])
+        if len(live) < numScans - j:
+            extra = (numScans - j - len(live)) * folds
+            states = np.concatenate((states, lcgStates(int(states[-1]), extra)))
+            continue
+        live = live[:numScans - j]
+        cand = drawFolds[live]
+        sizes = scanSizes[j:]
+        before = placed[cand] # PSMs in each scan's drawn fold before placing it
+        for f in range(folds):
+            inFold = cand == f
+            before[inFold] += np.cumsum(sizes[inFold]) - sizes[inFold]
+        over = np.flatnonzero(remain[cand] - before <= 0)
+        t = over[0] if len(over) else len(cand)
+        scanFolds[j:j+t] = cand[:t]
+        placed += np.bincount(cand[:t], weights = sizes[:t], minlength = folds)
+        j += t
+        if t < len(cand): # scan j's fold is full, redraw from its draw onwards
+            full[cand[t]] = True
+            d += live[t]
+        else:
+            d += live[-1] + 1
+    if seed is None:
+        _seed = int(states[d-1])
+    return Folds(rows, np.repeat(scanFolds, scanSizes), folds)
 
 
 #########################################################
@@ -913,11 +877,11 @@ def doLdaSingleFold(thresh, kFold, features, labels, validation_Features, valida
     """
     clf = lda()
     clf.fit(features, labels)
-    validation_scores = clf.decision_function(validation_Features)
-    tp, _, _ = calcQ(validation_scores, validation_Labels, thresh, True)
+    validation_scores = evalRows(clf.decision_function, validation_Features)
+    numTp = numTargetsAtQ(validation_scores, validation_Labels, thresh, True)
     if _debug and _verb > 1:
-        print("CV finished for fold %d: %d targets identified" % (kFold, len(tp)))
-    return validation_scores, len(tp), clf
+        print("CV finished for fold %d: %d targets identified" % (kFold, numTp))
+    return validation_scores, numTp, clf
 
 ###########
 ## Sanity checks for overall workflow
@@ -1031,14 +995,34 @@ def getPercKimWeights(currIter, kFold):
     return clf
 
 
+def nearestSvmSolution(solved, cp, cn, initWeights = None):
+    """ Weights and training outputs of the solved (cpos, cneg) grid point nearest to (cp, cn),
+        in log-space, where solved is a list of (log cpos, log cneg, weights, outputs).  If no
+        grid point has been solved, returns initWeights (e.g., the previous iteration's solution,
+        whose outputs on the current training set are unknown)
+    """
+    if not solved:
+        return initWeights, None
+    dists = [(lcp - np.log(cp))**2 + (lcn - np.log(cn))**2 for lcp, lcn, _, _ in solved]
+    _, _, w, o = solved[int(np.argmin(dists))]
+    return w, o
+
 def doSvmGridSearch(thresh, kFold, features, labels, validation_Features, validation_Labels, 
-                    cposes, cfracs, alpha, tron = True, currIter=1):
+                    cposes, cfracs, alpha, tron = True, currIter=1, warmStart = False, initWeights = None,
+                    solverThreads = 1, solverDtype = np.float64):
     """ Train and validate SVMs for different class weights, as is done in Percolator
+
+        If warmStart is True, L2-SVM-MFN (tron = False) solves the grid as a regularization path:
+        each grid point starts from the weights and training outputs of the nearest solved grid
+        point, and the first from initWeights (e.g., the previous iteration's best weights for
+        this fold), if given.  Each L2-SVM-MFN solve uses solverThreads threads and stores the training 
+        features as solverDtype (float64 or float32)
     """
     bestTaq = -1.
     bestCp = 1.
     bestCn = 1.
     bestClf = []
+    solved = [] # solved grid points, for warm starts
     # Find cpos and cneg
     for cpos in cposes:
         for cfrac in cfracs:
@@ -1047,12 +1031,21 @@ def doSvmGridSearch(thresh, kFold, features, labels, validation_Features, valida
                 classWeight = {1: alpha * cpos, -1: alpha * cneg}
                 clf = svc(dual = False, fit_intercept = True, class_weight = classWeight, tol = 1e-7)
                 clf.fit(features, labels)
-                validation_scores = clf.decision_function(validation_Features)
+                validation_scores = evalRows(clf.decision_function, validation_Features)
             else:
-                clf = l2_svm_mfn.solver(features, labels, 0, Cn = alpha * cneg, Cp = alpha * cpos)
-                validation_scores = np.dot(validation_Features, clf[:-1]) + clf[-1]
-            tp, _, _ = calcQ(validation_scores, validation_Labels, thresh, True)
-            currentTaq = len(tp)
+                if warmStart:
+                    w0, o0 = nearestSvmSolution(solved, alpha * cpos, alpha * cneg, initWeights)
+                    clf, outputs = l2_svm_mfn.solver(features, labels, 0, Cn = alpha * cneg, Cp = alpha * cpos, 
+                                                     initWeights = w0, initOutputs = o0, returnOutputs = True,
+                                                     numThreads = solverThreads, dtype = solverDtype, 
+                                                     workspace = svmWorkspace(kFold))
+                    solved.append((np.log(alpha * cpos), np.log(alpha * cneg), clf, outputs))
+                else:
+                    clf = l2_svm_mfn.solver(features, labels, 0, Cn = alpha * cneg, Cp = alpha * cpos, 
+                                            numThreads = solverThreads, dtype = solverDtype, 
+                                            workspace = svmWorkspace(kFold))
+                validation_scores = evalRows(lambda A: np.dot(A, clf[:-1]) + clf[-1], validation_Features)
+            currentTaq = numTargetsAtQ(validation_scores, validation_Labels, thresh, True)
             if _debug and _verb > 2:
                 print("CV fold %d: cpos = %f, cneg = %f separated %d validation targets" % (kFold, alpha * cpos, alpha * cneg, currentTaq))
             if currentTaq > bestTaq:
@@ -1061,48 +1054,62 @@ def doSvmGridSearch(thresh, kFold, features, labels, validation_Features, valida
                 bestCp = cpos * alpha
                 bestCn = cneg * alpha
                 bestClf = deepcopy(clf)
-    tp, _, _ = calcQ(topScores, validation_Labels, thresh)
-    bestTaq = len(tp)
+    bestTaq = numTargetsAtQ(topScores, validation_Labels, thresh)
     if _debug and _verb > 1:
         print("CV finished for fold %d: best cpos = %f, best cneg = %f, %d targets identified" % (kFold, bestCp, bestCn, bestTaq))
     return topScores, bestTaq, bestClf
 
-def evalSvmCposCnegPair_globalDataMatrix(tron, cpos, cfrac, alpha, thresh, kFold):
-    """ Train and validate an SVM for a single (cpos, cneg) class-weight pair, given
-        global training/validation feature matrix and labels for speed
+def svmWorkspace(kFold):
+    """ L2-SVM-MFN workspace of CV fold kFold, created on first use
+    """
+    if kFold not in _svmWorkspaces:
+        _svmWorkspaces[kFold] = l2_svm_mfn.SolverWorkspace()
+    return _svmWorkspaces[kFold]
+
+def closeSvmWorkspaces():
+    """ Free the L2-SVM-MFN workspaces of all CV folds
+    """
+    for ws in _svmWorkspaces.values():
+        ws.close()
+    _svmWorkspaces.clear()
+
+def initSvmWorker(verb):
+    """ Initialize module globals in SVM worker processes, which are not inherited under
+        the spawn and forkserver start methods
+    """
+    global _verb
+    _verb = verb
 
-        Used for multithreaded speedups when an SVM is selected as the classifier, i.e.,
+def svmWorkerPool(numThreads):
+    """ Persistent pool of SVM worker processes, reused across training iterations
+    """
+    numProcesses = max(1, min([mp.cpu_count() - 1, numThreads]))
+    return mp_utils.getWorkerPool(numProcesses, _mpStartMethod, initSvmWorker, (_verb,))
+
+def evalSvmCposCnegPair_sharedData(descriptor, tron, cpos, cfrac, alpha, thresh, kFold, initWeights = None, solverDtype = np.float64):
+    """ Train and validate an SVM for a single (cpos, cneg) class-weight pair, given the
+        training/validation feature matrices and labels of CV fold kFold in shared memory,
+        i.e., descriptor describes mp_utils.SharedArrays with keys (kFold, 'X'), (kFold, 'Y'),
+        (kFold, 'validation_X') and (kFold, 'validation_Y')
+
+        Used for multiprocess speedups when an SVM is selected as the classifier, i.e.,
         --method \in [1,2]
 
     """
-    features = _mp_data[(kFold, 'X')]
-    labels = _mp_data[(kFold, 'Y')]
-    validation_Features = _mp_data[(kFold, 'validation_X')]
-    validation_Labels = _mp_data[(kFold, 'validation_Y')]
-    cneg = cfrac*cpos
-    if tron:
-        classWeight = {1: alpha * cpos, -1: alpha * cneg}
-        clf = svc(dual = False, fit_intercept = True, class_weight = classWeight, tol = 1e-7)
-        clf.fit(features, labels)
-        validation_scores = clf.decision_function(validation_Features)
-    else:
-        clf = l2_svm_mfn.solver(features, labels, 0, Cn = alpha * cneg, Cp = alpha * cpos)
-        validation_scores = np.dot(validation_Features, clf[:-1]) + clf[-1]
-    tp, _, _ = calcQ(validation_scores, validation_Labels, thresh, True)
-    currentTaq = len(tp)
-    if _debug and _verb > 2:
-        print("CV fold %d: cpos = %f, cneg = %f separated %d validation targets" % (kFold, alpha * cpos, alpha * cneg, currentTaq))
-    return (kFold, cpos * alpha, cneg * alpha, currentTaq, np.array(validation_scores), clf)
+    data = mp_utils.attachSharedArrays(descriptor)
+    return (kFold,) + evalSvmCposCnegPair(data[(kFold, 'X')], data[(kFold, 'Y')],
+                                          data[(kFold, 'validation_X')], data[(kFold, 'validation_Y')],
+                                          tron, cpos, cfrac, alpha, thresh, kFold, initWeights, solverDtype)
 
 def doSvmGridSearch_threaded(thresh, kFold, features, labels, validation_Features, validation_Labels, 
-                             cposes, cfracs, alpha, tron = True, currIter=1, numThreads = 1):
+                             cposes, cfracs, alpha, tron = True, currIter=1, numThreads = 1, initWeights = None):
     """ Train and validate SVMs for different class weights, as is done in Percolator.  
-        Calls evalSvmCposCnegPair() to evaluate each class weight pair.
+        Calls evalSvmCposCnegPair_sharedData() to evaluate each class weight pair, warm-starting
+        L2-SVM-MFN from initWeights, if given.
 
-        Uses multithreading for speed, but passing the training/validation feature matrix and labels
-        over and over diminishes performance.  See doIter() for the fully sped up implementation, which 
-        utilizes global access of the training/validation feature matrix and labels and multithreading for
-        speed.
+        The training/validation feature matrices and labels are placed in shared memory once
+        and evaluated by the persistent pool of worker processes.  See doIter() for the fully
+        sped up implementation, which also parallelizes over CV folds.
     """
     bestTaq = -1.
     bestCp = 1.
@@ -1110,36 +1117,40 @@ def doSvmGridSearch_threaded(thresh, kFold, features, labels, validation_Feature
     bestClf = []
     cposCfracPairs = [(cpos, cfrac) for cpos in cposes for cfrac in cfracs]
 
-    numThreads = min([mp.cpu_count() - 1, numThreads, len(cposCfracPairs)])
-    pool = mp.Pool(processes = numThreads)
-    results = [pool.apply_async(evalSvmCposCnegPair,
-                                args=(features, labels, validation_Features, validation_Labels,
-                                      tron, cpos, cfrac, alpha, thresh, kFold)) 
-               for (cpos,cfrac) in cposCfracPairs]
-
-    pool.close()
-    pool.join() # wait for jobs to finish before continuing
-
-    for p in results:
-        cposCnegCandidate = p.get()
-        currentTaq = cposCnegCandidate[2]
+    with mp_utils.SharedArrays() as sharedData:
+        sharedData.publish((kFold, 'X'), features)
+        sharedData.publish((kFold, 'Y'), labels)
+        if isinstance(validation_Features, FoldRows): # gather rows directly into shared memory
+            sharedData.publish((kFold, 'validation_X'), validation_Features.X, validation_Features.rows)
+        else:
+            sharedData.publish((kFold, 'validation_X'), validation_Features)
+        sharedData.publish((kFold, 'validation_Y'), validation_Labels)
+        descriptor = sharedData.descriptor()
+        pool = svmWorkerPool(numThreads)
+        results = [pool.apply_async(evalSvmCposCnegPair_sharedData,
+                                    args=(descriptor, tron, cpos, cfrac, alpha, thresh, kFold, initWeights)) 
+                   for (cpos,cfrac) in cposCfracPairs]
+        results = [p.get() for p in results] # wait for jobs to finish before releasing shared data
+
+    for cposCnegCandidate in results:
+        currentTaq = cposCnegCandidate[3]
         if currentTaq > bestTaq:
             bestTaq = currentTaq
-            bestCp = cposCnegCandidate[0]
-            bestCn = cposCnegCandidate[1]
-            topScores = np.array(cposCnegCandidate[3])
-            bestClf = deepcopy(cposCnegCandidate[4])
-    tp, _, _ = calcQ(topScores, validation_Labels, thresh)
-    bestTaq = len(tp)
+            bestCp = cposCnegCandidate[1]
+            bestCn = cposCnegCandidate[2]
+            topScores = np.array(cposCnegCandidate[4])
+            bestClf = deepcopy(cposCnegCandidate[5])
+    bestTaq = numTargetsAtQ(topScores, validation_Labels, thresh)
     if _debug and _verb > 1:
         print("CV finished for fold %d: best cpos = %f, best cneg = %f, %d targets identified" % (kFold, bestCp, bestCn, bestTaq))
     return topScores, bestTaq, bestClf
 
 def evalSvmCposCnegPair(features, labels, 
                         validation_Features, validation_Labels,
-                        tron, cpos, cfrac, alpha, thresh, kFold):
+                        tron, cpos, cfrac, alpha, thresh, kFold, initWeights = None, solverDtype = np.float64):
     """ Train and validate an SVM for a single (cpos, cneg) class-weight pair, given
-        training/validation feature matrix and labels as inputs
+        training/validation feature matrix and labels as inputs.  L2-SVM-MFN is warm-started
+        from initWeights, if given, and stores the training features as solverDtype
 
     """
     cneg = cfrac*cpos
@@ -1147,12 +1158,12 @@ def evalSvmCposCnegPair(features, labels,
         classWeight = {1: alpha * cpos, -1: alpha * cneg}
         clf = svc(dual = False, fit_intercept = True, class_weight = classWeight, tol = 1e-7)
         clf.fit(features, labels)
-        validation_scores = clf.decision_function(validation_Features)
+        validation_scores = evalRows(clf.decision_function, validation_Features)
     else:
-        clf = l2_svm_mfn.solver(features, labels, 0, Cn = alpha * cneg, Cp = alpha * cpos)
-        validation_scores = np.dot(validation_Features, clf[:-1]) + clf[-1]
-    tp, _, _ = calcQ(validation_scores, validation_Labels, thresh, True)
-    currentTaq = len(tp)
+        clf = l2_svm_mfn.solver(features, labels, 0, Cn = alpha * cneg, Cp = alpha * cpos, initWeights = initWeights, 
+                                dtype = solverDtype, workspace = svmWorkspace(kFold))
+        validation_scores = evalRows(lambda A: np.dot(A, clf[:-1]) + clf[-1], validation_Features)
+    currentTaq = numTargetsAtQ(validation_scores, validation_Labels, thresh, True)
     if _debug and _verb > 2:
         print("CV fold %d: cpos = %f, cneg = %f separated %d validation targets" % (kFold, alpha * cpos, alpha * cneg, currentTaq))
     return (cpos * alpha, cneg * alpha, currentTaq, np.array(validation_scores), clf)
@@ -1170,12 +1181,11 @@ def doTest(thresh, keys, X, Y, trained_models, svmlin = False):
     for kFold, testSids in enumerate(keys):
         w = trained_models[kFold]
         if svmlin:
-            testScores[testSids] = np.dot(X[testSids], w[:-1]) + w[-1]
+            testScores[testSids] = FoldRows(X, testSids).apply(lambda A: np.dot(A, w[:-1]) + w[-1])
         else:
-            testScores[testSids] = w.decision_function(X[testSids])
+            testScores[testSids] = FoldRows(X, testSids).apply(w.decision_function)
         # Calculate true positives
-        tp, _, _ = calcQ(testScores[testSids], Y[testSids], thresh, False)
-        totalTaq += len(tp)
+        totalTaq += numTargetsAtQ(testScores[testSids], Y[testSids], thresh, False)
     return testScores, totalTaq
 
 
@@ -1216,68 +1226,122 @@ def doIter(thresh, keys, scores, X, Y, targetDecoyRatio, method = 0, currIter=1,
         isSvm = True
     elif method==2:
         isSvm = True
-
-    if numThreads==1 or not isSvm: # check whether we need to parallelize the SVM grid search
-        for kFold, cvBinSids in enumerate(keys):
-            # Find training set using q-value analysis
-            taq, daq, _ = calcQ(scores[kFold], Y[cvBinSids], thresh, True)
-            td = [cvBinSids[i] for i in taq]
-            gd = getDecoyIdx(Y, cvBinSids)
-            # Debugging check
-            if _debug and _verb >= 1:
-                print("CV fold %d: |targets| = %d, |decoys| = %d, |taq|=%d, |daq|=%d" % (kFold, len(cvBinSids) - len(gd), len(gd), len(taq), len(daq)))
-            trainSids = gd + td
-            validation_Sids = cvBinSids
+    # Warm-start L2-SVM-MFN along the class-weight grid and from the previous iteration's solutions
+    warmStart = method==2 and dnn_hyperparams.get('svm_warm_start', False)
+    prevWeights = [None] * len(keys)
+    if warmStart and len(prev_iter_models) == len(keys):
+        prevWeights = prev_iter_models
+    # Threads are used by parallel grid search processes (SVMs), by concurrently trained CV folds, 
+    # or within each L2-SVM-MFN solve or DNN fold
+    gridThreads = numThreads
+    foldThreads = 1
+    solverThreads = 1
+    if not isSvm:
+        foldThreads = min(numThreads, len(keys))
+        if method==3 and dnn_code.trainingDevice(dnn_hyperparams).type != 'cpu':
+            foldThreads = 1 # DNN folds are trained in turn on the GPU, so as not to run out of GPU memory
+        solverThreads = max(1, numThreads // foldThreads)
+    elif method==2 and dnn_hyperparams.get('svm_parallelism') == 'solver':
+        gridThreads = 1
+        solverThreads = numThreads
+    elif method==2 and dnn_hyperparams.get('svm_parallelism') == 'folds':
+        gridThreads = 1
+        foldThreads = min(numThreads, len(keys))
+        solverThreads = max(1, numThreads // foldThreads)
+    # DNN folds train and score with their share of the threads
+    foldHyperparams = dnn_hyperparams
+    if method==3:
+        foldHyperparams = dict(dnn_hyperparams, numThreads = solverThreads)
+    # Precision in which L2-SVM-MFN stores the training features of each CV fold
+    solverDtype = np.float64
+    if method==2 and dnn_hyperparams.get('svm_precision') == 'float32':
+        solverDtype = np.float32
+
+    def trainFold(kFold):
+        """ Select the training set of CV fold kFold using q-value analysis, train a classifier
+            on it and score the fold's validation set
+        """
+        cvBinSids = keys[kFold]
+        # Find training set using q-value analysis
+        taq, daq, _ = calcQ(scores[kFold], Y[cvBinSids], thresh, True)
+        trainSids = getTrainingIdx(Y, cvBinSids, taq)
+        # Debugging check
+        if _debug and _verb >= 1:
+            numDecoys = len(trainSids) - len(taq)
+            print("CV fold %d: |targets| = %d, |decoys| = %d, |taq|=%d, |daq|=%d" % (kFold, len(cvBinSids) - numDecoys, numDecoys, len(taq), len(daq)))
+        validation_Sids = np.asarray(cvBinSids, dtype = np.intp)
+        if method == 2 and X.dtype != solverDtype: # gather training rows directly in the solver's precision
+            features = np.empty((len(trainSids), X.shape[1]), dtype = solverDtype)
+            mp_utils.gatherRows(X, trainSids, features, _blockRows)
+        else:
             features = X[trainSids]
-            labels = Y[trainSids]
+        labels = Y[trainSids]
+        # validation rows are only scored by LDA/SVMs, gather them in blocks instead of copying
+        if method == 3:
             validation_Features = X[validation_Sids]
-            validation_Labels = Y[validation_Sids]
-        
-            if method == 0:
-                topScores, bestTaq, bestClf = doLdaSingleFold(thresh, kFold, features, labels, validation_Features, validation_Labels)
-            elif method in [1, 2]: # helpful to keep this single-threaded SVM implementation in for profiling
-                topScores, bestTaq, bestClf = doSvmGridSearch(thresh, kFold, features, labels,validation_Features, validation_Labels,
-                                                              cposes, cfracs, alpha, tron, currIter)
-            else:
-                topScores, bestTaq, bestClf = dnn_code.DNNSingleFold(thresh, kFold, features, labels, validation_Features, 
-                                                                     validation_Labels, hparams=dnn_hyperparams)
-            all_AUCs.append( AUC_fn_001(topScores, validation_Labels) )
+        else:
+            validation_Features = FoldRows(X, validation_Sids)
+        validation_Labels = Y[validation_Sids]
+    
+        if method == 0:
+            topScores, bestTaq, bestClf = doLdaSingleFold(thresh, kFold, features, labels, validation_Features, validation_Labels)
+        elif method in [1, 2]: # helpful to keep this single-threaded SVM implementation in for profiling
+            topScores, bestTaq, bestClf = doSvmGridSearch(thresh, kFold, features, labels,validation_Features, validation_Labels,
+                                                          cposes, cfracs, alpha, tron, currIter, warmStart, prevWeights[kFold],
+                                                          solverThreads, solverDtype)
+        else:
+            # each fold draws from its own seeded torch generators, so results do not depend on how folds are scheduled
+            foldSeed = int(np.random.SeedSequence([dnn_hyperparams.get('seed', 1), currIter, kFold]).generate_state(1)[0])
+            topScores, bestTaq, bestClf = dnn_code.DNNSingleFold(thresh, kFold, features, labels, validation_Features, 
+                                                                 validation_Labels, hparams=dict(foldHyperparams, dnn_seed = foldSeed))
+        # a separate evaluator per fold, concurrent folds must not share its buffers
+        return topScores, bestTaq, bestClf, mini_utils.AUC_up_to_tol_singleQ(0.01)(topScores, validation_Labels)
+
+    if gridThreads==1 or not isSvm: # check whether we need to parallelize the SVM grid search
+        if foldThreads > 1:
+            # Train CV folds concurrently: the numerical work of training and scoring releases the GIL, 
+            # and selecting the training set of one fold overlaps with training on another.  DNN folds 
+            # limit torch's intra-op threads to their share of the threads
+            initializer = torch_utils.limit_intra_op_threads if method==3 else None
+            with ThreadPoolExecutor(max_workers = foldThreads, initializer = initializer, initargs = (solverThreads,)) as executor:
+                foldResults = list(executor.map(trainFold, range(len(keys))))
+        else:
+            foldResults = [trainFold(kFold) for kFold in range(len(keys))]
+        for topScores, bestTaq, bestClf, auc in foldResults:
+            all_AUCs.append(auc)
             newScores.append(topScores)
             clfs.append(bestClf)
             estTaq += bestTaq
     else: # parallelize over CV bins and SVM grid search with minimal data copying overhead
-        newScores = [None, None, None]
-        clfs = [None, None, None]
-        all_AUCs = [None, None, None]
-        bestTaqs = [-1, -1, -1]
-        bestCps = [-1, -1, -1]
-        bestCns = [-1, -1, -1]
+        newScores = [None] * len(keys)
+        clfs = [None] * len(keys)
+        all_AUCs = [None] * len(keys)
+        bestTaqs = [-1] * len(keys)
+        bestCps = [-1] * len(keys)
+        bestCns = [-1] * len(keys)
+        validation_Labels = []
         cposCfracPairs = [(cpos, cfrac, kFold) for cpos in cposes for cfrac in cfracs for kFold in range(len(keys))]
-        for kFold, cvBinSids in enumerate(keys): # first make global training and validation sets
-            # Find training set using q-value analysis
-            taq, daq, _ = calcQ(scores[kFold], Y[cvBinSids], thresh, True)
-            td = [cvBinSids[i] for i in taq]
-            gd = getDecoyIdx(Y, cvBinSids)
-            # Debugging check
-            if _debug and _verb >= 1:
-                print("CV fold %d: |targets| = %d, |decoys| = %d, |taq|=%d, |daq|=%d" % (kFold, len(cvBinSids) - len(gd), len(gd), len(taq), len(daq)))
-            trainSids = gd + td
-            validation_Sids = cvBinSids
-            global _mp_data
-            _mp_data[(kFold, 'X')] = X[trainSids]
-            _mp_data[(kFold, 'Y')] = Y[trainSids]
-            _mp_data[(kFold, 'validation_X')] = X[validation_Sids]
-            _mp_data[(kFold, 'validation_Y')] = Y[validation_Sids]
-        numThreads = min([mp.cpu_count() - 1, numThreads, len(cposCfracPairs)])
-        pool = mp.Pool(processes = numThreads)
-        results = [pool.apply_async(evalSvmCposCnegPair_globalDataMatrix,
-                                    args=(tron, cpos, cfrac, alpha, thresh, kFold)) 
-                   for (cpos,cfrac, kFold) in cposCfracPairs]
-        
-        pool.close()
-        pool.join() # wait for jobs to finish before continuing
-        for p in results:
-            cposCnegCandidate = p.get()
+        with mp_utils.SharedArrays() as sharedData:
+            for kFold, cvBinSids in enumerate(keys): # first place training and validation sets in shared memory
+                # Find training set using q-value analysis
+                taq, daq, _ = calcQ(scores[kFold], Y[cvBinSids], thresh, True)
+                trainSids = getTrainingIdx(Y, cvBinSids, taq)
+                # Debugging check
+                if _debug and _verb >= 1:
+                    numDecoys = len(trainSids) - len(taq)
+                    print("CV fold %d: |targets| = %d, |decoys| = %d, |taq|=%d, |daq|=%d" % (kFold, len(cvBinSids) - numDecoys, numDecoys, len(taq), len(daq)))
+                validation_Sids = np.asarray(cvBinSids, dtype = np.intp)
+                sharedData.publish((kFold, 'X'), X, trainSids, solverDtype if method == 2 else None)
+                sharedData.publish((kFold, 'Y'), Y, trainSids)
+                sharedData.publish((kFold, 'validation_X'), X, validation_Sids)
+                validation_Labels.append(sharedData.publish((kFold, 'validation_Y'), Y, validation_Sids).copy())
+            descriptor = sharedData.descriptor()
+            pool = svmWorkerPool(gridThreads)
+            results = [pool.apply_async(evalSvmCposCnegPair_sharedData,
+                                        args=(descriptor, tron, cpos, cfrac, alpha, thresh, kFold, prevWeights[kFold], solverDtype)) 
+                       for (cpos,cfrac, kFold) in cposCfracPairs]
+            results = [p.get() for p in results] # wait for jobs to finish before releasing shared data
+        for cposCnegCandidate in results:
             kFold = cposCnegCandidate[0]
             currentTaq = cposCnegCandidate[3]
             if currentTaq > bestTaqs[kFold]:
@@ -1287,11 +1351,10 @@ def doIter(thresh, keys, scores, X, Y, targetDecoyRatio, method = 0, currIter=1,
                 newScores[kFold] = np.array(cposCnegCandidate[4])
                 clfs[kFold] = deepcopy(cposCnegCandidate[5])
         for kFold in range(len(keys)):
-            tp, _, _ = calcQ(newScores[kFold], _mp_data[kFold, 'validation_Y'], thresh)
-            bestTaqs[kFold] = len(tp)
-            all_AUCs[kFold] = AUC_fn_001(newScores[kFold], _mp_data[kFold, 'validation_Y'] )
+            bestTaqs[kFold] = numTargetsAtQ(newScores[kFold], validation_Labels[kFold], thresh)
+            all_AUCs[kFold] = AUC_fn_001(newScores[kFold], validation_Labels[kFold])
         estTaq = np.sum(bestTaqs)
-    estTaq /= 2
+    estTaq /= len(keys) - 1 # each PSM is in the training sets of all but one CV fold
     return newScores, estTaq, clfs, np.mean(all_AUCs)
 
 def targetDecoyCompetition(scores, Y, pepstrings, sids0, expMasses):
@@ -1344,7 +1407,7 @@ def mainIter(hyperparams):
          E) Perform semi-supervised learning for input --maxIters, using
             --method as the underlying classifier which is trained on a CV training
             fold and tested on the corresponding disjoint test set.
-         F) Post-process results using TDC or (TODO) mix-max q-value estimatation procedures
+         F) Post-process results using TDC or mix-max q-value estimatation procedures
          G) Test learned parameters and save final post-processed identifications output_dir/output.txt
     
          Notes:
@@ -1382,9 +1445,21 @@ def mainIter(hyperparams):
     ##############
     ##############
 
-    pepstrings, X, Y, featureNames, sids0, expMasses = load_pin_return_featureMatrix(hyperparams['pin'])
+    if hyperparams.get('float32', False):
+        # Normalized float32 features are written once to a memory-mapped file, which all CV folds
+        # and classifiers index into
+        memmapDir = hyperparams.get('feature_memmap_dir', None) or output_dir
+        memmapFile = _join(memmapDir, 'features.%d.npy' % os.getpid())
+        pepstrings, X, Y, featureNames, sids0, expMasses = load_pin_return_featureMatrix(hyperparams['pin'], dtype = np.float32,
+                                                                                        memmapFile = memmapFile)
+        try:
+            os.remove(memmapFile) # the mapping remains valid until X is released
+        except OSError:
+            pass
+    else:
+        pepstrings, X, Y, featureNames, sids0, expMasses = load_pin_return_featureMatrix(hyperparams['pin'])
     # pepstrings: list of tuples (psm id, peptide string, protein id) for each PSM
-    # X: standard-normalized feature matrix
+    # X: standard-normalized feature matrix (float32 memmap if hyperparams['float32'])
     # Y: binary labels, true denoting a target PSM
     # featureNames: list of names for features loaded from pin
     # sids0: list of scan numbers (ids) from the pin file
@@ -1404,7 +1479,8 @@ def mainIter(hyperparams):
     ##############
     ##############
 
-    trainKeys, testKeys = partitionCvBins(sidSortedRowIndices, sids)
+    cvFolds = partitionCvBins(sidSortedRowIndices, sids, hyperparams['num_folds'])
+    trainKeys, testKeys = cvFolds.train, cvFolds.test
 
     ##############
     ## Check if we should load previously learned DNNs, 
@@ -1420,7 +1496,7 @@ def mainIter(hyperparams):
 
             print("Loading previously trained models")
             scores, initTaq = load_and_score_dnns(q, trainKeys, X, Y, hyperparams, input_dir)
-            print("Could separate %d identifications" % ( initTaq / 2 ))
+            print("Could separate %d identifications" % ( initTaq / (len(trainKeys) - 1) ))
             initDirectionFound = True
 
     ##############
@@ -1439,7 +1515,7 @@ def mainIter(hyperparams):
             scores, initTaq = givenInitialDirection_split(trainKeys, X, Y, q, featureNames, initDir)
         else:
             scores, initTaq = searchForInitialDirection_split(trainKeys, X, Y, q, featureNames, hyperparams['numThreads'])
-        print("Could initially separate %d identifications" % ( initTaq / 2 ))
+        print("Could initially separate %d identifications" % ( initTaq / (len(trainKeys) - 1) ))
         if hyperparams['deepInitDirection']:
             print("Performing deep initial direction search")
             scores, initTaq = deepDirectionSearch(trainKeys, scores, X, Y,
@@ -1485,7 +1561,10 @@ def mainIter(hyperparams):
             isSvmlin = (hyperparams['method']==2)
             testScores, numIdentified = doTest(q, testKeys, X, Y, trained_models, isSvmlin)
             testScores = doMergeScores(q, testKeys, testScores, Y, isSvm)
-            taq, _, qs = calcQ(testScores, Y, q, False)
+            if hyperparams.get('qvalue_method') == 'mixmax':
+                taq, _, qs = calcMixMaxQ(testScores, Y, q)
+            else:
+                taq, _, qs = calcQ(testScores, Y, q, False)
 
             if hyperparams['tdc']:
                 writeOutput(_join(output_dir,'output_allPsms_iter' + str(i) + '.txt'), testScores, Y, pepstrings, qs)
@@ -1514,7 +1593,7 @@ def mainIter(hyperparams):
 
     ##############
     ##############
-    ## F) Post-process results using TDC or (TODO) mix-max q-value estimatation procedures
+    ## F) Post-process results using TDC or mix-max q-value estimatation procedures
     ##############
     ##############
     if hyperparams['tdc']:
@@ -1525,9 +1604,13 @@ def mainIter(hyperparams):
         print("Could identify %d targets after target-decoy competition" % (len(taq)))
         X = X[tdcWinners, :]
         # Update train and test partitions for further processing
-        trainKeys, testKeys = mapTrainTestKeys(trainKeys, testKeys, tdcWinners)
+        cvFolds = cvFolds.subset(tdcWinners)
+        trainKeys, testKeys = cvFolds.train, cvFolds.test
         writeOutput(_join(output_dir, 'output_pretdc.txt'), scores, Y, pepstrings, qs)
     else:         
+        if hyperparams.get('qvalue_method') == 'mixmax':
+            taq, _, qs = calcMixMaxQ(scores, Y, q)
+            print("Could identify %d targets using mix-max q-values" % (len(taq)))
         # Save final identifications
         # sort scores in descending order
         inds = [i for i,s in sorted(enumerate(scores), reverse = True, key = lambda r: r[1])]
@@ -1535,30 +1618,6 @@ def mainIter(hyperparams):
 
     return scores, X, Y, pepstrings, sids0, expMasses, trainKeys, testKeys
 
-def mapTrainTestKeys(trainKeys, testKeys, oldToNewMapping):
-    """ Update train and test keys under new mapping, such that
-        for oldToNewMapping[i] = j, and tk in trainKeys, 
-        tk[j] = i
-    """
-    newTrainKeys = []
-    newTestKeys = []
-    newMap = {}
-    for i, j in enumerate(oldToNewMapping):
-        newMap[j] = i
-    for fold, (trainInds, testInds) in enumerate(zip(trainKeys, testKeys)):
-        newTrainInds = []
-        newTestInds = []
-        for ind in trainInds:
-            if ind in newMap:
-                newTrainInds.append(newMap[ind])
-        for ind in testInds:
-            if ind in newMap:
-                newTestInds.append(newMap[ind])
-        newTrainKeys.append(newTrainInds)
-        newTestKeys.append(newTestInds)
-
-    return newTrainKeys, newTestKeys
-
 def tdc(hyperparams, scores, X, Y, pepstrings, sids0, expMasses, trainKeys, testKeys):
     """ Analysis workflow proceeds as follows:
          A) Normalize input features
@@ -1602,7 +1661,9 @@ def tdc(hyperparams, scores, X, Y, pepstrings, sids0, expMasses, trainKeys, test
     ## A) Normalize input features
     ##############
     ##############
-    if _standardNorm:
+    if X.dtype != np.float64:
+        normalizeFeatures(X, out = X)
+    elif _standardNorm:
         preprocessing.scale(X, copy = False)
     else:
         min_max_scaler = preprocessing.MinMaxScaler()
@@ -1721,12 +1782,22 @@ def main():
     parser.add_option('--deepq', type = 'float', action= 'store', default = 0.07)
     parser.add_option('--load_previous_dnn', type = 'string', default = 'false', help = 'Start iterations from previously trained model saved in output_dir')
     parser.add_option('--tdc', type = 'string', default = 'true', help = 'Use target-decoy competition to assign q-values.')
+    parser.add_option('--qvalue_method', type = 'string', action= 'store', default = 'tdc', 
+                      help = 'Final q-value estimation: tdc or mixmax.  mixmax estimates pi0 and computes mix-max q-values without target-decoy competition (overrides --tdc).')
     parser.add_option('--previous_dnn_dir', type = 'string', action= 'store', default=None, help='Previous output directory containing trained dnn weights.')
     parser.add_option('--write_output_per_iter', type = 'string', default = 'true', help = 'Write recalibrated psms after every X iterations, where X = --output_per_iter_granularity.')
     parser.add_option('--output_per_iter_granularity', type = 'int', action= 'store', default = 5, help = 'Number of iterations to write recalibrated psms.')
     parser.add_option('--deepInitDirection', type = 'string', default = 'true', help = 'Perform initial direction search using deep models.')
     parser.add_option('--initDirection', type = 'int', action= 'store', default=-1)
     parser.add_option('--numThreads', type = 'int', action= 'store', default=1)
+    parser.add_option('--svm_parallelism', type = 'string', action= 'store', default = 'grid', 
+                      help = 'How method 2 uses --numThreads: grid (grid search class weights and CV folds in parallel processes), folds (CV folds trained concurrently in threads) or solver (multithreaded L2-SVM-MFN solves, e.g., for large CV folds).')
+    parser.add_option('--svm_precision', type = 'string', action= 'store', default = 'float64', 
+                      help = 'Precision L2-SVM-MFN (method 2) stores training features in: float64 or float32 (dot products are accumulated in double precision).')
+    parser.add_option('--svm_warm_start', type = 'string', default = 'false', 
+                      help = 'Warm-start L2-SVM-MFN (method 2) from the nearest solved class weights of the grid search and the previous iteration\'s solution.')
+    parser.add_option('--mp_start_method', type = 'string', action= 'store', default=None, 
+                      help = 'Start method of worker processes for the parallel SVM grid search: fork, spawn or forkserver.  Defaults to the platform default.')
     parser.add_option('--verbose', type = 'int', action= 'store', default = 1)
     parser.add_option('--method', type = 'int', action= 'store', default = 3, 
                       help = 'Method 0: LDA; Method 1: linear SVM, solver TRON; Method 2: linear SVM, solver L2-SVM-MFN; Method 3: DNN (MLP)')
@@ -1734,6 +1805,7 @@ def main():
     parser.add_option('--pin', type = 'string', action= 'store', help='input file in PIN format')
     parser.add_option('--output_dir', type = 'string', action= 'store', default=None, help='Defaults to model_output/<data_file_name>/<time_stamp>/')
     parser.add_option('--seed', type = 'int', action= 'store', default = 1)
+    parser.add_option('--num_folds', type = 'int', action= 'store', default = 3, help='number of cross-validation folds PSMs are partitioned into (by scan id).')
     parser.add_option('--dnn_num_epochs', type = 'int', action= 'store', default = 50, help='number of epochs for training the DNN model.')
     parser.add_option('--dnn_lr', type = 'float', action= 'store', default = 0.001, help='learning rate for training the DNN model.')
     parser.add_option('--dnn_lr_decay', type = 'float', action= 'store', default = 0.02, 
@@ -1748,24 +1820,51 @@ def main():
     parser.add_option('--dnn_label_smoothing_1', type = 'float', action= 'store', default = 0.99, help='Label smoothing class 1 (positives)')
     parser.add_option('--dnn_train_qtol', type = 'float', action= 'store', default = 0.1, help='AUC q-value tolerance for validation set.')
     parser.add_option('--snapshot_ensemble_count', type = 'int', action= 'store', default = 10, help='Number of ensembles to train.')
+    parser.add_option('--dnn_ensemble_early_stopping', type = 'string', default = 'false', 
+                      help='Stop the greedy selection of the snapshot ensemble once no snapshot improves its validation AUC.')
     parser.add_option('--deep_direction_ensemble', type = 'int', action= 'store', default = 30, help='Number of ensembles to train.')
     parser.add_option('--false_positive_loss_factor', type = 'float', action= 'store', default = 4.0, help='Multiplicative factor to weight false positives')
     parser.add_option('--dnn_optimizer', type = 'string', action= 'store', default= 'adam', help='DNN solver to use.')
+    parser.add_option('--pin_cache', type = 'string', default = 'false', 
+                      help = 'Cache parsed PIN files in binary form (a full copy of the PIN data, up to --pin_cache_max_gb in total) and memory-map them on later runs.  Entries are written to --pin_cache_dir, by default %s.' % (pin_utils.defaultCacheDir()))
+    parser.add_option('--pin_cache_dir', type = 'string', action= 'store', default=None, help='Directory for cached PIN files.  Defaults to %s.' % (pin_utils.defaultCacheDir()))
+    parser.add_option('--float32', type = 'string', default = 'false', 
+                      help = 'Keep the normalized feature matrix in float32, memory-mapped from a file written once after loading the PIN file.  Reduces memory for large PIN files.')
+    parser.add_option('--feature_memmap_dir', type = 'string', action= 'store', default=None, help='Directory for the float32 memory-mapped feature matrix.  Defaults to output_dir.')
+    parser.add_option('--pin_cache_max_gb', type = 'float', action= 'store', default = 20., help='Maximum size of the PIN cache directory in GB, least recently used entries are evicted beyond this.')
     (_options, _args) = parser.parse_args()
 
     params = _options.__dict__
 
-    global _verb, _seed
+    global _verb, _seed, _mpStartMethod
     _verb = params['verbose']
     _seed= params['seed']
+    if params['mp_start_method'] is not None and params['mp_start_method'] not in mp.get_all_start_methods():
+        raise ValueError('start method {} not supported, must be one of {}'.format(params['mp_start_method'], ', '.join(mp.get_all_start_methods())))
+    _mpStartMethod = params['mp_start_method']
     ########################
     # Parameter value checks
     ########################
     # If including more boolean parameters, add to list trueOrFalse_params to check input
     # values and set to true or false
-    trueOrFalse_params = ['load_previous_dnn', 'tdc', 'write_output_per_iter', 'deepInitDirection']
+    trueOrFalse_params = ['load_previous_dnn', 'tdc', 'write_output_per_iter', 'deepInitDirection', 'pin_cache', 'float32', 'svm_warm_start', 
+                          'dnn_ensemble_early_stopping']
     for tf_param in trueOrFalse_params:
         params[tf_param] = check_arg_trueFalse(params[tf_param])
+    pin_utils.setCacheOptions(params['pin_cache'], params['pin_cache_dir'], params['pin_cache_max_gb'])
+    params['qvalue_method'] = params['qvalue_method'].lower()
+    if params['qvalue_method'] != 'tdc' and params['qvalue_method'] != 'mixmax':
+        raise ValueError('q-value method {} not supported'.format(params['qvalue_method']))
+    if params['qvalue_method'] == 'mixmax':
+        params['tdc'] = False
+    if params['num_folds'] < 2:
+        raise ValueError('number of CV folds must be at least 2, got {}'.format(params['num_folds']))
+    params['svm_parallelism'] = params['svm_parallelism'].lower()
+    if params['svm_parallelism'] not in ['grid', 'folds', 'solver']:
+        raise ValueError('SVM parallelism {} not supported, must be grid, folds or solver'.format(params['svm_parallelism']))
+    params['svm_precision'] = params['svm_precision'].lower()
+    if params['svm_precision'] != 'float64' and params['svm_precision'] != 'float32':
+        raise ValueError('SVM precision {} not supported, must be float64 or float32'.format(params['svm_precision']))
     if params["method"]!=3:
         params['deepInitDirection'] = False
     else:
@@ -1777,6 +1876,8 @@ def main():
     scores, X, Y, pepstrings, sids0, expMasses, trainKeys, testKeys = mainIter(params)
     if params["tdc"]:
         tdc(params, scores, X, Y, pepstrings, sids0, expMasses, trainKeys, testKeys)
+    mp_utils.closeWorkerPool()
+    closeSvmWorkspaces()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+Written by John Halloran <jthalloran@ucdavis.edu>
+
+Copyright (C) 2020 John Halloran
+Licensed under the Open Software License version 3.0
+See COPYING or http://opensource.org/licenses/OSL-3.0
+
+Benchmarks of the q-value entry points.  Synthetic score/label arrays are generated
+for a range of PSM counts, tie rates and decoy fractions, every entry point of every
+available q-value implementation is timed, results are checked against the reference
+implementation, and timings are written to a JSON file.  Passing a JSON file from a
+previous version as --baseline reports entry points which have become slower.
+
+The L2-SVM-MFN solver is also timed with features stored in double and single precision,
+checking that the number of targets identified at q with single precision stays within
+--svm_precision_tol of double precision.
+"""
+from __future__ import print_function
+
+import os
+import json
+import time
+import optparse
+import platform
+import datetime
+import importlib
+import subprocess
+import numpy as np
+
+# Q-value implementations, in order of preference for the reference results
+_implementations = [('numpy', 'proteoTorch_qvalues_np'),
+                    ('cython', 'proteoTorch_qvalues'),
+                    ('python', 'proteoTorch.pyfiles.qvalsBase')]
+
+_entryPoints = ['calcQ', 'calcQAndNumIdentified', 'numIdentifiedAtQ', 'qMedianDecoyScore', 'numTargetsAtQ']
+
+#########################################################
+#########################################################
+################### Synthetic data
+#########################################################
+#########################################################
+def syntheticScores(numPsms, tieRate = 0., decoyFraction = 0.5, separation = 2., seed = 1):
+    """ Generate scores and labels for numPsms PSMs.
+
+        Decoy scores are standard normal, as are target scores, of which half are shifted by
+        separation (i.e., correct identifications).  A fraction tieRate of PSMs copy the score of
+        another, randomly chosen PSM, and a fraction decoyFraction of PSMs are decoys (label -1).
+    """
+    rng = np.random.RandomState(seed)
+    labels = np.where(rng.random_sample(numPsms) < decoyFraction, -1, 1).astype(np.int32)
+    scores = rng.standard_normal(numPsms)
+    scores += separation * ((labels == 1) & (rng.random_sample(numPsms) < 0.5))
+    if tieRate > 0.:
+        tied = np.flatnonzero(rng.random_sample(numPsms) < tieRate)
+        scores[tied] = scores[rng.randint(numPsms, size = len(tied))]
+    return scores, labels
+
+#########################################################
+#########################################################
+################### Result normalization
+#########################################################
+#########################################################
+def tieGroupEnds(scores):
+    """ Mask of the last PSM of each group of tied scores, in descending order of score.
+        Cumulative counts at these positions do not depend on how a sort orders tied PSMs
+    """
+    s = np.sort(scores)[::-1]
+    ends = np.ones(len(s), dtype = bool)
+    ends[:-1] = s[:-1] != s[1:]
+    return ends
+
+def normalizeResult(function, result, ends):
+    """ Convert the result of a q-value entry point to a dictionary of arrays which are
+        comparable across implementations (e.g., regardless of the order of tied PSMs)
+    """
+    if function == 'calcQ':
+        taq, daq, qvals = result
+        return {'taq' : np.sort(np.asarray(taq, dtype = np.int64)),
+                'daq' : np.sort(np.asarray(daq, dtype = np.int64)),
+                'qvals' : np.asarray(qvals, dtype = np.float64)}
+    if function == 'calcQAndNumIdentified':
+        qvals, numIdentified = result
+        return {'qvals' : np.asarray(qvals, dtype = np.float64),
+                'numIdentified' : np.asarray(numIdentified, dtype = np.int64)[ends]}
+    if function == 'numIdentifiedAtQ':
+        numIdentified = np.asarray(result, dtype = np.int64)
+        return {'numPassing' : np.array([len(numIdentified)]),
+                'numIdentified' : numIdentified[ends[:len(numIdentified)]]}
+    if function == 'qMedianDecoyScore':
+        return {'thresholdScore' : np.array([result[0]], dtype = np.float64),
+                'medianDecoyScore' : np.array([result[1]], dtype = np.float64)}
+    return {'numTargets' : np.array([result])}
+
+def compareResults(reference, result):
+    """ Returns the fields of result which differ from the reference
+    """
+    mismatches = []
+    for k in reference:
+        a = reference[k]
+        b = result[k]
+        if a.shape != b.shape or not np.array_equal(a, b):
+            mismatches.append(k)
+    return mismatches
+
+#########################################################
+#########################################################
+################### Timing
+#########################################################
+#########################################################
+def loadImplementations(names):
+    """ Import the requested q-value implementations, skipping those which are not available
+    """
+    modules = []
+    for name, moduleName in _implementations:
+        if name not in names:
+            continue
+        try:
+            modules.append((name, importlib.import_module(moduleName)))
+        except ImportError:
+            print("Q-value implementation %s (%s) not available, skipping" % (name, moduleName))
+    return modules
+
+def timeCall(f, args, repeats):
+    """ Returns the result of f(*args) and the wall clock times of repeats further calls
+    """
+    result = f(*args)
+    times = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - t)
+    return result, times
+
+def benchmarkQvalues(sizes, tieRates, decoyFractions, implementations, q = 0.01, repeats = 3,
+                     maxPsms = None, seed = 1):
+    """ Time all q-value entry points of each implementation over all combinations of PSM counts
+        (sizes), tie rates and decoy fractions.  maxPsms maps implementation names to the largest
+        number of PSMs to run them on (e.g., to skip the pure-python implementation for large inputs).
+
+        Returns a list of dictionaries, one per (implementation, entry point, input) triple, with timings
+        in seconds and whether the results are identical to those of the first implementation
+    """
+    records = []
+    for numPsms in sizes:
+        for tieRate in tieRates:
+            for decoyFraction in decoyFractions:
+                scores, labels = syntheticScores(numPsms, tieRate, decoyFraction, seed = seed)
+                ends = tieGroupEnds(scores)
+                references = {}
+                for name, module in implementations:
+                    if maxPsms and numPsms > maxPsms.get(name, numPsms):
+                        continue
+                    for function in _entryPoints:
+                        if not hasattr(module, function):
+                            continue
+                        result, times = timeCall(getattr(module, function), (scores, labels, q), repeats)
+                        result = normalizeResult(function, result, ends)
+                        if function not in references:
+                            references[function] = (name, result)
+                        refName, reference = references[function]
+                        mismatches = compareResults(reference, result)
+                        records.append({'suite' : 'qvalues',
+                                        'implementation' : name,
+                                        'function' : function,
+                                        'numPsms' : int(numPsms),
+                                        'tieRate' : tieRate,
+                                        'decoyFraction' : decoyFraction,
+                                        'minTime' : min(times) if times else None,
+                                        'meanTime' : float(np.mean(times)) if times else None,
+                                        'reference' : refName,
+                                        'identical' : not mismatches,
+                                        'mismatches' : mismatches})
+                        print("%-7s %-22s n=%-10d ties=%.2f decoys=%.2f  %10.6fs %s" %
+                              (name, function, numPsms, tieRate, decoyFraction, records[-1]['minTime'] or 0.,
+                               '' if not mismatches else 'DIFFERS from %s: %s' % (refName, ', '.join(mismatches))))
+    return records
+
+#########################################################
+#########################################################
+################### SVM solver precision
+#########################################################
+#########################################################
+def syntheticFeatures(numPsms, numFeatures, decoyFraction = 0.5, separation = 3., seed = 1):
+    """ Generate standardized features and labels for numPsms PSMs, as in a PIN file.
+
+        Features are standard normal; half of the targets (i.e., correct identifications) are
+        shifted by separation along a random direction.  Columns are then standardized.
+    """
+    rng = np.random.RandomState(seed)
+    labels = np.where(rng.random_sample(numPsms) < decoyFraction, -1., 1.)
+    X = rng.standard_normal((numPsms, numFeatures))
+    direction = rng.standard_normal(numFeatures)
+    direction /= np.linalg.norm(direction)
+    correct = (labels == 1) & (rng.random_sample(numPsms) < 0.5)
+    X[correct] += separation * direction
+    X -= X.mean(axis = 0)
+    X /= X.std(axis = 0)
+    return X, labels
+
+def benchmarkSvmPrecision(sizes, numFeatures, q = 0.01, repeats = 3, tolerance = 0.01, seed = 1):
+    """ Time L2-SVM-MFN with the feature matrix stored in double (float64) and single (float32)
+        precision, for each number of PSMs in sizes.  The number of targets identified at q by the
+        single precision solution must be within a fraction tolerance of the double precision one.
+
+        Returns a list of dictionaries, one per (precision, input) pair, or an empty list if the
+        solver is not available
+    """
+    try:
+        from proteoTorch_solvers import l2_svm_mfn
+        from proteoTorch_qvalues_np import numTargetsAtQ
+    except Exception as e:
+        print("L2-SVM-MFN solver not available (%s), skipping" % (e))
+        return []
+    records = []
+    for numPsms in sizes:
+        X, labels = syntheticFeatures(numPsms, numFeatures, seed = seed)
+        Cn = float(np.sum(labels == 1)) / max(1., float(np.sum(labels == -1)))
+        X32 = X.astype(np.float32)
+        reference = None
+        for dtype, features in [(np.float64, X), (np.float32, X32)]:
+            clf, times = timeCall(lambda: l2_svm_mfn.solver(features, labels, 0, Cp = 1., Cn = Cn, dtype = dtype), (), repeats)
+            numIdentified = numTargetsAtQ(np.dot(X, clf[:-1]) + clf[-1], labels, q)
+            if reference is None:
+                reference = numIdentified
+            withinTol = abs(numIdentified - reference) <= tolerance * max(1, reference)
+            records.append({'suite' : 'svm_precision',
+                            'implementation' : 'l2_svm_mfn',
+                            'function' : np.dtype(dtype).name,
+                            'numPsms' : int(numPsms),
+                            'numFeatures' : int(numFeatures),
+                            'tieRate' : 0.,
+                            'decoyFraction' : 0.5,
+                            'minTime' : min(times) if times else None,
+                            'meanTime' : float(np.mean(times)) if times else None,
+                            'numIdentified' : int(numIdentified),
+                            'reference' : 'float64',
+                            'identical' : bool(withinTol),
+                            'mismatches' : [] if withinTol else ['numIdentified']})
+            print("%-7s %-22s n=%-10d features=%-4d %10.6fs %d targets at q=%.2f %s" %
+                  ('svm', np.dtype(dtype).name, numPsms, numFeatures, records[-1]['minTime'] or 0., numIdentified, q,
+                   '' if withinTol else 'DIFFERS from float64 (%d targets)' % (reference)))
+    return records
+
+#########################################################
+#########################################################
+################### Regression tracking
+#########################################################
+#########################################################
+def recordKey(r):
+    return (r['suite'], r['implementation'], r['function'], r['numPsms'], r['tieRate'], r['decoyFraction'], r.get('numFeatures'))
+
+def findRegressions(records, baseline, tolerance):
+    """ Returns the records whose minimum time exceeds that of the matching baseline record
+        by more than a factor of (1 + tolerance)
+    """
+    previous = dict((recordKey(r), r) for r in baseline['results'])
+    regressions = []
+    for r in records:
+        p = previous.get(recordKey(r))
+        if p is None or not p['minTime'] or r['minTime'] is None:
+            continue
+        ratio = r['minTime'] / p['minTime']
+        if ratio > 1. + tolerance:
+            regressions.append({'key' : list(recordKey(r)), 'baselineTime' : p['minTime'],
+                                'time' : r['minTime'], 'ratio' : ratio})
+    return regressions
+
+def gitRevision():
+    """ Current git commit of the source tree, if available
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                       stderr = subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def parseList(s, t):
+    return [t(float(v)) if t is int else t(v) for v in s.split(',') if v]
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', type = 'string', action= 'store', default = '1e4,1e5,1e6',
+                      help = 'Comma separated numbers of PSMs, e.g., 1e4,1e5,1e6,1e7,1e8.')
+    parser.add_option('--tie_rates', type = 'string', action= 'store', default = '0,0.5',
+                      help = 'Comma separated fractions of PSMs whose score ties that of another PSM.')
+    parser.add_option('--decoy_fractions', type = 'string', action= 'store', default = '0.5', help = 'Comma separated fractions of decoy PSMs.')
+    parser.add_option('--implementations', type = 'string', action= 'store', default = 'numpy,cython,python',
+                      help = 'Comma separated q-value implementations to benchmark: numpy (proteoTorch_qvalues_np), cython (proteoTorch_qvalues), python (qvalsBase).')
+    parser.add_option('--max_cython_psms', type = 'float', action= 'store', default = 1e7, help = 'Largest input to benchmark the cython implementation on.')
+    parser.add_option('--max_python_psms', type = 'float', action= 'store', default = 1e5, help = 'Largest input to benchmark the python implementation on.')
+    parser.add_option('--svm_sizes', type = 'string', action= 'store', default = '1e5,1e6',
+                      help = 'Comma separated numbers of PSMs to time the L2-SVM-MFN solver on in double and single precision (empty to skip).')
+    parser.add_option('--svm_features', type = 'int', action= 'store', default = 30, help = 'Number of features of the SVM inputs.')
+    parser.add_option('--svm_precision_tol', type = 'float', action= 'store', default = 0.01,
+                      help = 'Largest allowed relative difference between the targets identified by the single and double precision solvers.')
+    parser.add_option('--q', type = 'float', action= 'store', default = 0.01)
+    parser.add_option('--repeats', type = 'int', action= 'store', default = 3, help = 'Timed calls per entry point and input.')
+    parser.add_option('--seed', type = 'int', action= 'store', default = 1)
+    parser.add_option('--output', type = 'string', action= 'store', default = 'benchmark.json', help = 'JSON file to write results to.')
+    parser.add_option('--baseline', type = 'string', action= 'store', default = None, help = 'JSON results of a previous run to check for regressions.')
+    parser.add_option('--regression_tol', type = 'float', action= 'store', default = 0.2,
+                      help = 'Report entry points more than this fraction slower than the baseline.')
+    (_options, _args) = parser.parse_args()
+    params = _options.__dict__
+
+    implementations = loadImplementations(parseList(params['implementations'], str))
+    maxPsms = {'cython' : params['max_cython_psms'], 'python' : params['max_python_psms']}
+    records = benchmarkQvalues(parseList(params['sizes'], int), parseList(params['tie_rates'], float),
+                               parseList(params['decoy_fractions'], float), implementations,
+                               params['q'], params['repeats'], maxPsms, params['seed'])
+    svmRecords = benchmarkSvmPrecision(parseList(params['svm_sizes'], int), params['svm_features'], params['q'],
+                                       params['repeats'], params['svm_precision_tol'], params['seed'])
+    records += svmRecords
+
+    output = {'timestamp' : datetime.datetime.now().isoformat(),
+              'gitRevision' : gitRevision(),
+              'platform' : {'python' : platform.python_version(), 'numpy' : np.__version__,
+                            'machine' : platform.machine(), 'processor' : platform.processor(),
+                            'cpuCount' : os.cpu_count()},
+              'parameters' : params,
+              'results' : records}
+    regressions = []
+    if params['baseline']:
+        with open(params['baseline']) as f:
+            baseline = json.load(f)
+        regressions = findRegressions(records, baseline, params['regression_tol'])
+        output['baselineRevision'] = baseline.get('gitRevision')
+        output['regressions'] = regressions
+        for r in regressions:
+            print("Regression: %s %.6fs vs. %.6fs baseline (x%.2f)" % ('/'.join(map(str, r['key'])), r['time'], r['baselineTime'], r['ratio']))
+    with open(params['output'], 'w') as f:
+        json.dump(output, f, indent = 1)
+    print("Wrote %d benchmark results to %s" % (len(records), params['output']))
+
+    mismatches = [r for r in records if not r['identical']]
+    if mismatches:
+        print("%d results differ from the reference implementation" % (len(mismatches)))
+    precisionFailures = [r for r in svmRecords if not r['identical']]
+    if regressions or precisionFailures:
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -142,7 +142,7 @@ cdef getQValues(double pi0, psm* combined,
             else:
                 n_z_ge_w += 1
                 queue += 1
-            if idx == 0 or combined[idx].scoe != combined[idx-1].score:
+            if idx == 0 or combined[idx].score != combined[idx-1].score:
                 for i in range(queue):
                     h_w_le_z.push_back(n_w_ge_w)
                     h_z_le_z.push_back(n_z_ge_w)
@@ -172,7 +172,8 @@ cdef getQValues(double pi0, psm* combined,
 
         if idx==numPsms-1 or combined[idx].score != combined[idx+1].score:
             if pi0 < 1.0 and decoyQueue > 0:
-                j = countTotal - (n_z_ge_w - 1)
+                # index of the current decoy group in h_w_le_z and h_z_le_z (ordered by ascending score)
+                j = countTotal - (n_z_ge_w - 1 + skipDecoysPlusOne)
                 cnt_w = float(h_w_le_z[j])
                 cnt_z = float(h_z_le_z[j])
                 estPx_lt_zj = (cnt_w - pi0*cnt_z) / ((1.0 - pi0)*cnt_z)
@@ -183,7 +184,7 @@ cdef getQValues(double pi0, psm* combined,
                     estPx_lt_zj = 0.
                 E_f1_mod_run_tot += float(decoyQueue) * estPx_lt_zj * (1.0 - pi0)
                 if verb >= 3:
-                    print "Mix-max num negatives correction: %f vs. %f" % ((1.0 - pi0)*float(n_z_ge_w), E_f1_mod_run_tot)
+                    print("Mix-max num negatives correction: %f vs. %f" % ((1.0 - pi0)*float(n_z_ge_w), E_f1_mod_run_tot))
 
             if _includeNegativesInResult:
                 targetQueue += decoyQueue
@@ -199,8 +200,10 @@ cdef getQValues(double pi0, psm* combined,
     return list(accumulate(qvals[::-1], min))[::-1]
     
 def calcQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False,
-          verb = -1):
+          verb = -1, double pi0 = 1.):
     """Returns q-values and the indices of the positive class such that q <= thresh
+
+       For pi0 < 1, mix-max q-values are computed
     """
     assert len(scores)==len(labels), "Number of input scores does not match number of labels for q-value calculation"
     cdef int numPsms
@@ -224,7 +227,6 @@ def calcQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False,
     else:
         qsort(allScores, numPsms, sizeof(psm), compare)
 
-    cdef double pi0 = 1.
     cdef int sdpo = 0
     if skipDecoysPlusOne:
         sdpo = 1
@@ -244,9 +246,11 @@ def calcQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False,
                 taq.append(curr_og_idx)
             else:
                 daq.append(curr_og_idx)
-    qvals = [qvals[allScores[idx].index] for i in range(numPsms)]
+    originalOrderQvals = [0.] * numPsms
+    for idx in range(numPsms):
+        originalOrderQvals[allScores[idx].index] = qvals[idx]
     free(allScores)
-    return taq,daq, qvals
+    return taq,daq, originalOrderQvals
 
 def calcQAndNumIdentified(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, verb = -1):
     """Returns q-values and the number of identified spectra at each q-value
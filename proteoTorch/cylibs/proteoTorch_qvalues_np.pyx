@@ -0,0 +1,661 @@
+# distutils: language=c++
+# cython: boundscheck=False, wraparound=False, cdivision=True
+
+# Written by John Halloran <jthalloran@ucdavis.edu>
+#
+# Copyright (C) 2020 John Halloran
+# Licensed under the Open Software License version 3.0
+# See COPYING or http://opensource.org/licenses/OSL-3.0
+
+""" Array-in/array-out q-value estimation.
+
+    Drop-in replacements for calcQ, calcQAndNumIdentified, numIdentifiedAtQ and qMedianDecoyScore
+    of proteoTorch_qvalues, operating directly on contiguous NumPy arrays.  Scores are ordered with
+    a stable descending sort over typed memoryviews, and FDRs and their running minimum (i.e., the
+    q-values) are computed in C without creating Python objects per PSM.  Indices and q-values are
+    returned as ndarrays.  Mix-max q-values are supported through the pi0 argument (see estimatePi0).
+"""
+
+import numpy as np
+from libc.stdlib cimport malloc, free
+from libc.math cimport isnan, floor
+from libcpp cimport bool
+from libcpp.algorithm cimport sort as stdsort
+from libcpp.vector cimport vector
+from cython.parallel cimport prange
+
+cdef extern from "<algorithm>" namespace "std" nogil:
+    void nth_element[Iter](Iter first, Iter nth, Iter last)
+
+ctypedef fused floating:
+    float
+    double
+
+cdef struct psm:
+    double score
+    Py_ssize_t index
+
+cdef bool psmGreater(psm a, psm b) nogil:
+    """ Descending order of score, ties broken by order of appearance (thus, a stable sort).
+        NaN scores are ordered last.
+    """
+    if a.score > b.score:
+        return True
+    if a.score < b.score:
+        return False
+    if a.score == b.score:
+        return a.index < b.index
+    if isnan(a.score) != isnan(b.score):
+        return isnan(b.score)
+    return a.index < b.index
+
+#########################################################
+#########################################################
+################### Sorting and q-value kernels
+#########################################################
+#########################################################
+cdef int argsortDescending(const double[::1] scores, Py_ssize_t[::1] order) nogil:
+    """ Write the stable descending sort order of scores to order.  Returns -1 if out of memory
+    """
+    cdef Py_ssize_t n = scores.shape[0]
+    cdef Py_ssize_t i
+    cdef psm *allScores = <psm *> malloc(max(n, 1) * sizeof(psm))
+    if allScores == NULL:
+        return -1
+    for i in range(n):
+        allScores[i].score = scores[i]
+        allScores[i].index = i
+    stdsort(allScores, allScores + n, psmGreater)
+    for i in range(n):
+        order[i] = allScores[i].index
+    free(allScores)
+    return 0
+
+cdef psm *naturalMergeSort(psm *a, psm *buf, Py_ssize_t n) nogil:
+    """ Adaptive, stable sort of a in psmGreater order, using buf (of the same size) as scratch space.
+        Maximal ordered runs are detected (runs in reverse order are flipped in place) and
+        merged pairwise, so nearly sorted input is sorted in O(n log r) time for r runs.
+        Returns the buffer (a or buf) holding the sorted result.
+    """
+    cdef vector[Py_ssize_t] bounds, newBounds
+    cdef Py_ssize_t i = 0, j, lo, mid, hi, k
+    cdef psm tmp
+    cdef psm *swap
+    # find runs
+    bounds.push_back(0)
+    while i < n:
+        j = i + 1
+        if j < n and psmGreater(a[j], a[i]):
+            while j < n and psmGreater(a[j], a[j-1]):
+                j += 1
+            lo = i
+            hi = j - 1
+            while lo < hi:
+                tmp = a[lo]
+                a[lo] = a[hi]
+                a[hi] = tmp
+                lo += 1
+                hi -= 1
+        else:
+            while j < n and not psmGreater(a[j], a[j-1]):
+                j += 1
+        bounds.push_back(j)
+        i = j
+    # merge pairs of runs until a single run remains
+    while bounds.size() > 2:
+        newBounds.clear()
+        newBounds.push_back(0)
+        for k in range(0, bounds.size() - 1, 2):
+            lo = bounds[k]
+            mid = bounds[k+1]
+            hi = bounds[k+2] if k + 2 < bounds.size() else mid
+            i = lo
+            j = mid
+            while i < mid and j < hi:
+                if psmGreater(a[j], a[i]):
+                    buf[lo] = a[j]
+                    j += 1
+                else:
+                    buf[lo] = a[i]
+                    i += 1
+                lo += 1
+            while i < mid:
+                buf[lo] = a[i]
+                i += 1
+                lo += 1
+            while j < hi:
+                buf[lo] = a[j]
+                j += 1
+                lo += 1
+            newBounds.push_back(hi)
+        bounds.swap(newBounds)
+        swap = a
+        a = buf
+        buf = swap
+    return a
+
+cdef int resortDescending(const double[::1] scores, const Py_ssize_t[::1] prevOrder, Py_ssize_t[::1] order) nogil:
+    """ Given prevOrder, a permutation which previously sorted (similar) scores, write the stable
+        descending sort order of scores to order.  Returns -1 if out of memory
+    """
+    cdef Py_ssize_t n = scores.shape[0]
+    cdef Py_ssize_t i
+    cdef psm *allScores = <psm *> malloc(2 * max(n, 1) * sizeof(psm))
+    cdef psm *sortedScores
+    if allScores == NULL:
+        return -1
+    for i in range(n):
+        allScores[i].score = scores[prevOrder[i]]
+        allScores[i].index = prevOrder[i]
+    sortedScores = naturalMergeSort(allScores, allScores + n, n)
+    for i in range(n):
+        order[i] = sortedScores[i].index
+    free(allScores)
+    return 0
+
+cdef void qvaluesSorted(const double[::1] scores, const int[::1] labels, const Py_ssize_t[::1] order,
+                        int skipDecoysPlusOne, double pi0, double[::1] qvals) nogil:
+    """ Compute the q-values of PSMs ordered by descending score, i.e., the q-value of
+        PSM order[i] is written to qvals[i]
+
+        If pi0 < 1, mix-max q-values are computed (Keich et al., "Improved false discovery rate
+        estimation procedure for shotgun proteomics").  For the decoys in a group of tied scores z,
+        the counts N_{w<=z} and N_{z<=z} (the h_w_le_z and h_z_le_z histograms of getQValues) are the
+        totals minus the number of targets and decoys scoring strictly above the group, so the
+        correction is accumulated in the same pass.  If pi0 = 1 this is the standard q-value calculation.
+    """
+    cdef Py_ssize_t n = order.shape[0]
+    cdef Py_ssize_t idx, i
+    cdef Py_ssize_t groupStart = 0 # first PSM of the current group of tied scores
+    cdef double c = 0. if skipDecoysPlusOne else 1.
+    cdef double n_z_ge_w = c # N_{z>=w} and N_{w>=w}
+    cdef double n_w_ge_w = 0
+    cdef double numTargets = 0, numDecoys
+    cdef double w_gt_z = 0, z_gt_z = 0 # targets and decoys scoring above the current group
+    cdef double decoyQueue, cnt_w, cnt_z, estPx_lt_zj
+    cdef double E_f1_mod_run_tot = 0.
+    cdef double fdr
+    if pi0 < 1.:
+        for idx in range(n):
+            if labels[idx] == 1:
+                numTargets += 1
+    numDecoys = n - numTargets
+    for idx in range(n):
+        if labels[order[idx]] == 1:
+            n_w_ge_w += 1
+        else:
+            n_z_ge_w += 1
+        if idx == n - 1 or scores[order[idx]] != scores[order[idx+1]]:
+            if pi0 < 1.:
+                decoyQueue = n_z_ge_w - c - z_gt_z
+                if decoyQueue > 0:
+                    cnt_w = numTargets - w_gt_z
+                    cnt_z = numDecoys - z_gt_z
+                    estPx_lt_zj = (cnt_w - pi0*cnt_z) / ((1. - pi0)*cnt_z)
+                    if estPx_lt_zj > 1.:
+                        estPx_lt_zj = 1.
+                    if estPx_lt_zj < 0.:
+                        estPx_lt_zj = 0.
+                    E_f1_mod_run_tot += decoyQueue * estPx_lt_zj * (1. - pi0)
+                w_gt_z = n_w_ge_w
+                z_gt_z = n_z_ge_w - c
+            fdr = (n_z_ge_w * pi0 + E_f1_mod_run_tot) / max(1., n_w_ge_w)
+            if fdr > 1.:
+                fdr = 1.
+            for i in range(groupStart, idx + 1):
+                qvals[i] = fdr
+            groupStart = idx + 1
+    # Convert the FDRs into q-values, i.e., the running minimum from the lowest score
+    for idx in range(n - 2, -1, -1):
+        if qvals[idx+1] < qvals[idx]:
+            qvals[idx] = qvals[idx+1]
+
+cdef Py_ssize_t numPassing(const double[::1] qvals, double thresh) nogil:
+    """ Number of leading (sorted) PSMs with q-value <= thresh
+    """
+    cdef Py_ssize_t idx
+    for idx in range(qvals.shape[0]):
+        if qvals[idx] > thresh:
+            return idx
+    return qvals.shape[0]
+
+cdef Py_ssize_t countTargetsAtQ(const double[::1] scores, const int[::1] labels, double thresh,
+                                int skipDecoysPlusOne) nogil:
+    """ Number of targets with q-value <= thresh, without sorting all PSMs.
+
+        A PSM at sorted position i, with N_{z>=w} decoys and N_{w>=w} targets scoring at least as high,
+        passes if the FDR (N_{z>=w} + c) / max(1, N_{w>=w}) <= thresh at i or at some lower scoring position.
+        As N_{w>=w} is at most the total number of targets, T, no position with N_{z>=w} >= K,
+        K = floor(thresh * max(1, T) - c) + 2, can pass.  Thus only PSMs scoring strictly greater than
+        the K-th highest decoy score, found by partial selection, are sorted and scanned.
+        Returns -1 if out of memory
+    """
+    cdef Py_ssize_t n = scores.shape[0]
+    cdef Py_ssize_t numTargets = 0, numDecoys, K, i, m = 0
+    cdef Py_ssize_t numPassing = 0
+    cdef double c = 0. if skipDecoysPlusOne else 1.
+    cdef double n_z_ge_w = c, n_w_ge_w = 0.
+    cdef double cutoff
+    cdef double *decoyScores
+    cdef psm *candidates
+    for i in range(n):
+        if isnan(scores[i]):
+            return -2
+        if labels[i] == 1:
+            numTargets += 1
+    if not (thresh < 1.): # all q-values are at most 1
+        return numTargets
+    numDecoys = n - numTargets
+    K = <Py_ssize_t> floor(thresh * max(1, numTargets) - c) + 2
+    if K <= 0:
+        return 0
+    cutoff = -1. / 0.
+    if K <= numDecoys:
+        decoyScores = <double *> malloc(numDecoys * sizeof(double))
+        if decoyScores == NULL:
+            return -1
+        for i in range(n):
+            if labels[i] != 1:
+                decoyScores[m] = -scores[i]
+                m += 1
+        nth_element(decoyScores, decoyScores + K - 1, decoyScores + numDecoys)
+        cutoff = -decoyScores[K - 1]
+        free(decoyScores)
+    # gather and sort the candidate region
+    candidates = <psm *> malloc(max(n, 1) * sizeof(psm))
+    if candidates == NULL:
+        return -1
+    m = 0
+    for i in range(n):
+        if scores[i] > cutoff:
+            candidates[m].score = scores[i]
+            candidates[m].index = i
+            m += 1
+    stdsort(candidates, candidates + m, psmGreater)
+    for i in range(m):
+        if labels[candidates[i].index] == 1:
+            n_w_ge_w += 1
+        else:
+            n_z_ge_w += 1
+        if i == m - 1 or candidates[i].score != candidates[i+1].score:
+            if n_z_ge_w / max(1., n_w_ge_w) <= thresh:
+                numPassing = <Py_ssize_t> n_w_ge_w
+    free(candidates)
+    return numPassing
+
+cdef void scanGroups(psm *a, Py_ssize_t start, Py_ssize_t count, Py_ssize_t step, const int[::1] labels,
+                     double thresh, double *n_z_ge_w, double *n_w_ge_w, Py_ssize_t *numPassing) nogil:
+    """ Continue the FDR scan over count sorted PSMs a[start], a[start + step], ..., updating the running
+        decoy and target counts, and the number of targets at the last group end with FDR <= thresh
+    """
+    cdef Py_ssize_t k, p
+    for k in range(count):
+        p = start + k * step
+        if labels[a[p].index] == 1:
+            n_w_ge_w[0] += 1
+        else:
+            n_z_ge_w[0] += 1
+        if k == count - 1 or a[p].score != a[p + step].score:
+            if n_z_ge_w[0] / max(1., n_w_ge_w[0]) <= thresh:
+                numPassing[0] = <Py_ssize_t> n_w_ge_w[0]
+
+cdef void countColumnTargetsAtQ(const floating[:, :] X, const Py_ssize_t[::1] rows, const int[::1] labels,
+                                Py_ssize_t j, double thresh, int skipDecoysPlusOne, Py_ssize_t *counts) nogil:
+    """ Number of targets with q-value <= thresh when scoring PSMs by column j of X (written to counts[0])
+        and by the negated column (written to counts[1]).
+
+        As in countTargetsAtQ(), only PSMs scoring above the K-th highest decoy score can pass for the
+        column, and, likewise, only PSMs scoring below the K-th lowest decoy score can pass for the negated
+        column.  The union of both candidate regions is sorted once; the column is scanned from the top
+        and the negated column in the reverse order, from the bottom.  Equal scores form a single group
+        in both orders, so counts match numTargetsAtQ().  Columns with NaN scores (ordered last in both
+        cases) are fully sorted.  Counts are set to -1 if out of memory
+    """
+    cdef Py_ssize_t n = rows.shape[0]
+    cdef Py_ssize_t i, m = 0, numTop = 0, numBottom = 0, numNan = 0, numTargets = 0, numDecoys, K
+    cdef double c = 0. if skipDecoysPlusOne else 1.
+    cdef double n_z_ge_w, n_w_ge_w
+    cdef double hiCut = -1. / 0.
+    cdef double loCut = 1. / 0.
+    cdef double score
+    cdef bint fullSort = True
+    cdef double *decoyScores
+    cdef psm *allScores
+    counts[0] = 0
+    counts[1] = 0
+    for i in range(n):
+        if labels[i] == 1:
+            numTargets += 1
+    numDecoys = n - numTargets
+    if not (thresh < 1.): # all q-values are at most 1
+        counts[0] = numTargets
+        counts[1] = numTargets
+        return
+    K = <Py_ssize_t> floor(thresh * max(1, numTargets) - c) + 2
+    if K <= 0:
+        return
+    allScores = <psm *> malloc(max(n, 1) * sizeof(psm))
+    decoyScores = <double *> malloc(max(numDecoys, 1) * sizeof(double))
+    if allScores == NULL or decoyScores == NULL:
+        free(allScores)
+        free(decoyScores)
+        counts[0] = -1
+        counts[1] = -1
+        return
+    for i in range(n):
+        score = X[rows[i], j]
+        allScores[i].score = score
+        allScores[i].index = i
+        if isnan(score):
+            numNan += 1
+        elif labels[i] != 1:
+            decoyScores[m] = score
+            m += 1
+    if numNan == 0 and K <= numDecoys:
+        nth_element(decoyScores, decoyScores + numDecoys - K, decoyScores + numDecoys)
+        hiCut = decoyScores[numDecoys - K]
+        nth_element(decoyScores, decoyScores + K - 1, decoyScores + numDecoys)
+        loCut = decoyScores[K - 1]
+        fullSort = not (loCut <= hiCut) # candidate regions overlap
+    if not fullSort:
+        m = 0
+        for i in range(n):
+            if allScores[i].score > hiCut:
+                numTop += 1
+            elif allScores[i].score < loCut:
+                numBottom += 1
+            else:
+                continue
+            allScores[m] = allScores[i]
+            m += 1
+    else:
+        m = n
+        numTop = n - numNan
+        numBottom = n - numNan
+    free(decoyScores)
+    stdsort(allScores, allScores + m, psmGreater)
+    # scores: the top candidates (all PSMs, including NaN scores, if fully sorted)
+    n_z_ge_w = c
+    n_w_ge_w = 0.
+    scanGroups(allScores, 0, n if fullSort else numTop, 1, labels, thresh, &n_z_ge_w, &n_w_ge_w, &counts[0])
+    # negated scores: the bottom candidates in reverse order (followed by NaN scores, if fully sorted)
+    n_z_ge_w = c
+    n_w_ge_w = 0.
+    scanGroups(allScores, m - numNan - 1, numBottom, -1, labels, thresh, &n_z_ge_w, &n_w_ge_w, &counts[1])
+    if fullSort:
+        scanGroups(allScores, n - numNan, numNan, 1, labels, thresh, &n_z_ge_w, &n_w_ge_w, &counts[1])
+    free(allScores)
+
+cdef void countAllColumnsTargetsAtQ(const floating[:, :] X, const Py_ssize_t[::1] rows, const int[::1] labels,
+                                    double thresh, int skipDecoysPlusOne, Py_ssize_t[:, ::1] counts, int numThreads) nogil:
+    cdef Py_ssize_t j
+    for j in prange(X.shape[1], num_threads = numThreads, schedule = 'dynamic'):
+        countColumnTargetsAtQ(X, rows, labels, j, thresh, skipDecoysPlusOne, &counts[j, 0])
+
+#########################################################
+#########################################################
+################### Python interface
+#########################################################
+#########################################################
+def asLabels(labels):
+    """ Return labels as a contiguous int32 array, copying only if necessary
+    """
+    labels = np.ravel(labels)
+    if labels.dtype != np.int32:
+        labels = labels.astype(np.int32)
+    return np.ascontiguousarray(labels)
+
+def asScoresLabels(scores, labels):
+    """ Return scores and labels as contiguous float64 and int32 arrays, copying only if necessary
+    """
+    scores = np.ascontiguousarray(np.ravel(scores), dtype = np.float64)
+    labels = asLabels(labels)
+    assert len(scores)==len(labels), "Number of input scores does not match number of labels for q-value calculation"
+    return scores, labels
+
+def argsortScores(scores):
+    """ Stable descending sort order of a contiguous float64 array of scores
+    """
+    cdef Py_ssize_t[::1] order = np.empty(len(scores), dtype = np.intp)
+    cdef const double[::1] s = scores
+    cdef int ret
+    with nogil:
+        ret = argsortDescending(s, order)
+    if ret:
+        raise MemoryError()
+    return np.asarray(order)
+
+def checkPi0(pi0):
+    """ Return pi0, the estimated fraction of incorrect target PSMs, as a float in [0, 1]
+    """
+    pi0 = float(pi0)
+    if not (0. <= pi0 <= 1.):
+        raise ValueError('pi0 must be in [0, 1], got {}'.format(pi0))
+    return pi0
+
+def sortedQvalues(scores, labels, skipDecoysPlusOne = False, order = None, pi0 = 1.):
+    """ Returns order, the stable descending sort order of scores, and qvals, the q-values of
+        the PSMs in that order.  scores and labels must be as returned by asScoresLabels()
+
+        If order is given, it is assumed to sort scores and is not recomputed.  If pi0 < 1,
+        mix-max q-values are returned.
+    """
+    cdef double p0 = checkPi0(pi0)
+    if order is None:
+        order = argsortScores(scores)
+    qvals = np.empty(len(scores), dtype = np.float64)
+    cdef const double[::1] s = scores
+    cdef const int[::1] l = labels
+    cdef const Py_ssize_t[::1] o = order
+    cdef double[::1] q = qvals
+    cdef int sdpo = 1 if skipDecoysPlusOne else 0
+    with nogil:
+        qvaluesSorted(s, l, o, sdpo, p0, q)
+    return order, qvals
+
+def calcQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, verb = -1, pi0 = 1.):
+    """ Returns the indices of targets and decoys such that q <= thresh (in descending order of score),
+        and the q-values of all PSMs in their original order.
+
+        For pi0 < 1, e.g., as returned by estimatePi0(), mix-max q-values are computed.  This requires
+        target and decoy PSMs from separate searches, i.e., PSMs which have not undergone target-decoy
+        competition.
+    """
+    scores, labels = asScoresLabels(scores, labels)
+    order, qvals = sortedQvalues(scores, labels, skipDecoysPlusOne, pi0 = pi0)
+    passing = order[:numPassing(qvals, thresh)]
+    isTarget = labels[passing] == 1
+    originalOrderQvals = np.empty_like(qvals)
+    originalOrderQvals[order] = qvals
+    return passing[isTarget], passing[~isTarget], originalOrderQvals
+
+def numTargetsAtQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, pi0 = 1.):
+    """ Returns the number of targets with q-value <= thresh, i.e., len(calcQ(scores, labels, thresh, skipDecoysPlusOne, pi0 = pi0)[0]),
+        sorting only the PSMs which may pass the threshold (see countTargetsAtQ).  Mix-max q-values
+        (pi0 < 1) depend on all decoy scores, so all PSMs are sorted in that case.
+    """
+    scores, labels = asScoresLabels(scores, labels)
+    if checkPi0(pi0) < 1.:
+        return len(calcQ(scores, labels, thresh, skipDecoysPlusOne, pi0 = pi0)[0])
+    cdef const double[::1] s = scores
+    cdef const int[::1] l = labels
+    cdef Py_ssize_t count
+    cdef double t = thresh
+    cdef int sdpo = 1 if skipDecoysPlusOne else 0
+    with nogil:
+        count = countTargetsAtQ(s, l, t, sdpo)
+    if count == -1:
+        raise MemoryError()
+    if count == -2: # NaN scores, fall back to sorting all PSMs
+        return len(calcQ(scores, labels, thresh, skipDecoysPlusOne)[0])
+    return count
+
+def numTargetsAtQColumns(X, labels, thresh = 0.01, skipDecoysPlusOne = False, rows = None, numThreads = 1):
+    """ Returns an array, counts, of shape (number of columns of X, 2), where counts[j, 0] and counts[j, 1]
+        are the number of targets with q-value <= thresh when scoring PSMs by X[:, j] and -X[:, j], respectively.
+
+        All columns are evaluated in a single native call, in parallel over numThreads OpenMP threads.
+        X may be float32 or float64 (other types are converted), and need not be contiguous.  If rows is
+        given, only rows X[rows] are scored, without copying them, and labels correspond to these rows.
+    """
+    X = np.asarray(X)
+    if X.ndim != 2:
+        raise ValueError('X must be a 2D matrix')
+    if X.dtype != np.float32 and X.dtype != np.float64:
+        X = X.astype(np.float64)
+    if rows is None:
+        rows = np.arange(X.shape[0], dtype = np.intp)
+    rows = np.ascontiguousarray(rows, dtype = np.intp)
+    labels = asLabels(labels)
+    assert len(rows)==len(labels), "Number of input scores does not match number of labels for q-value calculation"
+    counts = np.zeros((X.shape[1], 2), dtype = np.intp)
+    cdef const Py_ssize_t[::1] r = rows
+    cdef const int[::1] l = labels
+    cdef Py_ssize_t[:, ::1] c = counts
+    cdef const float[:, :] Xf
+    cdef const double[:, :] Xd
+    cdef double t = thresh
+    cdef int sdpo = 1 if skipDecoysPlusOne else 0
+    cdef int threads = max(1, numThreads)
+    if X.dtype == np.float32:
+        Xf = X
+        with nogil:
+            countAllColumnsTargetsAtQ(Xf, r, l, t, sdpo, c, threads)
+    else:
+        Xd = X
+        with nogil:
+            countAllColumnsTargetsAtQ(Xd, r, l, t, sdpo, c, threads)
+    if (counts < 0).any():
+        raise MemoryError()
+    return counts
+
+def calcQAndNumIdentified(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, verb = -1, pi0 = 1.):
+    """ Returns q-values and the number of identified targets at each q-value, in descending order of score
+    """
+    scores, labels = asScoresLabels(scores, labels)
+    order, qvals = sortedQvalues(scores, labels, skipDecoysPlusOne, pi0 = pi0)
+    return qvals, np.cumsum(labels[order] == 1)
+
+def numIdentifiedAtQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, verb = -1, pi0 = 1.):
+    """ Returns the number of identified targets at each PSM with q-value <= thresh, in descending order of score
+    """
+    scores, labels = asScoresLabels(scores, labels)
+    order, qvals = sortedQvalues(scores, labels, skipDecoysPlusOne, pi0 = pi0)
+    return np.cumsum(labels[order[:numPassing(qvals, thresh)]] == 1)
+
+def qMedianDecoyScore(scores, labels, thresh = 0.01, skipDecoysPlusOne = False):
+    """ Returns the minimal score which achieves the specified threshold and the
+        median decoy score from the set
+    """
+    scores, labels = asScoresLabels(scores, labels)
+    order, qvals = sortedQvalues(scores, labels, skipDecoysPlusOne)
+    # Calculate minimum score which achieves q-value thresh
+    u = scores[order[max(0, numPassing(qvals, thresh) - 1)]]
+    # find median decoy score
+    d = scores[order[0]] + 1.
+    dScores = np.sort(scores[labels != 1])
+    if len(dScores):
+        d = dScores[len(dScores) // 2]
+    return u, d
+
+def estimatePi0(scores, labels, numBoot = 100, maxBootSize = 1000, numLambda = 100, maxLambda = 0.5, seed = 1):
+    """ Estimate pi0, the fraction of target PSMs which are incorrect, for mix-max q-values.
+
+        Target p-values are the fraction of decoys scoring at least as high (the decoys being a
+        sample of the null distribution, from a separate search).  For each lambda in a grid over
+        [0, maxLambda), pi0(lambda) = #{p > lambda} / ((1 - lambda) * #targets), and the lambda with
+        the smallest bootstrapped mean squared error to min_lambda pi0(lambda) is selected, as in
+        Storey et al., "Strong control, conservative point estimation and simultaneous conservative
+        consistency of false discovery rates: a unified approach".  All bootstrap samples are
+        evaluated at once.  Returns 1 if there are no target or no decoy PSMs.
+    """
+    scores, labels = asScoresLabels(scores, labels)
+    isTarget = labels == 1
+    decoyScores = np.sort(scores[~isTarget])
+    targetScores = scores[isTarget]
+    if not len(decoyScores) or not len(targetScores):
+        return 1.
+    pvals = np.sort((len(decoyScores) - np.searchsorted(decoyScores, targetScores, side = 'left')) / float(len(decoyScores)))
+    lambdas = np.arange(numLambda) * (maxLambda / numLambda)
+    # pi0(lambda) for each row of sorted p-values
+    def pi0s(sortedP):
+        numAbove = sortedP.shape[1] - np.stack([np.searchsorted(row, lambdas, side = 'right') for row in sortedP])
+        return numAbove / ((1. - lambdas) * sortedP.shape[1])
+    estimates = pi0s(pvals[np.newaxis, :])[0]
+    minPi0 = estimates.min()
+    rng = np.random.RandomState(seed)
+    bootSize = min(len(pvals), maxBootSize)
+    boot = np.sort(pvals[rng.randint(len(pvals), size = (numBoot, bootSize))], axis = 1)
+    mse = ((pi0s(boot) - minPi0) ** 2).mean(axis = 0)
+    return float(min(max(estimates[np.argmin(mse)], 0.), 1.))
+
+#########################################################
+#########################################################
+################### Repeated evaluation over fixed labels
+#########################################################
+#########################################################
+cdef class QValueEvaluator:
+    """ Q-value evaluation for repeated calls on the same labels, e.g., over the validation epochs
+        of DNN training.
+
+        The labels are converted once, and the sort order of the previous call is kept.  New scores
+        are permuted by this order and re-sorted with an adaptive merge sort, which runs in near-linear
+        time when scores change only slightly between calls (or are negated).  Results are identical
+        to those of the module level functions.
+    """
+    cdef readonly object labels
+    cdef object order
+
+    def __init__(self, labels):
+        _, self.labels = asScoresLabels(np.zeros(len(labels)), labels)
+        self.order = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def sort(self, scores):
+        """ Returns scores as a contiguous float64 array and their stable descending sort order
+        """
+        scores, _ = asScoresLabels(scores, self.labels)
+        if self.order is None:
+            self.order = argsortScores(scores)
+            return scores, self.order
+        order = np.empty(len(scores), dtype = np.intp)
+        cdef const double[::1] s = scores
+        cdef const Py_ssize_t[::1] prev = self.order
+        cdef Py_ssize_t[::1] o = order
+        cdef int ret
+        with nogil:
+            ret = resortDescending(s, prev, o)
+        if ret:
+            raise MemoryError()
+        self.order = order
+        return scores, order
+
+    def sortedQvalues(self, scores, skipDecoysPlusOne = False, pi0 = 1.):
+        scores, order = self.sort(scores)
+        return sortedQvalues(scores, self.labels, skipDecoysPlusOne, order, pi0)
+
+    def calcQ(self, scores, thresh = 0.01, skipDecoysPlusOne = False, pi0 = 1.):
+        """ As calcQ()
+        """
+        order, qvals = self.sortedQvalues(scores, skipDecoysPlusOne, pi0)
+        passing = order[:numPassing(qvals, thresh)]
+        isTarget = self.labels[passing] == 1
+        originalOrderQvals = np.empty_like(qvals)
+        originalOrderQvals[order] = qvals
+        return passing[isTarget], passing[~isTarget], originalOrderQvals
+
+    def numTargetsAtQ(self, scores, thresh = 0.01, skipDecoysPlusOne = False, pi0 = 1.):
+        """ Number of targets with q-value <= thresh, i.e., len(calcQ(scores, thresh, skipDecoysPlusOne, pi0)[0]).
+            Uses the partial selection kernel of numTargetsAtQ(), so the stored sort order is not updated.
+        """
+        if checkPi0(pi0) < 1.:
+            return len(self.calcQ(scores, thresh, skipDecoysPlusOne, pi0)[0])
+        return numTargetsAtQ(scores, self.labels, thresh, skipDecoysPlusOne)
+
+    def numIdentifiedAtQ(self, scores, thresh = 0.01, skipDecoysPlusOne = False, pi0 = 1.):
+        """ As numIdentifiedAtQ()
+        """
+        order, qvals = self.sortedQvalues(scores, skipDecoysPlusOne, pi0)
+        return np.cumsum(self.labels[order[:numPassing(qvals, thresh)]] == 1)
@@ -19,10 +19,10 @@ import proteoTorch.torch_utils as torch_utils
 import proteoTorch.mini_utils as mini_utils
 
 try:
-    from proteoTorch_qvalues import calcQ, calcQAndNumIdentified
+    from proteoTorch_qvalues_np import calcQ, calcQAndNumIdentified, numTargetsAtQ
 except:
     print("Cython q-value not found, loading strictly python q-value library")
-    from proteoTorch.pyfiles.qvalsBase import calcQ, calcQAndNumIdentified
+    from proteoTorch.pyfiles.qvalsBase import calcQ, calcQAndNumIdentified, numTargetsAtQ
 
 _DEFAULT_HYPERPARAMS = {'dnn_optimizer': 'adam', 'batchsize': 5000, 'dnn_num_epochs': 2000, 
                         'dnn_lr': 0.001, 'l2_reg_const':0,
@@ -85,38 +85,38 @@ class label_smoothing_loss(nn.Module):
         self.device = device
         self.amount = class_confidence_values
         self.num_classes = len(class_confidence_values)
-        self._false_positive_loss_factor = false_positive_loss_factor
+        self._false_positive_loss_factor = float(false_positive_loss_factor)
         
-        self.soft_distribs = np.zeros((self.num_classes, self.num_classes), 'float32')
-        self.class_weights = np.asarray(class_weights, 'float32')
+        soft_distribs = np.zeros((self.num_classes, self.num_classes), 'float32')
         for i in range(self.num_classes):
             other_amount = (1 - self.amount[i]) / (self.num_classes - 1)
-            self.soft_distribs[i, :] = other_amount
-            self.soft_distribs[i, i] = self.amount[i]
+            soft_distribs[i, :] = other_amount
+            soft_distribs[i, i] = self.amount[i]
+        # held on the device, so that the loss never synchronizes with the host (and can be scripted, e.g. torch.jit.script)
+        self.register_buffer('soft_distribs', torch_utils.numpy_to_pytorch_tensor(soft_distribs, device=device))
+        self.register_buffer('class_weights', torch_utils.numpy_to_pytorch_tensor(np.asarray(class_weights, 'float32'), device=device))
         
     def forward(self, output, labels):
         """
         output (float) shape: (batch_size, num_classes)
         labels (long) shape: (batch_size,)
         """
-        labels = torch_utils.torch_tensor_to_np(labels)
         weights = self.class_weights[labels]
-        soft_labels = np.zeros((len(labels), self.num_classes), 'float32')
-        soft_labels[np.arange(len(labels)), :] = self.soft_distribs[labels]
+        soft_labels = self.soft_distribs[labels]
         softm_pred = F.log_softmax(output, 1)
-        KL_loss = F.kl_div(softm_pred, torch_utils.numpy_to_pytorch_tensor(soft_labels, device=self.device), reduction='none').mean(1) #'batchmean')
+        KL_loss = F.kl_div(softm_pred, soft_labels, reduction='none').mean(1) #'batchmean')
         if self._false_positive_loss_factor != 1:
-            idx = ((torch_utils.torch_tensor_to_np(labels) == 0) * (torch_utils.torch_tensor_to_np(softm_pred)[:, 1] >= -0.693147180559)).astype(np.bool)
-            weights[idx] *=  self._false_positive_loss_factor
+            # false positives: decoys (class 0) predicted as class 1 with probability >= 0.5
+            idx = (labels == 0) & (softm_pred.detach()[:, 1] >= -0.693147180559)
             # loss_adjustment_others is to keep the overall loss at a ~fixed average so that the LR does not neet to be adjusted
-            n = np.sum(idx)
-            loss_adjustment_others = (len(weights) - n * self._false_positive_loss_factor) / (len(weights) - n)
-            weights[idx==0] *= loss_adjustment_others
+            n = idx.sum()
+            loss_adjustment_others = (len(labels) - n * self._false_positive_loss_factor) / (len(labels) - n)
+            weights = torch.where(idx, weights * self._false_positive_loss_factor, weights * loss_adjustment_others)
 #        if 0:
 #            #un-weighted loss'
 #            return (tmp).sum() / len(labels)
 #        else:
-        return (torch_utils.numpy_to_pytorch_tensor(weights, device=self.device) * KL_loss).sum() / len(labels)
+        return (weights * KL_loss).sum() / len(labels)
 
 
 
@@ -146,11 +146,41 @@ class MLP_model(nn.Module):
         for x in self._layers_MLP:
             params.extend(x.parameters())
         torch_utils.register_params_in_model(self, params, 'MLP_weights') 
+        self._generator = None
+
+    def reset_parameters(self, generator):
+        '''
+        Re-initializes all weights as nn.Linear does, drawing them from the given torch.Generator.
+        '''
+        with torch.no_grad():
+            for lay in self._layers_MLP + [self._layer_output]:
+                nn.init.kaiming_uniform_(lay.weight, a=np.sqrt(5), generator=generator)
+                bound = 1. / np.sqrt(lay.weight.shape[1])
+                nn.init.uniform_(lay.bias, -bound, bound, generator=generator)
+
+    def set_generator(self, generator):
+        '''
+        Draws dropout masks from the given torch.Generator (on the model's device) instead of torch's global RNG; None reverts to the latter.
+        '''
+        self._generator = generator
+
+    def stacked_ensemble(self, weights_list, device):
+        '''
+        Returns an ensemble (torch_utils.Stacked_MLP_Ensemble) averaging the predictions of this model 
+        with each of the given weights (state dicts), evaluated in a single pass over the data.
+        '''
+        names = self._all_weights
+        layer_param_names = list(zip(names[0::2], names[1::2])) + [('_layer_output.weight', '_layer_output.bias')]
+        return torch_utils.Stacked_MLP_Ensemble(weights_list, layer_param_names, device, 
+                                                'sigmoid' if self._use_sigmoid_outputs else 'softmax', model=self)
 
     def __call__(self, x):
         for lay in self._layers_MLP:
             x = torch.relu(lay(x))
-            x = self.dropout(x)
+            if self._generator is not None and self.training and self.dropout.p > 0:
+                x = x * torch.empty_like(x).bernoulli_(1. - self.dropout.p, generator=self._generator) / (1. - self.dropout.p)
+            else:
+                x = self.dropout(x)
         x = self._layer_output(x)
         if self._use_sigmoid_outputs:
             return torch.sigmoid(x)
@@ -158,10 +188,11 @@ class MLP_model(nn.Module):
             return x if self.training==True else F.softmax(x, dim=1)
 
 class ModelWrapper_like_sklearn(object):
-    def __init__(self, model, device, batchsize=500):
+    def __init__(self, model, device, batchsize=500, num_threads=1):
         self._model = model
         self._device = device
         self._batchsize = batchsize
+        self._num_threads = num_threads
     
     def get_single_model(self):
         '''
@@ -170,10 +201,26 @@ class ModelWrapper_like_sklearn(object):
         return self._model
     
     def decision_function(self, X):
-        return torch_utils.run_model_on_data(X, self._model, self._device, self._batchsize)[:,1]
+        return torch_utils.run_model_on_data(X, self._model, self._device, self._batchsize, self._num_threads)[:,1]
 
 
 
+def trainingDevice(hparams):
+    """
+    Device DNNs are trained on: GPU <dnn_gpu_id> if CUDA is available, otherwise the CPU.
+    """
+    return torch.device("cuda:"+str(hparams.get('dnn_gpu_id', 0)) if torch.cuda.is_available() else "cpu")
+
+
+def inferenceThreads(hparams, device):
+    """
+    Number of threads scoring blocks of PSMs with a trained model: --numThreads on the CPU, 1 on a GPU.
+    """
+    if device.type != 'cpu':
+        return 1
+    return max(1, hparams.get('numThreads', 1))
+
+
 def convert_labels(binary_labels):
     """
     input: list with two unique values, e.g. -1 and 1
@@ -196,14 +243,22 @@ def DNNSingleFold(thresh, kFold, train_features, train_labels, validation_Featur
     model:
         
         Pass None to create a new model or pass a model to fine-tune it
+
+    If hparams contains 'dnn_seed', the initial weights, minibatch order and dropout masks are drawn from torch
+    generators seeded with it rather than from torch's global RNG, so that CV folds trained concurrently are reproducible.
     """
     tmp_hparams = _DEFAULT_HYPERPARAMS.copy()
     tmp_hparams.update(hparams)
     hparams = tmp_hparams.copy()
-    DEVICE = torch.device("cuda:"+str(hparams['dnn_gpu_id']) if torch.cuda.is_available() else "cpu")
+    DEVICE = trainingDevice(hparams)
+    generator = None
+    if hparams.get('dnn_seed') is not None:
+        generator = torch.Generator(device=DEVICE).manual_seed(hparams['dnn_seed'])
     
     if model is None:
         model = MLP_model(num_input_channels=len(train_features[0]), number_of_classes = 2, **hparams)
+        if generator is not None:
+            model.reset_parameters(torch.Generator().manual_seed(hparams['dnn_seed']))
         model = model.to(DEVICE)
         print('DNNSingleFold: new model on device', DEVICE)
     else:
@@ -213,8 +268,11 @@ def DNNSingleFold(thresh, kFold, train_features, train_labels, validation_Featur
             else:
                 break
         print('DNNSingleFold: fine-tuning given model on device', DEVICE)
-    train_data = (np.asarray(train_features).astype('float32'), convert_labels(train_labels))
-    valid_data = (np.asarray(validation_Features).astype('float32'), convert_labels(validation_Labels))
+    single_model = model
+    single_model.set_generator(generator)
+    # no copy if the features are already float32
+    train_data = (np.asarray(train_features, dtype = 'float32'), convert_labels(train_labels))
+    valid_data = (np.asarray(validation_Features, dtype = 'float32'), convert_labels(validation_Labels))
     
     if 0:
         data_name = hparams['pin'].split('/')[-2]
@@ -246,13 +304,15 @@ def DNNSingleFold(thresh, kFold, train_features, train_labels, validation_Featur
             batchsize=hparams['batchsize'], num_epochs=hparams['dnn_num_epochs'], train=True, initial_lr=hparams['dnn_lr'], 
             total_lr_decay=hparams['dnn_lr_decay'], verbose=1, use_early_stopping=True, 
             validation_metric=val_metric, validation_check_interval=20,
-            snapshot_ensemble_count=hparams['snapshot_ensemble_count'])
+            snapshot_ensemble_count=hparams['snapshot_ensemble_count'], num_threads=max(1, hparams.get('numThreads', 1)),
+            ensemble_early_stopping=hparams.get('dnn_ensemble_early_stopping', False), generator=generator)
+    single_model.set_generator(None)
     # grab predictions for class 1
     test_pred = torch_utils.run_model_on_data(valid_data[0], model, DEVICE, 5000)[:, 1]
         
-    tp, _, _ = calcQ(test_pred, validation_Labels, thresh, skipDecoysPlusOne=True)
-    print("DNN CV finished for fold %d: %d targets identified" % (kFold, len(tp)))
-    return test_pred, len(tp), ModelWrapper_like_sklearn(model, DEVICE)
+    numTp = numTargetsAtQ(test_pred, validation_Labels, thresh, skipDecoysPlusOne=True)
+    print("DNN CV finished for fold %d: %d targets identified" % (kFold, numTp))
+    return test_pred, numTp, ModelWrapper_like_sklearn(model, DEVICE, num_threads=inferenceThreads(hparams, DEVICE))
 
 
 def saveDNNSingleFold(model, kFold, output_dir=None, filebase = 'dnn_weights_fold'):
@@ -299,17 +359,17 @@ def loadDNNSingleFold(num_features, kFold, hparams = {}, input_dir=None):
     tmp_hparams = _DEFAULT_HYPERPARAMS.copy()
     tmp_hparams.update(hparams)
     hparams = tmp_hparams.copy()
-    DEVICE = torch.device("cuda:"+str(hparams['dnn_gpu_id']) if torch.cuda.is_available() else "cpu")
+    DEVICE = trainingDevice(hparams)
     
     model = MLP_model(num_input_channels=num_features, number_of_classes = 2, **hparams)
     model = model.to(DEVICE)
     if input_dir is  None:
-        return ModelWrapper_like_sklearn(model, DEVICE)
+        return ModelWrapper_like_sklearn(model, DEVICE, num_threads=inferenceThreads(hparams, DEVICE))
 
     print('DNNSingleFold: loading previously trained weights', DEVICE)
     params = torch.load(path.join(input_dir, "dnn_weights_fold{}.pt".format(kFold)))
     torch_utils.set_model_params(model, params)
-    return ModelWrapper_like_sklearn(model, DEVICE)
+    return ModelWrapper_like_sklearn(model, DEVICE, num_threads=inferenceThreads(hparams, DEVICE))
 
 if __name__=='__main__':
     TEST_X = label_smoothing_loss(torch.device("cpu"), [1,1], false_positive_loss_factor=2)
@@ -6,12 +6,13 @@ Licensed under the Open Software License version 3.0
 See COPYING or http://opensource.org/licenses/OSL-3.0
 """
 import time
+import threading
 import numpy as np
 from os import makedirs as _makedirs
 from os.path import exists as _exists
 
 
-from proteoTorch_qvalues import calcQAndNumIdentified, numIdentifiedAtQ
+from proteoTorch_qvalues_np import calcQAndNumIdentified, numIdentifiedAtQ, QValueEvaluator
 # try:
 #    from proteoTorch_qvalues import calcQAndNumIdentified, numIdentifiedAtQ
 # except:
@@ -124,10 +125,19 @@ def AUC_up_to_tol_singleQ(qTol=0.002):
         
         function with inputs: <predictions>, <labels>
     """
+    # Called every few epochs, or for each candidate of a greedy ensemble selection, on the same 
+    # validation labels; keep a q-value evaluator which reuses the sort order of the previous 
+    # predictions.  Evaluators are kept per thread, so that the function is thread-safe
+    cache = threading.local()
     def fn(predictions, labels):
-        if labels.ndim==2:
-            labels = np.argmax(labels, axis=1)
-        ps, _ = numIdentifiedAtQ_v2(predictions, labels, qTol)
+        if getattr(cache, 'labels', None) is not labels:
+            cache.labels = labels
+            if labels.ndim==2:
+                labels = np.argmax(labels, axis=1)
+            cache.evaluator = QValueEvaluator(labels)
+        if predictions.ndim==2:
+            predictions = predictions[:,1] #softmax() already applied
+        ps = np.asarray(cache.evaluator.numIdentifiedAtQ(predictions, qTol), 'float32')
         auc = np.trapz(ps)
         return auc
     return fn
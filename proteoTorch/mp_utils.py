@@ -0,0 +1,174 @@
+"""
+Written by John Halloran <jthalloran@ucdavis.edu>
+
+Copyright (C) 2020 John Halloran
+Licensed under the Open Software License version 3.0
+See COPYING or http://opensource.org/licenses/OSL-3.0
+
+Shared-memory data plane and persistent worker pool for multiprocessing.
+
+Arrays read by worker processes (e.g., the training and validation matrices of each CV fold
+during the SVM grid search) are copied once into multiprocessing.shared_memory blocks.  Tasks
+are passed a small descriptor (block names, shapes and dtypes), from which workers map the
+arrays without copying them.  Unlike module globals inherited through fork copy-on-write, this
+works under all start methods (fork, spawn and forkserver), and each array is held in memory
+once regardless of the number of workers.
+"""
+import os
+import atexit
+import multiprocessing as mp
+import numpy as np
+from multiprocessing import shared_memory
+
+#########################################################
+#########################################################
+################### Shared arrays
+#########################################################
+#########################################################
+def gatherRows(a, rows, out, blockRows = 1 << 16):
+    """ Copy rows a[rows] into out, converting them to out's dtype.  Rows are gathered in blocks,
+        so no full-size temporary is created when the dtypes differ
+    """
+    for i in range(0, len(rows), blockRows):
+        out[i:i + blockRows] = a[rows[i:i + blockRows]]
+    return out
+
+class SharedArrays(object):
+    """ NumPy arrays placed in shared memory, keyed by (hashable) names.
+
+        The creating process owns the blocks and must call release() (or use the object as a
+        context manager) to free them.  Workers map the arrays with attachSharedArrays(descriptor()).
+    """
+    _numCreated = 0
+
+    def __init__(self):
+        SharedArrays._numCreated += 1
+        # identifies this collection in worker processes
+        self.token = '%d.%d' % (os.getpid(), SharedArrays._numCreated)
+        self.blocks = {}
+        self.arrays = {}
+
+    def publish(self, key, a, rows = None, dtype = None):
+        """ Copy a, or rows a[rows] if rows is given, to shared memory under key, converted to dtype if 
+            given.  Returns the shared copy
+        """
+        a = np.asarray(a)
+        dtype = a.dtype if dtype is None else np.dtype(dtype)
+        shape = a.shape if rows is None else (len(rows),) + a.shape[1:]
+        self.remove(key)
+        shm = shared_memory.SharedMemory(create = True, size = max(1, int(np.prod(shape)) * dtype.itemsize))
+        out = np.ndarray(shape, dtype = dtype, buffer = shm.buf)
+        # registered before copying, so that the block is freed by release() even if the copy fails
+        self.blocks[key] = shm
+        self.arrays[key] = out
+        if rows is None:
+            out[...] = a
+        else:
+            gatherRows(a, rows, out)
+        return out
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def descriptor(self):
+        """ Picklable description of the shared arrays, passed to worker processes
+        """
+        return (self.token, dict((k, (self.blocks[k].name, a.shape, a.dtype.str)) for k, a in self.arrays.items()))
+
+    def remove(self, key):
+        """ Free the shared array under key, if any
+        """
+        if key in self.blocks:
+            del self.arrays[key]
+            shm = self.blocks.pop(key)
+            shm.close()
+            shm.unlink()
+
+    def release(self):
+        """ Free all shared arrays
+        """
+        for key in list(self.blocks):
+            self.remove(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+def attachBlock(name):
+    """ Map an existing shared memory block, without registering it for cleanup by this
+        process (the block is unlinked by its creator)
+    """
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError: # track argument not available before Python 3.13; the resource tracker is shared with the creator
+        return shared_memory.SharedMemory(name = name)
+
+# Arrays mapped by this (worker) process, kept between tasks using the same collection
+_attached = {'token' : None, 'blocks' : [], 'arrays' : {}}
+
+def detachSharedArrays():
+    """ Unmap all arrays mapped by attachSharedArrays()
+    """
+    _attached['arrays'] = {}
+    for shm in _attached['blocks']:
+        try:
+            shm.close()
+        except BufferError: # still referenced, unmapped once garbage collected
+            pass
+    _attached['blocks'] = []
+    _attached['token'] = None
+
+def attachSharedArrays(descriptor):
+    """ Returns a dictionary mapping keys to the arrays described by descriptor (see SharedArrays.descriptor()).
+
+        The mapping is cached, so repeated tasks on the same collection map its blocks only once;
+        blocks of a previous collection are unmapped.  Workers must not modify the arrays.
+    """
+    token, entries = descriptor
+    if _attached['token'] != token:
+        detachSharedArrays()
+        for key, (name, shape, dtype) in entries.items():
+            shm = attachBlock(name)
+            _attached['blocks'].append(shm)
+            _attached['arrays'][key] = np.ndarray(shape, dtype = np.dtype(dtype), buffer = shm.buf)
+        _attached['token'] = token
+    return _attached['arrays']
+
+#########################################################
+#########################################################
+################### Persistent worker pool
+#########################################################
+#########################################################
+_pool = None
+_poolArgs = None
+
+def getWorkerPool(numProcesses, startMethod = None, initializer = None, initargs = ()):
+    """ Returns a pool of numProcesses worker processes, created on first use and reused by later
+        calls with the same arguments (e.g., over all training iterations), rather than starting
+        new processes for every batch of tasks.
+
+        startMethod is one of mp.get_all_start_methods() (fork, spawn or forkserver), or None for
+        the platform default.  initializer(*initargs) is called in each new worker.
+    """
+    global _pool, _poolArgs
+    args = (numProcesses, startMethod, initializer, initargs)
+    if _pool is not None and _poolArgs != args:
+        closeWorkerPool()
+    if _pool is None:
+        _pool = mp.get_context(startMethod).Pool(processes = numProcesses, initializer = initializer, initargs = initargs)
+        _poolArgs = args
+    return _pool
+
+def closeWorkerPool():
+    """ Shut down the persistent worker pool, if running
+    """
+    global _pool, _poolArgs
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+        _poolArgs = None
+
+atexit.register(closeWorkerPool)
@@ -0,0 +1,677 @@
+"""
+Written by John Halloran <jthalloran@ucdavis.edu>
+
+Copyright (C) 2020 John Halloran
+Licensed under the Open Software License version 3.0
+See COPYING or http://opensource.org/licenses/OSL-3.0
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import warnings
+import numpy as np
+from os.path import splitext
+
+# Number of bytes read per block when parsing PIN files
+_blockBytes = 1 << 24
+
+# Binary feature matrix cache, see load_pin_columns_cached()
+_cacheEnabled = False
+_cacheDir = None # None: per-user cache directory, see defaultCacheDir()
+_cacheMaxBytes = 20 * (1 << 30)
+_cacheVersion = 1
+
+def checkGzip_openfile(filename, mode = 'r'):
+    if splitext(filename)[1] == '.gz':
+        return gzip.open(filename, mode)
+    else:
+        return open(filename, mode)
+
+#########################################################
+#########################################################
+################### Compact string storage
+#########################################################
+#########################################################
+class StringTable(object):
+    """ Read-only table of the per-PSM string fields of a PIN file (PSM id, peptide, proteins).
+
+        All rows are stored in a single utf-8 byte buffer, with rows separated by newlines and
+        fields separated by tabs, plus an array of row end offsets.  Indexing a row returns
+        the list of its fields, i.e., the same as the row lists previously built by the
+        csv.DictReader parser, so that the table may be used wherever a list of per-PSM
+        string lists is expected.
+    """
+    def __init__(self, buf, ends, numFields):
+        self._buf = buf # uint8 array
+        self._ends = ends # int64 array, position of the newline terminating each row
+        self._numFields = numFields
+
+    @classmethod
+    def from_blocks(cls, blocks, numFields):
+        """ blocks - list of utf-8 encoded byte strings, each consisting of complete, newline terminated rows
+        """
+        bufs = [np.frombuffer(b, dtype = np.uint8) for b in blocks]
+        if len(bufs):
+            buf = np.concatenate(bufs)
+        else:
+            buf = np.zeros(0, dtype = np.uint8)
+        ends = np.flatnonzero(buf == 10).astype(np.int64)
+        return cls(buf, ends, numFields)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """ Return a new StringTable consisting of the rows of each of tables in turn
+        """
+        offsets = np.cumsum([0] + [len(t._buf) for t in tables[:-1]])
+        return cls(np.concatenate([t._buf for t in tables]),
+                   np.concatenate([t._ends + o for t, o in zip(tables, offsets)]).astype(np.int64), tables[0]._numFields)
+
+    def __len__(self):
+        return len(self._ends)
+
+    def _row(self, i):
+        if i < 0:
+            i += len(self._ends)
+        start = self._ends[i-1] + 1 if i > 0 else 0
+        row = self._buf[start:self._ends[i]].tobytes().decode('utf-8').rstrip('\r')
+        return row.split('\t')[:self._numFields]
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return self._row(int(i))
+        return self.take(i)
+
+    def __iter__(self):
+        for i in range(len(self._ends)):
+            yield self._row(i)
+
+    def take(self, inds):
+        """ Return a new StringTable consisting of the rows in inds (index array, list or slice)
+        """
+        inds = np.arange(len(self._ends))[inds]
+        starts = np.zeros(len(self._ends), dtype = np.int64)
+        starts[1:] = self._ends[:-1] + 1
+        s = starts[inds]
+        lens = self._ends[inds] - s + 1 # include newline
+        if not len(lens):
+            return StringTable(np.zeros(0, dtype = np.uint8), np.zeros(0, dtype = np.int64), self._numFields)
+        newEnds = np.cumsum(lens) - 1
+        # gather byte positions of each selected row
+        pos = np.arange(newEnds[-1] + 1, dtype = np.int64) - np.repeat(newEnds - lens + 1 - s, lens)
+        return StringTable(self._buf[pos], newEnds, self._numFields)
+
+    def column(self, j):
+        """ Return field j of every row as a list
+        """
+        return [r[j] for r in self]
+
+#########################################################
+#########################################################
+################### Columnar PIN parsing
+#########################################################
+#########################################################
+def parse_pin_header(headerInOrder):
+    """ Check that header fields follow the PIN schema and determine the column layout
+
+        Returns dictionary with keys:
+            featureNames - names of feature columns, in file order
+            featureCols - column indices of features, relative to the numeric block (see below)
+            labelCol, sidCol - column indices of Label and ScanNr, relative to the numeric block
+            expMassInd - column index of ExpMass in the header
+            peptideInd - column index of Peptide in the header. Fields 1,...,peptideInd-1 are the
+                         numeric block, parsed directly as floats
+            numStringFields - number of string fields per PSM, i.e., PSM id, Peptide, and all
+                              following header fields (proteins)
+    """
+    l = headerInOrder
+    # spectrum identification key for PIN files
+    # Note: this string must be stated exactly as the third header field
+    sidKey = "ScanNr"
+    if sidKey not in l:
+        raise ValueError("No %s field, exitting" % (sidKey))
+    expMassKey = "ExpMass"
+    if expMassKey not in l:
+        raise ValueError("No %s field, exitting" % (expMassKey))
+    if "Label" not in l:
+        raise ValueError("No Label field, exitting")
+    constKeys = [l[0]]
+    # Check label
+    if l[1].lower() == 'label':
+        constKeys.append(l[1])
+    # Exclude calcmass and expmass as features
+    constKeys += [sidKey, "CalcMass", expMassKey]
+    # Find peptide and protein ID fields
+    peptideInd = -1
+    for i, key in enumerate(l):
+        if key.lower() == "peptide":
+            peptideInd = i
+            break
+    if peptideInd < 0:
+        raise ValueError("No Peptide field, exitting")
+    for key in ["Label", sidKey, expMassKey]:
+        if l.index(key) > peptideInd:
+            raise ValueError("Field %s must precede the Peptide field, exitting" % (key))
+    constKeys = set(constKeys + l[peptideInd:]) # exclude these when reserializing data
+    featureNames = []
+    featureCols = []
+    for i in range(1, peptideInd): # keep order of keys intact
+        if l[i] not in constKeys:
+            featureNames.append(l[i])
+            featureCols.append(i - 1)
+    return {'featureNames' : featureNames,
+            'featureCols' : np.array(featureCols, dtype = np.intp),
+            'labelCol' : l.index("Label") - 1,
+            'sidCol' : l.index(sidKey) - 1,
+            'expMassInd' : l.index(expMassKey),
+            'peptideInd' : peptideInd,
+            'numStringFields' : 1 + len(l) - peptideInd}
+
+def _fieldBounds(buf, schema, lineOffset):
+    """ Locate the fields of every line in a block of complete, newline terminated PIN rows
+
+        Returns line start positions, newline positions and, for each line, the positions of its
+        first peptideInd tabs (matrix of shape (numLines, peptideInd))
+    """
+    peptideInd = schema['peptideInd']
+    newlines = np.flatnonzero(buf == 10)
+    tabs = np.flatnonzero(buf == 9)
+    starts = np.zeros(len(newlines), dtype = np.int64)
+    starts[1:] = newlines[:-1] + 1
+    firstTab = np.searchsorted(tabs, starts)
+    tabInds = firstTab[:, None] + np.arange(peptideInd)[None, :]
+    # lines with too few fields index past their newline, or past the last tab
+    bad = np.flatnonzero(tabInds[:, -1] >= len(tabs))
+    if not len(bad):
+        bad = np.flatnonzero(tabs[tabInds[:, -1]] > newlines)
+    if len(bad):
+        i = bad[0]
+        raise ValueError("Line %d has fewer than %d fields, exitting" % (lineOffset + i + 2, peptideInd + 1))
+    return starts, newlines, tabs[tabInds]
+
+def _regionMask(n, regionStarts, regionEnds):
+    """ Boolean mask of length n, true over the half-open intervals [regionStarts[i], regionEnds[i])
+    """
+    delta = np.zeros(n + 1, dtype = np.int32)
+    delta[regionStarts] += 1
+    delta[regionEnds] -= 1
+    return np.cumsum(delta[:-1], dtype = np.int8) > 0
+
+def _parseNumericBlock(buf, tabPos, newlines, header, lineOffset):
+    """ Parse the numeric fields (1,...,peptideInd-1) of every line in the block in a single call
+    """
+    numLines, peptideInd = tabPos.shape
+    numCols = peptideInd - 1
+    # blank out everything but the numeric fields, which are then whitespace delimited
+    numericMask = _regionMask(len(buf), tabPos[:, 0] + 1, tabPos[:, -1])
+    text = np.where(numericMask, buf, 32).astype(np.uint8).tobytes()
+    vals = None
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        try:
+            vals = np.fromstring(text, dtype = np.float64, sep = ' ')
+        except (ValueError, DeprecationWarning):
+            vals = None
+    if vals is not None and len(vals) == numLines * numCols:
+        return vals.reshape(numLines, numCols), numericMask
+    # Find the offending field to report
+    for i in range(numLines):
+        for j in range(numCols):
+            field = buf[tabPos[i, j] + 1:tabPos[i, j+1]].tobytes().decode('utf-8')
+            try:
+                float(field)
+            except ValueError:
+                raise ValueError("Could not convert field %s with value %s on line %d to float, exitting" % (header[j+1], field, lineOffset + i + 2))
+    raise ValueError("Malformed PIN rows between lines %d and %d, exitting" % (lineOffset + 2, lineOffset + numLines + 1))
+
+def _gatherStrings(buf, starts, ends):
+    """ Gather the byte ranges [starts[i], ends[i]) of buf into a unicode string array
+    """
+    lens = ends - starts
+    width = max(1, int(lens.max())) if len(lens) else 1
+    pos = starts[:, None] + np.arange(width)[None, :]
+    chars = np.where(np.arange(width)[None, :] < lens[:, None], buf[np.minimum(pos, len(buf) - 1)], 0).astype(np.uint8)
+    return chars.view('S%d' % width).ravel().astype('U%d' % width)
+
+def iter_pin_blocks(f, schema, header, blockBytes = _blockBytes):
+    """ Parse a PIN file opened in binary mode (positioned after the header) in blocks of roughly
+        blockBytes bytes.  All fields are located and parsed with vectorized operations over each block.
+
+        Yields, per block:
+            numeric - float64 matrix of the numeric fields of each row
+            strRows - utf-8 encoded, newline separated string fields (see StringTable)
+            expMasses - array of ExpMass strings
+    """
+    expMassInd = schema['expMassInd']
+    lineOffset = 0
+    carry = b''
+    while True:
+        chunk = f.read(blockBytes)
+        if not chunk:
+            if not carry.strip():
+                break
+            data = carry + b'\n' # final line missing its newline
+            carry = b''
+        else:
+            data = carry + chunk
+            lastNewline = data.rfind(b'\n')
+            if lastNewline < 0:
+                carry = data
+                continue
+            carry = data[lastNewline+1:]
+            data = data[:lastNewline+1]
+        if lineOffset == 0 and data.startswith(b'DefaultDirection'):
+            data = data[data.index(b'\n')+1:]
+            lineOffset += 1
+        # drop blank lines and carriage returns
+        data = data.replace(b'\r', b'')
+        while b'\n\n' in data:
+            data = data.replace(b'\n\n', b'\n')
+        data = data.lstrip(b'\n')
+        if not data:
+            continue
+        buf = np.frombuffer(data, dtype = np.uint8)
+        starts, newlines, tabPos = _fieldBounds(buf, schema, lineOffset)
+        numeric, numericMask = _parseNumericBlock(buf, tabPos, newlines, header, lineOffset)
+        # string fields: everything outside the numeric fields, i.e., psm id <tab> peptide <tab> proteins...
+        stringMask = ~numericMask
+        stringMask[tabPos[:, -1]] = False
+        strRows = buf[stringMask].tobytes()
+        expMasses = _gatherStrings(buf, tabPos[:, expMassInd-1] + 1, tabPos[:, expMassInd])
+        lineOffset += len(newlines)
+        yield numeric, strRows, expMasses
+
+def _grow(arr, minRows):
+    """ Reallocate the leading dimension of arr to hold at least minRows rows
+    """
+    newArr = np.empty((max(minRows, int(1.5 * arr.shape[0]) + 1),) + arr.shape[1:], dtype = arr.dtype)
+    newArr[:arr.shape[0]] = arr
+    return newArr
+
+def _keyGroupStarts(sids, expMassBits, labels):
+    """ Start of each run of equal (scan number, exp mass, label) keys in sorted arrays
+    """
+    if not len(sids):
+        return np.zeros(0, dtype = np.intp)
+    change = (sids[1:] != sids[:-1]) | (expMassBits[1:] != expMassBits[:-1]) | (labels[1:] != labels[:-1])
+    return np.flatnonzero(np.concatenate(([True], change)))
+
+class TopPsmTable(object):
+    """ Streaming reduction keeping only the top scoring PSM per (scan number, exp mass, label)
+        key while a PIN file is read.
+
+        Each block of PSMs is reduced to its best PSM per key, and the winners of all blocks are
+        collected in arrays (string fields in StringTables).  Collected winners are reduced with a
+        single lexsort over (scan number, exp mass, label, -score, row), keeping the first PSM of
+        each key, once the file has been read and whenever they outnumber compactRows and twice the
+        keys of the previous reduction, so that memory scales with the number of distinct keys rather
+        than the number of PSMs.  Ties are resolved in favor of the earliest PSM.  Output rows are
+        ordered by first occurrence of each key, with the exp mass string of that first occurrence.
+    """
+    def __init__(self, numFeatures, dtype = np.float64, loadFeatures = True, compactRows = 1 << 20):
+        self._loadFeatures = loadFeatures
+        self._numFeatures = numFeatures
+        self._dtype = dtype
+        self._compactRows = compactRows
+        self._parts = [] # reduced winners of each block, and of previous reductions
+        self._numCollected = 0
+        self._numReduced = 0
+
+    def __len__(self):
+        return len(self._reduce()['sids']) if self._parts else 0
+
+    def _reduceParts(self, parts):
+        """ Reduce the concatenation of parts to the best entry per key
+        """
+        e = {}
+        for k in parts[0]:
+            if k == 'strings':
+                e[k] = StringTable.concatenate([part[k] for part in parts])
+            elif k != 'X' or self._loadFeatures:
+                e[k] = np.concatenate([part[k] for part in parts])
+        keys = (e['labels'], e['expMassBits'], e['sids'])
+        order = np.lexsort((e['rows'], -e['scores']) + keys)
+        starts = _keyGroupStarts(e['sids'][order], e['expMassBits'][order], e['labels'][order])
+        best = order[starts]
+        # keys sort identically, so groups start at the same positions when ordered by first occurrence
+        first = np.lexsort((e['firstRows'],) + keys)[starts]
+        reduced = {'sids' : e['sids'][best], 'expMassBits' : e['expMassBits'][best], 'labels' : e['labels'][best],
+                   'scores' : e['scores'][best], 'rows' : e['rows'][best], 'strings' : e['strings'].take(best),
+                   'firstRows' : e['firstRows'][first], 'expMasses' : e['expMasses'][first]}
+        if self._loadFeatures:
+            reduced['X'] = e['X'][best]
+        return reduced
+
+    def _reduce(self):
+        if len(self._parts) > 1:
+            self._parts = [self._reduceParts(self._parts)]
+        self._numCollected = self._numReduced = len(self._parts[0]['sids'])
+        return self._parts[0]
+
+    def _blockEntries(self, scores, features, labels, sids, expMassValues, expMasses, strRows, rowOffset):
+        rows = np.arange(rowOffset, rowOffset + len(scores), dtype = np.int64)
+        e = {'sids' : sids, 'expMassBits' : np.ascontiguousarray(expMassValues, dtype = np.float64).view(np.int64),
+             'labels' : labels, 'scores' : np.asarray(scores, dtype = np.float64), 'rows' : rows, 'firstRows' : rows,
+             'expMasses' : expMasses, 'strings' : StringTable.from_blocks([strRows], 0)}
+        if self._loadFeatures:
+            e['X'] = np.asarray(features, dtype = self._dtype)
+        return e
+
+    def update(self, scores, features, labels, sids, expMassValues, expMasses, strRows, rowOffset):
+        """ Collect the best PSM per key of a block of PSMs
+
+            scores - ranking score of each PSM
+            features - feature matrix of the block (ignored if loadFeatures is False)
+            expMassValues, expMasses - exp masses as floats (used as keys) and as strings
+            strRows - newline separated string fields of the block (see StringTable)
+            rowOffset - global index of the first PSM in the block
+        """
+        if not len(scores):
+            return
+        winners = self._reduceParts([self._blockEntries(scores, features, labels, sids, expMassValues, expMasses,
+                                                        strRows, rowOffset)])
+        self._parts.append(winners)
+        self._numCollected += len(winners['sids'])
+        if self._numCollected > max(self._compactRows, 2 * self._numReduced):
+            self._reduce()
+
+    def result(self, numStringFields):
+        """ Return pepstrings, X, Y, sids, expMasses ordered by first occurrence of each key
+        """
+        if not self._parts:
+            X = np.zeros((0, self._numFeatures), dtype = self._dtype) if self._loadFeatures else None
+            return (StringTable.from_blocks([], numStringFields), X, np.zeros(0, dtype = np.int32),
+                    np.zeros(0, dtype = np.int64), np.array([], dtype = str))
+        t = self._reduce()
+        order = np.argsort(t['firstRows'], kind = 'stable')
+        strings = t['strings'].take(order)
+        pepstrings = StringTable(strings._buf, strings._ends, numStringFields)
+        X = t['X'][order] if self._loadFeatures else None
+        return pepstrings, X, t['labels'][order], t['sids'][order], t['expMasses'][order]
+
+def load_pin_columns(filename, dtype = np.float64, loadFeatures = True, blockBytes = _blockBytes,
+                     topPsm = False, scoreInd = 0):
+    """ Load a PIN file column-wise, parsing the numeric fields of each block of rows directly into
+        a preallocated feature matrix
+
+        If topPsm is True, only the PSM with the highest value of feature scoreInd is kept per
+        (scan number, exp mass, label) key, reduced while streaming through the file (see TopPsmTable).
+
+        Returns:
+            pepstrings - StringTable of (psm id, peptide string, protein ids) for each PSM
+            X - feature matrix of type dtype (None if loadFeatures is False)
+            Y - int32 labels
+            featureNames - list of feature names
+            sids - int64 scan numbers
+            expMasses - array of experimental mass strings
+    """
+    f = checkGzip_openfile(filename, 'rb')
+    header = [h.lstrip(' ') for h in f.readline().decode('utf-8').rstrip('\r\n').split('\t')]
+    schema = parse_pin_header(header)
+    numFeatures = len(schema['featureNames'])
+    featureCols = schema['featureCols']
+    labelCol = schema['labelCol']
+    sidCol = schema['sidCol']
+    expMassCol = schema['expMassInd'] - 1
+    if topPsm:
+        table = TopPsmTable(numFeatures, dtype, loadFeatures)
+    else:
+        # Rough initial capacity, grown as necessary
+        capacity = 1 << 16
+        X = None
+        if loadFeatures:
+            X = np.empty((capacity, numFeatures), dtype = dtype)
+        Y = np.empty(capacity, dtype = np.int32)
+        sids = np.empty(capacity, dtype = np.int64)
+        strBlocks = []
+        expMassBlocks = []
+    numRows = 0 # number of PSMs stored
+    numLines = 0 # number of PSMs read
+    for numeric, strRows, expMasses in iter_pin_blocks(f, schema, header, blockBytes):
+        m = numeric.shape[0]
+        labels = numeric[:, labelCol]
+        badLabels = np.flatnonzero((labels != 1) & (labels != -1))
+        if len(badLabels):
+            print("Error: encountered label value %s on line %d, can only be -1 or 1, exitting" % (labels[badLabels[0]], numLines + badLabels[0] + 2))
+            exit(-1)
+        s = numeric[:, sidCol]
+        badSids = np.flatnonzero(s != np.floor(s))
+        if len(badSids):
+            raise ValueError("Could not convert scan number %s on line %d to int, exitting" % (s[badSids[0]], numLines + badSids[0] + 2))
+        if topPsm:
+            table.update(numeric[:, featureCols[scoreInd]], numeric[:, featureCols] if loadFeatures else None,
+                         labels.astype(np.int32), s.astype(np.int64), numeric[:, expMassCol], expMasses,
+                         strRows, numLines)
+            numLines += m
+            continue
+        if numRows + m > Y.shape[0]:
+            Y = _grow(Y, numRows + m)
+            sids = _grow(sids, numRows + m)
+            if loadFeatures:
+                X = _grow(X, numRows + m)
+        Y[numRows:numRows + m] = labels
+        sids[numRows:numRows + m] = s
+        if loadFeatures:
+            X[numRows:numRows + m] = numeric[:, featureCols]
+        strBlocks.append(strRows)
+        expMassBlocks.append(expMasses)
+        numRows += m
+        numLines += m
+    f.close()
+    if topPsm:
+        pepstrings, X, Y, sids, expMasses = table.result(schema['numStringFields'])
+        print("Kept top scoring PSM per (scan number, exp mass, label): %d of %d PSMs" % (len(Y), numLines))
+        return pepstrings, X, Y, schema['featureNames'], sids, expMasses
+    # release unused capacity in place
+    Y.resize(numRows, refcheck = False)
+    sids.resize(numRows, refcheck = False)
+    if loadFeatures:
+        X.resize((numRows, numFeatures), refcheck = False)
+    pepstrings = StringTable.from_blocks(strBlocks, schema['numStringFields'])
+    if expMassBlocks:
+        expMasses = np.concatenate(expMassBlocks)
+    else:
+        expMasses = np.array([], dtype = str)
+    return pepstrings, X, Y, schema['featureNames'], sids, expMasses
+
+#########################################################
+#########################################################
+################### Binary PIN cache
+#########################################################
+#########################################################
+def defaultCacheDir():
+    """ Per-user directory of the binary PIN cache: proteoTorch/pin under %LOCALAPPDATA% on
+        Windows, and under $XDG_CACHE_HOME (defaulting to ~/.cache) elsewhere
+    """
+    if sys.platform == 'win32' and os.environ.get('LOCALAPPDATA'):
+        base = os.environ['LOCALAPPDATA']
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'proteoTorch', 'pin')
+
+def setCacheOptions(enabled = False, cacheDir = None, maxGb = 20.):
+    """ Configure the binary PIN cache used by load_pin_columns_cached()
+
+        enabled - if False (the default), PIN files are always parsed from text
+        cacheDir - directory holding cache entries.  If None, defaultCacheDir()
+        maxGb - bound on the total size of the cache directory, least recently used
+                entries are evicted beyond this
+    """
+    global _cacheEnabled, _cacheDir, _cacheMaxBytes
+    _cacheEnabled = enabled
+    _cacheDir = cacheDir
+    _cacheMaxBytes = int(maxGb * (1 << 30))
+
+def _cacheRoot(filename):
+    if _cacheDir is not None:
+        return _cacheDir
+    return defaultCacheDir()
+
+def _cacheEntryDir(filename):
+    """ Cache entries are keyed by the absolute path of the PIN file
+    """
+    absPath = os.path.abspath(filename)
+    pathHash = hashlib.sha1(absPath.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(_cacheRoot(filename), os.path.basename(absPath) + '.' + pathHash)
+
+def _contentHash(filename, blockBytes = _blockBytes):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(blockBytes)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def _readMeta(entryDir):
+    try:
+        with open(os.path.join(entryDir, 'meta.json')) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _writeMeta(entryDir, meta):
+    tmp = os.path.join(entryDir, 'meta.json.tmp%d' % os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(entryDir, 'meta.json'))
+
+def _validCacheEntry(filename, entryDir, dtype, loadFeatures):
+    """ Check whether the cache entry matches the current PIN file.  The entry is valid if
+        the path, size and mtime of the PIN file match those recorded.  If only the mtime differs,
+        the content hash is compared (and, on a match, the recorded mtime updated).
+    """
+    meta = _readMeta(entryDir)
+    if meta is None or meta.get('version') != _cacheVersion:
+        return None
+    if loadFeatures and not meta['hasFeatures']:
+        return None
+    if loadFeatures and np.dtype(meta['dtype']).itemsize < np.dtype(dtype).itemsize:
+        return None # cached features have lower precision than requested
+    st = os.stat(filename)
+    if meta['path'] != os.path.abspath(filename) or meta['size'] != st.st_size:
+        return None
+    if meta['mtime'] != st.st_mtime:
+        if meta['contentHash'] != _contentHash(filename):
+            return None
+        meta['mtime'] = st.st_mtime
+    meta['lastUsed'] = time.time()
+    try:
+        _writeMeta(entryDir, meta)
+    except (IOError, OSError):
+        pass
+    return meta
+
+def _loadCacheEntry(entryDir, meta, dtype, loadFeatures):
+    """ Memory-map a cache entry
+    """
+    def load(name, mmap_mode = 'r'):
+        return np.load(os.path.join(entryDir, name + '.npy'), mmap_mode = mmap_mode)
+    X = None
+    if loadFeatures:
+        X = load('X', 'c') # copy-on-write, never modifies the cache
+        if X.dtype != dtype:
+            X = X.astype(dtype)
+    pepstrings = StringTable(load('strings'), load('stringEnds'), meta['numStringFields'])
+    return pepstrings, X, np.array(load('Y')), meta['featureNames'], np.array(load('sids')), load('expMasses')
+
+def _entryBytes(entryDir):
+    total = 0
+    for fn in os.listdir(entryDir):
+        try:
+            total += os.path.getsize(os.path.join(entryDir, fn))
+        except OSError:
+            pass
+    return total
+
+def _evictCache(cacheRoot, maxBytes, keep = None):
+    """ Remove least recently used cache entries until the cache directory is at most maxBytes
+    """
+    entries = []
+    for d in os.listdir(cacheRoot):
+        entryDir = os.path.join(cacheRoot, d)
+        if not os.path.isdir(entryDir) or entryDir == keep or d.startswith('.tmp'):
+            continue
+        meta = _readMeta(entryDir)
+        lastUsed = meta.get('lastUsed', 0.) if meta else 0.
+        entries.append((lastUsed, entryDir, _entryBytes(entryDir)))
+    total = sum([e[2] for e in entries])
+    if keep is not None:
+        total += _entryBytes(keep)
+    for _, entryDir, size in sorted(entries):
+        if total <= maxBytes:
+            break
+        print("PIN cache: evicting %s (%d bytes)" % (entryDir, size))
+        shutil.rmtree(entryDir, ignore_errors = True)
+        total -= size
+
+def _writeCacheEntry(filename, entryDir, pepstrings, X, Y, featureNames, sids, expMasses):
+    """ Write a cache entry to a temporary directory, then atomically move it in place
+    """
+    st = os.stat(filename)
+    cacheRoot = os.path.dirname(entryDir)
+    if not os.path.exists(cacheRoot):
+        os.makedirs(cacheRoot)
+    tmpDir = os.path.join(cacheRoot, '.tmp%d_%s' % (os.getpid(), os.path.basename(entryDir)))
+    if os.path.exists(tmpDir):
+        shutil.rmtree(tmpDir)
+    os.makedirs(tmpDir)
+    def save(name, arr):
+        np.save(os.path.join(tmpDir, name + '.npy'), arr)
+    if X is not None:
+        save('X', X)
+    save('Y', Y)
+    save('sids', sids)
+    save('expMasses', expMasses)
+    save('strings', pepstrings._buf)
+    save('stringEnds', pepstrings._ends)
+    meta = {'version' : _cacheVersion,
+            'path' : os.path.abspath(filename),
+            'size' : st.st_size,
+            'mtime' : st.st_mtime,
+            'contentHash' : _contentHash(filename),
+            'hasFeatures' : X is not None,
+            'dtype' : str(X.dtype) if X is not None else None,
+            'featureNames' : featureNames,
+            'numStringFields' : pepstrings._numFields,
+            'lastUsed' : time.time()}
+    _writeMeta(tmpDir, meta)
+    if os.path.exists(entryDir):
+        shutil.rmtree(entryDir, ignore_errors = True)
+    try:
+        os.rename(tmpDir, entryDir)
+    except OSError: # another process wrote the same entry concurrently
+        shutil.rmtree(tmpDir, ignore_errors = True)
+    _evictCache(cacheRoot, _cacheMaxBytes, keep = entryDir)
+
+def load_pin_columns_cached(filename, dtype = np.float64, loadFeatures = True, topPsm = False, scoreInd = 0):
+    """ Cached version of load_pin_columns().  On first load, the parsed PIN file is written to a
+        binary cache entry (.npy files for X, Y, sids, expMasses and the string table buffer plus
+        its offsets table).  Later loads memory-map the entry instead of reparsing the PIN file.
+        Top-PSM reduced loads (see load_pin_columns) are cached in separate entries per scoreInd.
+        The cache is disabled by default, see setCacheOptions() to enable it or change its location
+        and size bound.
+    """
+    if not _cacheEnabled:
+        return load_pin_columns(filename, dtype, loadFeatures, topPsm = topPsm, scoreInd = scoreInd)
+    entryDir = _cacheEntryDir(filename)
+    if topPsm:
+        entryDir += '.topPsm%d' % scoreInd
+    meta = None
+    if os.path.isdir(entryDir):
+        meta = _validCacheEntry(filename, entryDir, dtype, loadFeatures)
+    if meta is not None:
+        print("Loading cached PIN data from %s" % (entryDir))
+        return _loadCacheEntry(entryDir, meta, dtype, loadFeatures)
+    data = load_pin_columns(filename, dtype, loadFeatures, topPsm = topPsm, scoreInd = scoreInd)
+    print("Caching parsed PIN data in %s" % (entryDir))
+    try:
+        _writeCacheEntry(filename, entryDir, *data)
+    except (IOError, OSError) as e:
+        print("Warning: could not write PIN cache %s (%s), continuing without cache" % (entryDir, e))
+    return data
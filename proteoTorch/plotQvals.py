@@ -30,7 +30,7 @@ import itertools
 import numpy
 
 try:
-    from proteoTorch_qvalues import calcQ, calcQAndNumIdentified # load cython library
+    from proteoTorch_qvalues_np import calcQ, calcQAndNumIdentified # load cython library
 except:
     print("Warning: Cython q-value not found, loading strictly python q-value library, which slows down analysis significantly.")
     from proteoTorch.pyfiles.qvalsBase import calcQ, calcQAndNumIdentified # import unoptimized q-value calculation
@@ -38,7 +38,8 @@ except:
 from proteoTorch.analyze import (givenPsmIds_writePin, 
                                  load_pin_return_featureMatrix, load_pin_return_scanExpmassPairs,
                                  calculateTargetDecoyRatio, searchForInitialDirection_split,
-                                 getDecoyIdx, sortRowIndicesBySid, checkGzip_openfile, check_arg_trueFalse)
+                                 getDecoyIdx, sortRowIndicesBySid, partitionCvBins, checkGzip_openfile, check_arg_trueFalse)
+import proteoTorch.pin_utils as pin_utils
 from scipy.spatial import distance
 
 def calcDistanceMat(testMat,trainMat, metric = 'euclidean'):
@@ -47,47 +48,7 @@ def calcDistanceMat(testMat,trainMat, metric = 'euclidean'):
     z = distance.cdist(testMat, trainMat, metric)
     return z
 
-def doRand():
-    global _seed
-    _seed=(_seed * 279470273) % 4294967291
-    return _seed
-
-def partitionCvBins(featureMatRowIndices, sids, folds = 3, seed = 1):
-    trainKeys = []
-    testKeys = []
-    for i in range(folds):
-        trainKeys.append([])
-        testKeys.append([])
-    remain = []
-    r = len(sids) / folds
-    remain.append(len(sids) - (folds-1) * r)
-    for i in range(folds-1):
-        remain.append(len(sids) / folds)
-    prevSid = sids[0]
-    # seed = doRand(seed)
-    randIdx = doRand() % folds
-    it = 0
-    for k,sid in list(zip(featureMatRowIndices, sids)):
-        if (sid!=prevSid):
-            # seed = doRand(seed)
-            randIdx = doRand() % folds
-            while remain[randIdx] <= 0:
-                # seed = doRand(seed)
-                randIdx = doRand() % folds
-        for i in range(folds):
-            if i==randIdx:
-                testKeys[i].append(k)
-            else:
-                trainKeys[i].append(k)
-
-        remain[randIdx] -= 1
-        prevSid = sid
-        it += 1
-    return trainKeys, testKeys
-
 def disagreedPsms_computeSimilarity(pin, disagreedPsmsFile, seed = 1):
-    global _seed 
-    _seed = seed
     q=0.01
     thresh=q
     pepstrings, X, Y, featureNames, sids0 = load_pin_return_featureMatrix(pin)
@@ -97,7 +58,8 @@ def disagreedPsms_computeSimilarity(pin, disagreedPsmsFile, seed = 1):
     m = l[1] # number of features
     targetDecoyRatio, numT, numD = calculateTargetDecoyRatio(Y)
     print("Loaded %d target and %d decoy PSMS with %d features, ratio = %f" % (numT, numD, l[1], targetDecoyRatio))
-    trainKeys, testKeys = partitionCvBins(sidSortedRowIndices, sids)
+    cvFolds = partitionCvBins(sidSortedRowIndices, sids, seed = seed)
+    trainKeys, testKeys = cvFolds.train, cvFolds.test
     initTaq = 0.
     scores, initTaq = searchForInitialDirection_split(trainKeys, X, Y, q, featureNames)
 
@@ -131,7 +93,7 @@ def disagreedPsms_computeSimilarity(pin, disagreedPsmsFile, seed = 1):
         print("Fold %d: %s test instances, %d train instances" % (kFold, len(s), len(cvBinSids)))
         taq, daq, _ = calcQ(scores[kFold], Y[cvBinSids], thresh, True)
         gd = getDecoyIdx(Y, cvBinSids)
-        trainSids = gd + taq
+        trainSids = np.concatenate((gd, taq))
         # calculate similarity between A,B
         z = calcDistanceMat(X[s],X[trainSids], 'euclidean')
         excludePsms = 'kim_excludeHighlyCorreleatedPsmsList.txt'
@@ -1141,6 +1103,10 @@ def main():
     parser.add_option('--dataset', type = 'string', help = 'Original processed dataset in PIN format.  Only necessary if tdc set to True.')
     parser.add_option('--writeTdcResults', type = 'string', default = 'false', help = 'Write the results of TDC for all methods to new files.')
     parser.add_option('--tdcOutputDir', type = 'string', default = '', help = 'Output directory to write TDC competition results.')
+    parser.add_option('--pin_cache', type = 'string', default = 'false', 
+                      help = 'Cache the parsed dataset PIN file in binary form (a full copy of its data) and memory-map it on later runs.  Entries are written to --pin_cache_dir, by default %s.' % (pin_utils.defaultCacheDir()))
+    parser.add_option('--pin_cache_dir', type = 'string', default = None, help = 'Directory for cached PIN files.  Defaults to %s.' % (pin_utils.defaultCacheDir()))
+    parser.add_option('--pin_cache_max_gb', type = 'float', default = 20., help = 'Maximum size of the PIN cache directory in GB.')
 
     (OPTIONS, ARGS) = parser.parse_args()
 
@@ -1152,6 +1118,8 @@ def main():
     OPTIONS.tdc = check_arg_trueFalse(OPTIONS.tdc)
     OPTIONS.writeTdcResults = check_arg_trueFalse(OPTIONS.writeTdcResults)
     OPTIONS.publish = check_arg_trueFalse(OPTIONS.publish)
+    OPTIONS.pin_cache = check_arg_trueFalse(OPTIONS.pin_cache)
+    pin_utils.setCacheOptions(OPTIONS.pin_cache, OPTIONS.pin_cache_dir, OPTIONS.pin_cache_max_gb)
 
 
     mainPlot(ARGS, OPTIONS.output, OPTIONS.maxq, OPTIONS.tdc, OPTIONS.dataset, 
@@ -132,7 +132,8 @@ def getQValues(pi0, combined, skipDecoysPlusOne = False, verb = -1):
 
         if idx==len(combined)-1 or combined[idx][scoreInd] != combined[idx+1][scoreInd]:
             if pi0 < 1.0 and decoyQueue > 0:
-                j = len(h_w_le_z) - (n_z_ge_w - 1)
+                # index of the current decoy group in h_w_le_z and h_z_le_z (ordered by ascending score)
+                j = len(h_w_le_z) - (n_z_ge_w - (0 if skipDecoysPlusOne else 1))
                 cnt_w = float(h_w_le_z[j])
                 cnt_z = float(h_z_le_z[j])
                 estPx_lt_zj = (cnt_w - pi0*cnt_z) / ((1.0 - pi0)*cnt_z)
@@ -159,8 +160,10 @@ def getQValues(pi0, combined, skipDecoysPlusOne = False, verb = -1):
     
 
 
-def calcQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, verb = -1):
+def calcQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, verb = -1, pi0 = 1.):
     """Returns q-values and the indices of the positive class such that q <= thresh
+
+       For pi0 < 1, mix-max q-values are computed
     """
     assert len(scores)==len(labels), "Number of input scores does not match number of labels for q-value calculation"
     # allScores: list of triples consisting of score, label, and index
@@ -168,7 +171,6 @@ def calcQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, verb = -1):
     #--- sort descending
     
     allScores = sorted(allScores, key=lambda x: -x[0])
-    pi0 = 1.
     qvals = getQValues(pi0, allScores, skipDecoysPlusOne, verb)
     
     taq = []
@@ -183,9 +185,18 @@ def calcQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False, verb = -1):
                 taq.append(curr_og_idx)
             else:
                 daq.append(curr_og_idx)
-    return taq,daq, [qvals[i] for _,_,i in allScores]
+    originalOrderQvals = [0.] * len(qvals)
+    for (_,_,i), q in zip(allScores, qvals):
+        originalOrderQvals[i] = q
+    return taq,daq, originalOrderQvals
 
 
+def numTargetsAtQ(scores, labels, thresh = 0.01, skipDecoysPlusOne = False):
+    """Returns the number of targets such that q <= thresh
+    """
+    taq, _, _ = calcQ(scores, labels, thresh, skipDecoysPlusOne)
+    return len(taq)
+
 
 def calcQAndNumIdentified(scores, labels, thresh = 0.01, skipDecoysPlusOne = False):
     """Returns q-values and the number of identified spectra at each q-value
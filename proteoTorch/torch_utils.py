@@ -7,11 +7,17 @@ See COPYING or http://opensource.org/licenses/OSL-3.0
 """
 
 import numpy as np
+import copy
+import threading
 import time
 import torch
 import torch.nn as nn
 #import torch.nn.functional as F
 import torch.optim as optim
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of hidden activations (members x rows x layer width) Stacked_MLP_Ensemble computes at a time
+_STACKED_BLOCK_ELEMENTS = 1 << 23
 
 
 def torch_tensor_to_np(tensor):
@@ -37,6 +43,23 @@ def numpy_to_pytorch_tensor(np_array, dtype=None, device='cpu', requires_grad=Fa
 
 
 
+def stage_tensors(data_list, device='cpu'):
+    '''
+    Converts a group of arrays (e.g. data and labels of a training set) once to contiguous torch tensors on <device>,
+    so that minibatches can be gathered from them by index without further copies or conversions.
+    
+    Floating point arrays become torch.float32 and all others torch.long tensors (as in numpy_to_pytorch_tensor).
+    On the CPU, arrays of these types are shared with the returned tensors, not copied.
+    '''
+    ret = []
+    for x in data_list:
+        x = np.ascontiguousarray(x)
+        dtype = torch.float32 if 'float' in str(x.dtype) else torch.long
+        ret.append(torch.from_numpy(x).to(device=device, dtype=dtype))
+    return ret
+
+
+
 def to_categorical(labels, num_classes = None):
     '''
     flat list (integers, values 0 and up) -> 2D tensor (num_samples, num_classes)
@@ -96,7 +119,7 @@ def accuracy(predictions, labels):
 
 
 
-def make_ensemble__greedy(list_of_predictions, labels, max_N_models_in_ensemble = 20, metric = accuracy):
+def make_ensemble__greedy(list_of_predictions, labels, max_N_models_in_ensemble = 20, metric = accuracy, num_threads = 1, early_stopping = False):
     '''
     repeats: add one model to current ensemble so that ensemble accuracy/metric increases with each addition.
     Stops iteration if no improvement possible or if <max_N_models_in_ensemble> models were added (repetitions are counted).
@@ -105,7 +128,12 @@ def make_ensemble__greedy(list_of_predictions, labels, max_N_models_in_ensemble
     -------------
         list_of_predictions: probability/softmax predictions for validation set for all models.
 
-        metric: function; higher values are better
+        metric: function; higher values are better. Must be thread-safe if num_threads > 1 (e.g. mini_utils.AUC_up_to_tol_singleQ).
+        
+        num_threads: number of threads evaluating the candidate models of each step, each limited to one torch intra-op thread.
+        
+        early_stopping: stop once no candidate improves the current ensemble's metric (otherwise, add the best candidate 
+                        until <max_N_models_in_ensemble> models were added).
 
     returns:
     -------------
@@ -113,20 +141,41 @@ def make_ensemble__greedy(list_of_predictions, labels, max_N_models_in_ensemble
     '''
     ensemble_selection_indices = []
     ensemble_predictions = np.zeros(labels.shape, 'float32') #sum of model predictions
-    for i in range(max_N_models_in_ensemble):
-        j_best = 0
-        score_best = -1e30
-        for j,p in enumerate(list_of_predictions):
-            combined_p = (ensemble_predictions + p) / (1.+len(ensemble_selection_indices))
-            combined_score = metric(combined_p, labels)
-            #print('make_ensemble__greedy:: iter',i,'score =',combined_score)
-            if score_best < combined_score:
-                score_best = combined_score
-                j_best     = j
-        if score_best <= -1e30:
-            break #done, cannot improve
-        ensemble_selection_indices.append(j_best)
-        ensemble_predictions += list_of_predictions[j_best]
+    score_current = -1e30
+    # each thread combines the ensemble with a candidate in its own preallocated buffer
+    buffers = {}
+    def score_candidate(p):
+        buf = buffers.get(threading.get_ident())
+        if buf is None:
+            buf = buffers[threading.get_ident()] = np.empty(labels.shape, 'float32')
+        np.add(ensemble_predictions, p, out=buf)
+        buf /= (1.+len(ensemble_selection_indices))
+        return metric(buf, labels)
+    executor = None
+    if num_threads > 1 and len(list_of_predictions) > 1:
+        executor = ThreadPoolExecutor(max_workers=num_threads, initializer=limit_intra_op_threads, initargs=(1,))
+    try:
+        for i in range(max_N_models_in_ensemble):
+            if executor is not None:
+                scores = list(executor.map(score_candidate, list_of_predictions))
+            else:
+                scores = [score_candidate(p) for p in list_of_predictions]
+            # first candidate with the highest score (NaN scores are never chosen)
+            scores = np.asarray(scores, 'float64')
+            scores[~(scores > -1e30)] = -np.inf
+            j_best = int(np.argmax(scores))
+            score_best = scores[j_best]
+            #print('make_ensemble__greedy:: iter',i,'score =',score_best)
+            if score_best <= -1e30:
+                break #done, cannot improve
+            if early_stopping and ensemble_selection_indices and score_best <= score_current:
+                break #done, no candidate improves the ensemble
+            ensemble_selection_indices.append(j_best)
+            ensemble_predictions += list_of_predictions[j_best]
+            score_current = score_best
+    finally:
+        if executor is not None:
+            executor.shutdown()
     return ensemble_predictions/len(ensemble_selection_indices), ensemble_selection_indices
 
 
@@ -205,38 +254,216 @@ def update_lr(optimizer, initial_lr, relative_progress, total_lr_decay, factor=1
 
 
 
-def run_model_on_data(data, model, device, batchsize=50):
+def limit_intra_op_threads(num_threads):
+    '''
+    Limits torch's intra-op parallelism in the calling thread to num_threads, e.g. as the initializer of the workers of a 
+    thread pool, so that workers scoring or training concurrently share the cores instead of each using all of them 
+    (with torch's OpenMP backend, the setting applies to the calling thread only).
+    '''
+    torch.set_num_threads(max(1, int(num_threads)))
+
+
+
+def run_in_blocks(score_rows, data, batchsize, num_threads=1):
+    '''
+    Returns score_rows(rows) (an nd-array) for consecutive blocks of <batchsize> rows of data, written 
+    straight into one preallocated float32 array.
+    
+    With num_threads > 1, blocks are scored concurrently by a pool of threads (torch releases the GIL while 
+    computing), each limited to one intra-op thread; score_rows must then be thread-safe, and set torch.no_grad() 
+    itself as grad mode is thread-local.
+    '''
+    N = len(data)
+    batchsize = max(1, min(batchsize, N))
+    p = score_rows(data[0 : batchsize]) #(variable, num_outputs)
+    rval = np.empty((N,)+tuple(p.shape[1:]), 'float32')
+    rval[0:batchsize, ...] = p
+    def fill(offset):
+        rval[offset:offset+batchsize, ...] = score_rows(data[offset : offset + batchsize])
+    offsets = range(batchsize, N, batchsize)
+    if num_threads > 1 and len(offsets) > 1:
+        with ThreadPoolExecutor(max_workers=num_threads, initializer=limit_intra_op_threads, initargs=(1,)) as executor:
+            list(executor.map(fill, offsets))
+    else:
+        for offset in offsets:
+            fill(offset)
+    return rval
+
+
+
+def run_model_on_data(data, model, device, batchsize=50, num_threads=1):
     '''
     Returns the model's predictions as nd-array.
     
     Assumes that data is a numpy tensor.
+    
+    num_threads:
+        
+        number of threads concurrently scoring batches of rows (see run_in_blocks).
 
     '''
     if hasattr(model, 'run_model_on_data'):
-        return model.run_model_on_data(data, batchsize)
+        return model.run_model_on_data(data, batchsize, num_threads)
     model.eval()
     #model.training = False
-    rval = None
-    N = len(data)
-    if batchsize > N:
-        batchsize = N
-    with torch.no_grad():
-        for offset in range(0, N, batchsize):
-            p = torch_tensor_to_np(model(numpy_to_pytorch_tensor(data[offset : offset + batchsize], device=device))) #(variable, num_outputs)
-            if rval is None:
-                rval = np.zeros((N,)+tuple(p.shape[1:]), 'float32')
-            rval[offset:offset+batchsize, ...] = p
+    def score_rows(rows):
+        with torch.no_grad():
+            return torch_tensor_to_np(model(numpy_to_pytorch_tensor(rows, device=device)))
+    rval = run_in_blocks(score_rows, data, batchsize, num_threads)
     model.train()
     return rval
 
 
 
+class Stacked_MLP_Ensemble(object):
+    def __init__(self, weights_list, layer_param_names, device, output_activation='softmax', model=None):
+        '''
+        Ensemble of MLPs with the same architecture (e.g. weight snapshots of one model), whose weights are held as one 
+        stacked tensor per layer, so that all members are evaluated in a single pass over the data without reloading weights.
+        
+        The weights of each linear layer are stacked over the members into a (num_members, n_in, n_out) tensor, and a 
+        block of rows is scored by all members with batched matrix products (torch.baddbmm) on both the CPU and GPUs.  
+        Hidden layers use ReLU activations (dropout is inactive during inference), and the members' output probabilities 
+        are averaged.
+        
+        Does NOT support training; use select() to keep a subset of the members (e.g. chosen by make_ensemble__greedy) 
+        and get_single_model() / get_averaged_model() to obtain a single model.
+        
+        weights_list:
+            
+            list of state dicts (e.g. from get_model_params), one per ensemble member.
+        
+        layer_param_names:
+            
+            list of (weight name, bias name) pairs of the state dict entries of each linear layer, in order.
+        
+        output_activation:
+            
+            'softmax' or 'sigmoid', applied to the output layer of each member.
+        
+        model:
+            
+            model of the architecture (its weights are overwritten by get_single_model() and get_averaged_model()).
+        '''
+        assert output_activation in ['softmax', 'sigmoid']
+        self._device = device
+        self._output_activation = output_activation
+        self._model = model
+        self._weights_list = weights_list
+        self._num_members = len(weights_list)
+        self._counts = np.ones(self._num_members, 'float32') # number of times each member is counted in the average
+        self._layers = []
+        for weight_name, bias_name in layer_param_names:
+            W = np.stack([torch_tensor_to_np(w[weight_name]) for w in weights_list]).transpose(0, 2, 1)
+            b = np.stack([torch_tensor_to_np(w[bias_name]) for w in weights_list])[:, None, :]
+            self._layers.append((numpy_to_pytorch_tensor(np.ascontiguousarray(W), dtype=torch.float32, device=device), 
+                                 numpy_to_pytorch_tensor(b, dtype=torch.float32, device=device)))
+        self._max_width = max(W.shape[2] for W, _ in self._layers)
+        self._update_average_weights()
+    
+    def _update_average_weights(self):
+        self._average_weights = numpy_to_pytorch_tensor(self._counts / np.sum(self._counts), dtype=torch.float32, device=self._device)
+    
+    def __len__(self):
+        return self._num_members
+    
+    def select(self, indices):
+        '''
+        Returns the ensemble of the members with the given indices. Indices may repeat (as chosen by make_ensemble__greedy), 
+        in which case a member counts that many times in the average but is evaluated once.
+        '''
+        members = list(dict.fromkeys(int(i) for i in indices)) # unique, in order of first selection
+        counts = np.asarray([np.sum(np.asarray(indices) == i) for i in members], 'float32')
+        ret = copy.copy(self)
+        selected = numpy_to_pytorch_tensor(np.asarray(members), dtype=torch.long, device=self._device)
+        ret._layers = [(W.index_select(0, selected), b.index_select(0, selected)) for W, b in self._layers]
+        ret._weights_list = [self._weights_list[i] for i in members]
+        ret._num_members = len(members)
+        ret._counts = counts * self._counts[members]
+        ret._update_average_weights()
+        return ret
+    
+    def member_predictions(self, X):
+        '''
+        X: tensor of shape (batch_size, n_in) on the ensemble's device. Returns the predictions of each member, shape (num_members, batch_size, n_out).
+        '''
+        with torch.no_grad():
+            h = X.expand(self._num_members, -1, -1) # the members share the rows without copying them
+            for W, b in self._layers[:-1]:
+                h = torch.baddbmm(b, h, W).relu_() # (num_members, batch_size, n_out)
+            W, b = self._layers[-1]
+            return self._activation(torch.baddbmm(b, h, W))
+    
+    def __call__(self, X):
+        '''
+        X: tensor of shape (batch_size, n_in) on the ensemble's device. Returns the averaged predictions, shape (batch_size, n_out).
+        '''
+        return torch.tensordot(self._average_weights, self.member_predictions(X), dims=1)
+    
+    def _activation(self, h):
+        if self._output_activation == 'softmax':
+            return torch.softmax(h, dim=-1)
+        return torch.sigmoid(h)
+    
+    def _block_rows(self):
+        # bounds the memory of the stacked hidden activations
+        return max(1, _STACKED_BLOCK_ELEMENTS // (self._num_members * self._max_width))
+    
+    def run_model_on_data(self, data, batchsize=None, num_threads=1):
+        '''
+        Like __call__ but on large amounts of data (nd-array), returned as nd-array.
+        
+        Rows are scored in blocks sized to bound the memory of the stacked hidden activations (batchsize is ignored), 
+        using num_threads threads (see run_in_blocks).
+        '''
+        return run_in_blocks(lambda rows: torch_tensor_to_np(self(numpy_to_pytorch_tensor(rows, device=self._device))), 
+                             data, self._block_rows(), num_threads)
+    
+    def run_members_on_data(self, data, num_threads=1):
+        '''
+        Returns the predictions of each member on data (nd-array), shape (num_members, len(data), n_out), in one pass over data.
+        '''
+        P = run_in_blocks(lambda rows: torch_tensor_to_np(self.member_predictions(numpy_to_pytorch_tensor(rows, device=self._device)).transpose(0, 1)), 
+                          data, self._block_rows(), num_threads)
+        return np.ascontiguousarray(P.transpose(1, 0, 2))
+    
+    def get_single_model(self):
+        '''
+        returns the model with the weights of the first member
+        '''
+        set_model_params(self._model, dict(self._weights_list[0]))
+        return self._model
+    
+    def get_averaged_model(self):
+        '''
+        returns the model with the (count weighted) average of the members' weights, e.g. to export the ensemble as a single model. 
+        Its predictions generally differ from the ensemble's averaged predictions.
+        '''
+        w = self._counts / np.sum(self._counts)
+        averaged = {}
+        for k in self._weights_list[0]:
+            averaged[k] = sum(w[i] * torch_tensor_to_np(x[k]) for i, x in enumerate(self._weights_list)).astype(torch_tensor_to_np(self._weights_list[0][k]).dtype)
+        set_model_params(self._model, averaged)
+        return self._model
+    
+    def eval(self):
+        pass
+    
+    def train(self):
+        pass
+    
+    def state_dict(self):
+        '''WARNING: only returns the first model and not the entire ensemble'''
+        return self.get_single_model().state_dict()
+
+
+
 def train_model(model, device, loss_fn, optimizer, train_data, valid_data, test_data,
                 validation_metric = accuracy, validation_check_interval=1, #apply_softmax_to_predictions = True,
                 batchsize = 100, num_epochs = 100, train = True,
                  initial_lr=3e-3, total_lr_decay=0.2, ensemble_reset_lr_decay=1, verbose = 1,
                  use_early_stopping = True,
-                 snapshot_ensemble_count = 0):
+                 snapshot_ensemble_count = 0, num_threads = 1, ensemble_early_stopping = False, generator = None):
     """
     Main training loop for the DNN.
 
@@ -284,6 +511,18 @@ def train_model(model, device, loss_fn, optimizer, train_data, valid_data, test_
         If value > 0 then changes learning rate schedule to sawblade pattern, resetting to the initial value on each reset and decreasing down to a factor of <total_lr_decay>.
         Performs <snapshot_ensemble_count> such resets and stores model weight snapshots at lr resets. 
         Returns a model with weights averaged from the final <snapshot_ensemble_count> snapshots.
+    
+    num_threads [int]:
+        
+        number of threads evaluating candidate snapshots during ensemble selection (see make_ensemble__greedy).
+
+    ensemble_early_stopping [bool]:
+
+        stop the greedy snapshot ensemble selection once no snapshot improves the ensemble (see make_ensemble__greedy).
+
+    generator [torch.Generator]:
+
+        draws the order of minibatches from this generator (on <device>) instead of torch's global RNG.
 
     Returns:
     -----------
@@ -307,24 +546,29 @@ def train_model(model, device, loss_fn, optimizer, train_data, valid_data, test_
         
         # optimizer = optim.SGD(model.parameters(), lr=initial_lr, momentum=0.9, weight_decay=None)
         
+        # stage the training set on the device once, minibatches are then gathered from a random permutation
+        train_tensors = stage_tensors(train_data[:2], device)
+        num_train = len(train_data[0])
         times=[]
         for epoch in range(num_epochs):
             if snapshot_ensemble_count > 0:
                 update_lr(optimizer, initial_lr, (epoch % lr_reset_every_n_epochs) * 1. / lr_reset_every_n_epochs, total_lr_decay, ensemble_reset_lr_decay**(epoch*1./num_epochs))
             else:
                 update_lr(optimizer, initial_lr, epoch*1./num_epochs, total_lr_decay)
-            train_data = permute_data_2(train_data)
             losses=[]
             t0 = time.time()
-            for i in range(0, len(train_data[0]), batchsize):
+            permutation = torch.randperm(num_train, device=device, generator=generator)
+            for i in range(0, num_train, batchsize):
                 optimizer.zero_grad()
-                this_batch = [numpy_to_pytorch_tensor(x[i:i+batchsize], device=device) for x in train_data]
+                batch_indices = permutation[i:i+batchsize]
+                this_batch = [x.index_select(0, batch_indices) for x in train_tensors]
                 outputs = model(this_batch[0])
                 loss = loss_fn(outputs, this_batch[1])
                 loss.backward()
                 optimizer.step()
                 #loss = model.train_on_batch(x=train_data[i], y=train_data[i]['labels'], check_batch_dim=False)
-                losses.append(torch_tensor_to_np(loss))
+                losses.append(loss.detach()) # read back once per epoch, not after every batch
+            losses = torch_tensor_to_np(torch.stack(losses))
             times.append(time.time()-t0)
             if epoch % validation_check_interval == 0:
                 val_pred = run_model_on_data(valid_data[0], model, device, batchsize = 2 * batchsize)
@@ -356,7 +600,8 @@ def train_model(model, device, loss_fn, optimizer, train_data, valid_data, test_
     if use_early_stopping:
         set_model_params(model, model_params_at_best_valid)
     if snapshot_ensemble_count > 0:
-        model = make_ensemble(model, model_params_snapshots, valid_data, validation_metric, device, batchsize = 2 * batchsize)
+        model = make_ensemble(model, model_params_snapshots, valid_data, validation_metric, device, batchsize = 2 * batchsize, num_threads = num_threads, 
+                              early_stopping = ensemble_early_stopping)
     train_acc = validation_metric(run_model_on_data(train_data[0], model, device, batchsize = 2 * batchsize), train_data[1])
     val_acc = validation_metric(run_model_on_data(valid_data[0], model, device, batchsize = 2 * batchsize), valid_data[1])
     test_acc = validation_metric(run_model_on_data(test_data[0], model, device, batchsize = 2 * batchsize), test_data[1])
@@ -378,6 +623,7 @@ class Ensemble_Wrapper(object):
         self._weights_list = weights_list
         self._model = model
         self._device = device
+        self._stacked = None # Stacked_MLP_Ensemble of the weights, if the model provides one
         
     def __call__(self, X):
         preds = None
@@ -396,15 +642,22 @@ class Ensemble_Wrapper(object):
         set_model_params(self._model, self._weights_list[0])
         return self._model
     
-    def run_model_on_data(self, data, batchsize=50):
+    def run_model_on_data(self, data, batchsize=50, num_threads=1):
         '''
         Like __call__ but on large amounts of data.
+        
+        If the model provides a stacked_ensemble() inference engine (see Stacked_MLP_Ensemble), all weights are evaluated 
+        in one pass over the data, in blocks of rows sized by the engine.
         '''
+        if hasattr(self._model, 'stacked_ensemble'):
+            if self._stacked is None:
+                self._stacked = self._model.stacked_ensemble(self._weights_list, self._device)
+            return self._stacked.run_model_on_data(data, num_threads=num_threads)
         self.eval()
         preds = None
         for w in self._weights_list:
             set_model_params(self._model, w)
-            P = run_model_on_data(data, self._model, self._device, batchsize=batchsize)
+            P = run_model_on_data(data, self._model, self._device, batchsize=batchsize, num_threads=num_threads)
             if preds is None:
                 preds = P
             else:
@@ -424,13 +677,24 @@ class Ensemble_Wrapper(object):
     
 
 
-def make_ensemble(model, list_weights, validation_set, metric, device, batchsize=500):
-    val_preds = []
-    for x in list_weights:
-        set_model_params(model, x)
-        val_preds.append(run_model_on_data(validation_set[0], model, device, batchsize = batchsize))
+def make_ensemble(model, list_weights, validation_set, metric, device, batchsize=500, num_threads=1, early_stopping=False):
+    '''
+    Selects an ensemble of the weight snapshots list_weights greedily (make_ensemble__greedy) by its metric on the validation set.
+    
+    If the model provides a stacked ensemble (see Stacked_MLP_Ensemble), all snapshots are scored in one pass over the 
+    validation set and the selected subset of it is returned; otherwise an Ensemble_Wrapper.
+    '''
+    stacked = model.stacked_ensemble(list_weights, device) if hasattr(model, 'stacked_ensemble') else None
+    if stacked is not None:
+        val_preds = list(stacked.run_members_on_data(validation_set[0]))
+    else:
+        val_preds = []
+        for x in list_weights:
+            set_model_params(model, x)
+            val_preds.append(run_model_on_data(validation_set[0], model, device, batchsize = batchsize))
     val_pred, ensemble_indices = make_ensemble__greedy(val_preds, labels=to_categorical(validation_set[1]) if validation_set[1].ndim==1 else validation_set[1], 
-                                                          max_N_models_in_ensemble=len(list_weights), metric=metric)
+                                                          max_N_models_in_ensemble=len(list_weights), metric=metric, num_threads=num_threads, 
+                                                          early_stopping=early_stopping)
+    if stacked is not None:
+        return stacked.select(ensemble_indices)
     return Ensemble_Wrapper(model, [list_weights[i] for i in ensemble_indices], device)
-
-
@@ -23,10 +23,11 @@ class data(Structure):
 	m: number of examples
 	n: number of features
 	X: flattened 2D feature matrix
+	Xf: flattened 2D single-precision feature matrix, used instead of X if set
 	Y: labels
 	'''
-	_names = ['m', 'n', 'X', 'Y']
-	_types = [c_int, c_int, POINTER(c_double), POINTER(c_double) ]
+	_names = ['m', 'n', 'X', 'Xf', 'Y']
+	_types = [c_int, c_int, POINTER(c_double), POINTER(c_float), POINTER(c_double) ]
 	_fields_ = genFields(_names, _types)
 
 	def __str__(self):
@@ -39,15 +40,27 @@ class data(Structure):
 
 		return s
 
-	def from_data(self, X, y):
+	def from_data(self, X, y, dtype = np.float64):
+		""" Point to the C-contiguous feature matrix X, stored as dtype (float64 or float32), and 
+		float64 labels y, without copying them if they already are.  References to the arrays are 
+		kept, so they stay alive for as long as this structure (and the C solver) uses them.
+		"""
 		self.__frombuffer__ = False
 		# set constants
 		self.m = len(y)
 		self.n = X.shape[1]+1 # include bias term
 
-		# Copy data over
-		self.Y = np.ctypeslib.as_ctypes(y.astype(np.float64))
-		self.X = np.ctypeslib.as_ctypes(X.reshape(-1))
+		self._X = np.ascontiguousarray(X, dtype = dtype)
+		self._Y = np.ascontiguousarray(y, dtype = np.float64).reshape(-1)
+		if self._X.dtype == np.float32:
+			self.X = None
+			self.Xf = self._X.ctypes.data_as(POINTER(c_float))
+		elif self._X.dtype == np.float64:
+			self.X = self._X.ctypes.data_as(POINTER(c_double))
+			self.Xf = None
+		else:
+			raise ValueError('Features must be stored as float64 or float32')
+		self.Y = self._Y.ctypes.data_as(POINTER(c_double))
 	def __init__(self):
 		self.__createfrom__ = 'python'
 		self.__frombuffer__ = True
@@ -71,8 +84,8 @@ class vector_int(Structure):
 
 
 class options(Structure):
-	_names = ['lambda_l', 'Cp', 'Cn', 'epsilon', 'cgitermax', 'mfnitermax']
-	_types = [c_double, c_double, c_double, c_double, c_int, c_int]
+	_names = ['lambda_l', 'Cp', 'Cn', 'epsilon', 'cgitermax', 'mfnitermax', 'numThreads']
+	_types = [c_double, c_double, c_double, c_double, c_int, c_int, c_int]
 	_fields_ = genFields(_names, _types)
 
 	def __init__(self, **kwargs):
@@ -97,6 +110,9 @@ class options(Structure):
 			if 'mfnitermax' in kwargs.keys():
 				self.mfnitermax = kwargs['mfnitermax']
 
+			if 'numThreads' in kwargs.keys():
+				self.numThreads = max(1, int(kwargs['numThreads']))
+
 	def set_defaults(self):
 		self.lambda_l = 1.0
 		self.Cp = 1.0 
@@ -104,6 +120,7 @@ class options(Structure):
 		self.epsilon = 1e-7
 		self.cgitermax = 10000
 		self.mfnitermax = 50
+		self.numThreads = 1
 
 	def __str__(self):
 		s = ''
@@ -115,18 +132,83 @@ class options(Structure):
 		return s
 
 
-fillprototype(libssl.call_L2_SVM_MFN, None, [POINTER(data), POINTER(options), POINTER(vector_double), POINTER(vector_double), c_int, c_double, c_double])
+fillprototype(libssl.call_L2_SVM_MFN, None, [POINTER(data), POINTER(options), POINTER(vector_double), POINTER(vector_double), c_int, c_double, c_double,
+					     POINTER(c_double), POINTER(c_double), c_void_p])
+fillprototype(libssl.new_workspace, c_void_p, [])
+fillprototype(libssl.reserve_workspace, None, [c_void_p, c_int, c_int, c_int])
+fillprototype(libssl.free_workspace, None, [c_void_p])
 fillprototype(libssl.init_vec_double, None, [POINTER(vector_double), c_int, c_double])
 fillprototype(libssl.init_vec_int, None, [POINTER(vector_int), c_int])
 fillprototype(libssl.clear_vec_double, None, [POINTER(vector_double)])
 fillprototype(libssl.clear_vec_int, None, [POINTER(vector_int)])
 
-def solver(X, y, verbose, **kwargs):
+class SolverWorkspace(object):
+	'''
+	Buffers of the solver (active subset, Newton step, CGLS and line search vectors, and the weights 
+	and outputs), allocated on first use and reused by every solver() call passed the workspace, e.g., 
+	for all (Cp, Cn) pairs of a CV fold over all iterations.  Buffers grow as needed, so one workspace 
+	may be used for training sets of different sizes, but not by concurrent calls.
+	'''
+	def __init__(self):
+		self.handle = libssl.new_workspace()
+		self.weights = np.zeros(0)
+		self.outputs = np.zeros(0)
+
+	def buffers(self, m, n):
+		""" Weights (n) and outputs (m) vectors, backed by the workspace
+		"""
+		if len(self.weights) < n:
+			self.weights = np.zeros(n)
+		if len(self.outputs) < m:
+			self.outputs = np.zeros(max(m, len(self.outputs) + len(self.outputs) // 4))
+		w = vector_double()
+		w.d = n
+		w.vec = self.weights.ctypes.data_as(POINTER(c_double))
+		o = vector_double()
+		o.d = m
+		o.vec = self.outputs.ctypes.data_as(POINTER(c_double))
+		return w, o
+
+	def close(self):
+		""" Free the workspace's buffers
+		"""
+		if self.handle is not None:
+			libssl.free_workspace(self.handle)
+			self.handle = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __del__(self):
+		self.close()
+
+def solver(X, y, verbose, initWeights = None, initOutputs = None, returnOutputs = False, dtype = np.float64, 
+	   workspace = None, **kwargs):
 	""" Set up data structures and call optimized L2-SVM-MFN function.  Note that to make the data 
 	transfer of the numpy feature matrix to a flat ctype array as fast as possible, the L2-SVM-MFN 
 	source assumes the bias is not represented as a column of ones in the passed-in feature matrix, 
 	i.e., the bias term is handled separately whenever the passed in feature matrix X (called set 
-	the C++ L2_SVM_MFN function) is directly accessed.
+	the C++ L2_SVM_MFN function) is directly accessed.  A C-contiguous float64 X (and float64 y) 
+	is passed to the solver as is, without copying; CGLS reads its rows in place.
+
+	dtype = np.float32 stores X in single precision (e.g., standardized PIN features), halving the 
+	memory traffic of CGLS; dot products and the solution are still accumulated in double precision.  
+	A C-contiguous float32 X is then passed without copying.
+
+	workspace (a SolverWorkspace) provides the solver's buffers, so that repeated calls do not 
+	allocate them; otherwise they are allocated and freed by this call.
+
+	initWeights (of length X.shape[1] + 1, the bias last) warm-starts the solver, e.g., from the
+	solution for neighbouring class weights Cp and Cn.  initOutputs, the outputs of initWeights
+	on X, are computed if not given.  If returnOutputs is True, the outputs of the solution on X
+	are returned with the weights, so they may be passed as initOutputs of a later call.
+
+	Keyword arguments set the solver options (see class options), e.g., Cp and Cn.  numThreads > 1 
+	runs the CGLS and line search loops over examples with that many OpenMP threads, if libssl.so 
+	was built with OpenMP; results are deterministic for a given number of threads.
 	"""
 	# check y
 	if not isinstance(y, np.ndarray):
@@ -149,16 +231,48 @@ def solver(X, y, verbose, **kwargs):
 	elif X.shape[0] != y.shape[0]:
 		raise ValueError('X and y must have  the same number of samples')
 
+	# the solver operates on row-major features (a no-op for C-contiguous X of the requested precision)
+	dtype = np.dtype(dtype)
+	if dtype != np.float64 and dtype != np.float32:
+		raise ValueError('dtype must be float64 or float32')
+	X = np.ascontiguousarray(X, dtype = dtype)
+
+	w0 = None
+	o0 = None
+	if initWeights is not None:
+		w0 = np.ascontiguousarray(initWeights, dtype = np.float64)
+		if w0.shape != (X.shape[1] + 1,):
+			raise ValueError('initWeights must contain one weight per feature followed by the bias')
+		if initOutputs is not None:
+			o0 = np.ascontiguousarray(initOutputs, dtype = np.float64)
+			if o0.shape != (X.shape[0],):
+				raise ValueError('initOutputs must contain one output per sample')
+
 	ssl_data = data()
-	ssl_weights = vector_double()
 	ssl_options = options(**kwargs)
-	ssl_data.from_data(X,y)
-	ssl_outputs = vector_double()
-	libssl.call_L2_SVM_MFN(ssl_data, ssl_options, ssl_weights, ssl_outputs, verbose, ssl_options.Cp, ssl_options.Cn)
+	ssl_data.from_data(X,y,dtype)
+	if workspace is not None:
+		ssl_weights, ssl_outputs = workspace.buffers(ssl_data.m, ssl_data.n)
+	else:
+		ssl_weights = vector_double()
+		ssl_outputs = vector_double()
+	libssl.call_L2_SVM_MFN(ssl_data, ssl_options, ssl_weights, ssl_outputs, verbose, ssl_options.Cp, ssl_options.Cn,
+			       None if w0 is None else w0.ctypes.data_as(POINTER(c_double)),
+			       None if o0 is None else o0.ctypes.data_as(POINTER(c_double)),
+			       None if workspace is None else workspace.handle)
 	
-	clf = np.array(np.fromiter(ssl_weights.vec, dtype=np.float64, count=ssl_weights.d))
+	if workspace is not None:
+		clf = workspace.weights[:ssl_data.n].copy()
+		if returnOutputs:
+			outputs = workspace.outputs[:ssl_data.m].copy()
+	else:
+		clf = np.array(np.fromiter(ssl_weights.vec, dtype=np.float64, count=ssl_weights.d))
+		if returnOutputs:
+			outputs = np.array(np.fromiter(ssl_outputs.vec, dtype=np.float64, count=ssl_outputs.d))
 
-	libssl.clear_vec_double(ssl_outputs)
-	libssl.clear_vec_double(ssl_weights)
+		libssl.clear_vec_double(ssl_outputs)
+		libssl.clear_vec_double(ssl_weights)
 
+	if returnOutputs:
+		return clf, outputs
 	return clf
@@ -35,6 +35,9 @@
 
 #include <stdarg.h>
 #include <cstring>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 #ifdef __cplusplus
 extern "C" {
@@ -59,20 +62,104 @@ extern "C" {
 
 using namespace std;
 
+// Output of the row x of the (row-major) feature matrix, with an implicit bias feature of one, 
+// i.e., x'w[0:n-1] + w[n-1].  Summed in the same order as dgemv over rows with an explicit bias column.
+// Rows stored in single precision are accumulated in double precision
+template <typename T>
+inline double rowOutput(const T* x, const double* w, int n1){
+  double t = 0.0;
+  for (int j = 0; j < n1; j++) {
+    t += (double)x[j] * w[j];
+  }
+  return t + w[n1];
+}
+
+// r[0:n1] += a * x, for a row x of the feature matrix
+inline void addScaledRow(int n1, double a, const double* x, double* r){
+  int inc = 1;
+  daxpy_(&n1, &a, const_cast<double*>(x), &inc, r, &inc);
+}
+
+inline void addScaledRow(int n1, double a, const float* x, double* r){
+  for (int j = 0; j < n1; j++) {
+    r[j] += a * (double)x[j];
+  }
+}
+
+// Output of example i, whether the feature matrix is stored in double (Data->X) or single (Data->Xf) precision
+inline double exampleOutput(const struct data *Data, long i, double* w){
+  int n0 = Data->n - 1;
+  int inc = 1;
+  if (Data->Xf != NULL)
+    return rowOutput(Data->Xf + i*n0, w, n0);
+  return ddot_(&n0, Data->X + i*n0, &inc, w, &inc) + w[n0];
+}
+
+// Number of threads to use for a loop over m items, one if the loop is too short to be worth parallelizing
+inline int loopThreads(int m, int numThreads){
+#ifdef _OPENMP
+  if (numThreads > 1 && m >= numThreads * MIN_ROWS_PER_THREAD)
+    return numThreads;
+#endif
+  return 1;
+}
+
+// Contiguous block [lo, hi) of m items processed by thread t of nt threads
+inline void threadBlock(int m, int t, int nt, int* lo, int* hi){
+  *lo = (int)(((long)m * t) / nt);
+  *hi = (int)(((long)m * (t + 1)) / nt);
+}
+
+// r += X_J' z, i.e., the transposed matrix-vector product over the rows J of the feature matrix, 
+// with the implicit bias feature of one.  When multithreaded, each thread accumulates a contiguous 
+// block of rows into its own partial sum in rPartial (numThreads x n), and the partial sums are 
+// added in thread order, so results only depend on the number of threads
+template <typename T>
+void accumulateXtz(int active, const int* J, double* z, const T* set, int n1, double* r, 
+                   int numThreads, double* rPartial){
+  int inc = 1;
+  int n = n1 + 1;
+  int nt = loopThreads(active, numThreads);
+  if (nt == 1) {
+    for (int i = 0; i < active; i++) {
+      addScaledRow(n1, z[i], set + (long)J[i] * n1, r);
+      r[n1] += z[i];
+    }
+    return;
+  }
+  double one = 1.0;
+  for (long j = 0; j < (long)nt * n; j++) {
+    rPartial[j] = 0.0;
+  }
+#pragma omp parallel num_threads(nt)
+  {
+#ifdef _OPENMP
+    int t = omp_get_thread_num();
+    int lo, hi;
+    threadBlock(active, t, omp_get_num_threads(), &lo, &hi);
+    double* rt = rPartial + (long)t * n;
+    for (int i = lo; i < hi; i++) {
+      addScaledRow(n1, z[i], set + (long)J[i] * n1, rt);
+      rt[n1] += z[i];
+    }
+#endif
+  }
+  for (int t = 0; t < nt; t++) {
+    daxpy_(&n, &one, rPartial + (long)t * n, &inc, r, &inc);
+  }
+}
+
+template <typename T>
 double cglsFun1(int active, int* J, const double* Y,
-                double* set2, int n, double* q, 
-                double* p, double cpos, double cneg){
+                const T* set, int n1, double* q, 
+                double* p, double cpos, double cneg, int numThreads){
   double omega_q = 0.0;
-  int inc = 1;
   int i = 0;
 
-  char trans = 'T';
-  double alpha = 1.0;
-  double beta = 0.0;
-  dgemv_(&trans, &n, &active,
-         &alpha, set2, &n,
-         p, &inc, &beta, q, &inc);
-
+#pragma omp parallel for schedule(static) num_threads(loopThreads(active, numThreads))
+  for (i = 0; i < active; i++) {
+    q[i] = rowOutput(set + (long)J[i] * n1, p, n1);
+  }
   for (i = 0; i < active; i++) {
     omega_q += ((Y[J[i]]==1)? cpos : cneg) * (q[i]) * (q[i]);
   }
@@ -80,20 +167,18 @@ double cglsFun1(int active, int* J, const double* Y,
   return(omega_q);
 }
 
+template <typename T>
 void cglsFun2(int active, int* J, const double* Y,
-              double* set2, int n0, int n, double* q, 
+              const T* set, int n1, double* q, 
               double* o, double* z, double* r, 
-              double cpos, double cneg){
+              double cpos, double cneg, int numThreads, double* rPartial){
   int i;
-  int inc = 1;
-  int ind = 0;
-  double temp = 0.0;
   
   for (i = 0; i < active; i++) {
     o[J[i]] += q[i];
     z[i] -= ((Y[J[i]]==1)? cpos : cneg) * q[i];
-    daxpy_(&n, &(z[i]), set2 + i * n, &inc, r, &inc);
   }
+  accumulateXtz(active, J, z, set, n1, r, numThreads, rPartial);
 }
 
 int CGLS(const struct data *Data, 
@@ -102,7 +187,8 @@ int CGLS(const struct data *Data,
 	 const struct vector_int *Subset, 
 	 struct vector_double *Weights,
 	 struct vector_double *Outputs,
-	 int verbose, double cpos, double cneg)
+	 int verbose, double cpos, double cneg, int numThreads,
+	 struct workspace *Work)
 {
   if(VERBOSE_CGLS)
     cout << "CGLS starting..." << endl;
@@ -111,7 +197,9 @@ int CGLS(const struct data *Data,
   tictoc.restart();
   int active = Subset->d;
   int *J = Subset->vec;
+  // rows of the active subset are accessed in place, the bias (last) feature is implicit
   double* set = Data->X;
+  float* setf = Data->Xf; // if not NULL, features are stored in single precision
   double *Y = Data->Y;
   // double *C = Data->C;
   int n  = Data->n;
@@ -120,29 +208,28 @@ int CGLS(const struct data *Data,
   double *beta = Weights->vec;
   double *o  = Outputs->vec; 
   // initialize z 
-  double *z = new double[active];
-  double *q = new double[active];
+  double *z = Work->z;
+  double *q = Work->q;
   int ii=0;
-  register int i,j; 
-  int n0 = n-1;
+  register int i; 
   int inc = 1;
   double one = 1;
   double negLambda = -lambda_l;
-  int rowStart = 0;
-  double* set2 = new double[n*active];
-  double* r = new double[n];
+  double* r = Work->r;
+  // per-thread partial sums of the gradient
+  double* rPartial = Work->rPartial;
   for (i = n; i--;) {
     r[i] = 0.0;
   }
   for (i = 0; i < active; i++) {
     ii = J[i];
     z[i] = ((Y[ii]==1)? cpos : cneg) * (Y[ii] - o[ii]);
-    rowStart = i * n;
-    memcpy(set2 + rowStart, set + ii*n1, sizeof(double)*n1);
-    set2[rowStart + n1] = 1;
-    daxpy_(&n, &(z[i]), set2 + i*n, &inc, r, &inc);
   }
-  double *p = new double[n];   
+  if (setf != NULL)
+    accumulateXtz(active, J, z, setf, n1, r, numThreads, rPartial);
+  else
+    accumulateXtz(active, J, z, set, n1, r, numThreads, rPartial);
+  double *p = Work->p;
   // double omega1 = 0.0;
   // for(i = n ; i-- ;)
   //   {
@@ -175,7 +262,10 @@ int CGLS(const struct data *Data,
   while(cgiter < cgitermax)
     {
       cgiter++;
-      omega_q = cglsFun1(active, J, Y, set2, n, q, p, cpos, cneg);
+      if (setf != NULL)
+        omega_q = cglsFun1(active, J, Y, setf, n1, q, p, cpos, cneg, numThreads);
+      else
+        omega_q = cglsFun1(active, J, Y, set, n1, q, p, cpos, cneg, numThreads);
       gamma = omega1 / (lambda_l * omega_p + omega_q);
       inv_omega2 = 1 / omega1;
 
@@ -185,8 +275,12 @@ int CGLS(const struct data *Data,
       daxpy_(&n, &gamma, p, &inc, beta, &inc);
       dscal_(&active, &gamma, q, &inc);
 
-      cglsFun2(active, J, Y, set2,
-	       n0, n, q, o, z, r, cpos, cneg);
+      if (setf != NULL)
+        cglsFun2(active, J, Y, setf,
+                 n1, q, o, z, r, cpos, cneg, numThreads, rPartial);
+      else
+        cglsFun2(active, J, Y, set,
+                 n1, q, o, z, r, cpos, cneg, numThreads, rPartial);
 
       omega_z = ddot_(&active, z, &inc, z, &inc);
       omega1 = ddot_(&n, r, &inc, r, &inc);
@@ -266,27 +360,22 @@ int CGLS(const struct data *Data,
   tictoc.stop();
   if (verbose > 0)
     cout << "CGLS converged in " << cgiter << " iteration(s) and " << tictoc.time() << " seconds." << endl;
-  delete[] z;
-  delete[] q;
-  delete[] r;
-  delete[] p;
   return optimality;
 }
 int L2_SVM_MFN(const struct data *Data, 
 	       struct options *Options, 
 	       struct vector_double *Weights,
 	       struct vector_double *Outputs,
-	       int verbose, double cpos, double cneg)
+	       int verbose, double cpos, double cneg,
+	       struct workspace *Work)
 { 
   /* Disassemble the structures */  
   timer tictoc;
   tictoc.restart();
-  double* set = Data->X;
   double *Y = Data->Y;
   // double *C = Data->C;
   int n  = Data->n;
   int m  = Data->m;
-  int n0 = n-1;
   double lambda_l = 1.0;
   double epsilon = BIG_EPSILON;
   int cgitermax = SMALL_CGITERMAX;
@@ -298,8 +387,10 @@ int L2_SVM_MFN(const struct data *Data,
   double diff=0.0;
   int ini = 0;
   int inc = 1;
-  vector_int *ActiveSubset = new vector_int[1];
-  ActiveSubset->vec = new int[m];
+  int numThreads = Options->numThreads;
+  vector_int ActiveSubset_s;
+  vector_int *ActiveSubset = &ActiveSubset_s;
+  ActiveSubset->vec = Work->active;
   ActiveSubset->d = m;
   for(int i=0;i<n;i++) F+=w[i]*w[i];
   F=0.5*lambda_l*F;        
@@ -326,14 +417,17 @@ int L2_SVM_MFN(const struct data *Data,
   int iter=0;
   int opt=0;
   int opt2=0;
-  vector_double *Weights_bar = new vector_double[1];
-  vector_double *Outputs_bar = new vector_double[1];
-  double *w_bar = new double[n];
-  double *o_bar = new double[m];
+  vector_double Weights_bar_s;
+  vector_double Outputs_bar_s;
+  vector_double *Weights_bar = &Weights_bar_s;
+  vector_double *Outputs_bar = &Outputs_bar_s;
+  double *w_bar = Work->w_bar;
+  double *o_bar = Work->o_bar;
   Weights_bar->vec=w_bar;
   Outputs_bar->vec=o_bar;
   Weights_bar->d=n;
   Outputs_bar->d=m;
+  Delta *deltas = Work->deltas; // line search breakpoints, reused over iterations
   double delta=0.0;
   double t=0.0;
   int ii = 0;
@@ -347,12 +441,13 @@ int L2_SVM_MFN(const struct data *Data,
       for(int i=m; i-- ;)  
 	o_bar[i]=o[i];
       cout << " " ;
-      opt=CGLS(Data,cgitermax, epsilon,ActiveSubset,Weights_bar,Outputs_bar, verbose, cpos, cneg);
-      for(register int i=active; i < m; i++) 
+      opt=CGLS(Data,cgitermax, epsilon,ActiveSubset,Weights_bar,Outputs_bar, verbose, cpos, cneg, numThreads, Work);
+#pragma omp parallel for schedule(static) num_threads(loopThreads(m - active, numThreads))
+      for(int i=active; i < m; i++) 
 	{
-	  ii=ActiveSubset->vec[i];   
+	  int ii=ActiveSubset->vec[i];   
 	  // o_bar[ii] = ddot_(&n, set + ii*n, &inc, w_bar, &inc);
-	  o_bar[ii] = ddot_(&n0, set + ii*n0, &inc, w_bar, &inc) + w_bar[n0];
+	  o_bar[ii] = exampleOutput(Data, ii, w_bar);
 	  // t = w_bar[n - 1];
 	  // for (register int j = n - 1; j--;) {
 	  //   t += set[j + ii * n] * w_bar[j];
@@ -387,12 +482,6 @@ int L2_SVM_MFN(const struct data *Data,
 	    {
 	      memcpy(w, w_bar, sizeof(double)*n);
 	      memcpy(o, o_bar, sizeof(double)*m);
-	      delete[] ActiveSubset->vec;
-	      delete[] ActiveSubset;
-	      delete[] o_bar;
-	      delete[] w_bar;
-	      delete[] Weights_bar;
-	      delete[] Outputs_bar;
 	      tictoc.stop();
 	      if (verbose > 0)
 		cout << "L2_SVM_MFN converged (optimality) in " << iter << " iteration(s) and "<< tictoc.time() << " seconds. \n" << endl;
@@ -401,7 +490,7 @@ int L2_SVM_MFN(const struct data *Data,
 	}
       if (verbose > 0)
         cout << " " ;
-      delta=line_search(w,w_bar,lambda_l,o,o_bar,Y,n,m, cpos, cneg); 
+      delta=line_search(w,w_bar,lambda_l,o,o_bar,Y,n,m, cpos, cneg, numThreads, deltas); 
       if (verbose > 0)
         cout << "LINE_SEARCH delta = " << delta << endl;     
       F_old = F;
@@ -453,28 +542,47 @@ int L2_SVM_MFN(const struct data *Data,
 	{
 	  if (verbose > 0)
 	    cout << "L2_SVM_MFN converged (rel. criterion) in " << iter << " iterations and "<< tictoc.time() << " seconds. \n" << endl;
-	  delete[] ActiveSubset->vec;
-	  delete[] ActiveSubset;
-	  delete[] o_bar;
-	  delete[] w_bar;
-	  delete[] Weights_bar;
-	  delete[] Outputs_bar;
 	  tictoc.stop();
 	  return 2;
 	}
     }
-  delete[] ActiveSubset->vec;
-  delete[] ActiveSubset;
-  delete[] o_bar;
-  delete[] w_bar;
-  delete[] Weights_bar;
-  delete[] Outputs_bar;
   tictoc.stop();
   if (verbose > 0)
     cout << "L2_SVM_MFN converged (max iter exceeded) in " << iter << " iterations and "<< tictoc.time() << " seconds. \n" << endl;
   return 0;
 }
 
+// Line search terms of examples [lo, hi): adds their contributions to the left and right derivatives 
+// *L and *R, and writes the breakpoints where examples enter or leave the active set to deltas, 
+// incrementing *p for each
+void lineSearchBlock(int lo, int hi, const double *o, const double *o_bar, const double *Y, 
+                     double cpos, double cneg, double *L, double *R, Delta *deltas, int *p)
+{
+  double diff = 0.0;
+  double d2 = 0.0;
+  for (int i = lo; i < hi; i++) {
+    diff = Y[i] * (o_bar[i] - o[i]);
+    if (Y[i] * o[i] < 1) {
+      d2 = ((Y[i]==1)? cpos : cneg) * (o_bar[i] - o[i]);
+      *L += (o[i] - Y[i]) * d2;
+      *R += (o_bar[i] - Y[i]) * d2;
+      if (diff > 0) {
+        deltas[*p].delta = (1 - Y[i] * o[i]) / diff;
+        deltas[*p].index = i;
+        deltas[*p].s = -1;
+        (*p)++;
+      }
+    } else {
+      if (diff < 0) {
+        deltas[*p].delta = (1 - Y[i] * o[i]) / diff;
+        deltas[*p].index = i;
+        deltas[*p].s = 1;
+        (*p)++;
+      }
+    }
+  }
+}
+
 double line_search(double *w, 
                    double *w_bar,
                    double lambda_l,
@@ -482,7 +590,9 @@ double line_search(double *w,
                    double *o_bar, 
                    double *Y, 
                    int d, /* data dimensionality -- 'n' */
-                   int l,  double cpos, double cneg) /* number of examples */                  
+                   int l,  double cpos, double cneg, /* number of examples */
+                   int numThreads,
+                   Delta *deltas) /* workspace for at least l breakpoints */
 {                       
   int inc = 1;
   int i = 0;
@@ -499,44 +609,57 @@ double line_search(double *w,
   double L = omegaL;
   double R = omegaR;
   int ii = 0;
-  double d2 = 0.0;
 
-  Delta* deltas = new Delta[l];
   int p = 0;
-  for (i = 0; i < l; i++) {
-    diff = Y[i] * (o_bar[i] - o[i]);
-    if (Y[i] * o[i] < 1) {
-      d2 = ((Y[i]==1)? cpos : cneg) * (o_bar[i] - o[i]);
-      L += (o[i] - Y[i]) * d2;
-      R += (o_bar[i] - Y[i]) * d2;
-      if (diff > 0) {
-        deltas[p].delta = (1 - Y[i] * o[i]) / diff;
-        deltas[p].index = i;
-        deltas[p].s = -1;
-        p++;
-      }
-    } else {
-      if (diff < 0) {
-        deltas[p].delta = (1 - Y[i] * o[i]) / diff;
-        deltas[p].index = i;
-        deltas[p].s = 1;
-        p++;
-      }
+  int nt = loopThreads(l, numThreads);
+  if (nt == 1) {
+    lineSearchBlock(0, l, o, o_bar, Y, cpos, cneg, &L, &R, deltas, &p);
+  } else {
+    // each thread scans a contiguous block of examples, writing its breakpoints from the start of 
+    // the block; the blocks' sums and breakpoints are then gathered in order
+    double* Ls = new double[nt];
+    double* Rs = new double[nt];
+    int* ps = new int[nt];
+    for (int t = 0; t < nt; t++) {
+      Ls[t] = 0.0;
+      Rs[t] = 0.0;
+      ps[t] = 0;
+    }
+#pragma omp parallel for schedule(static, 1) num_threads(nt)
+    for (int t = 0; t < nt; t++) {
+      int lo, hi;
+      threadBlock(l, t, nt, &lo, &hi);
+      lineSearchBlock(lo, hi, o, o_bar, Y, cpos, cneg, Ls + t, Rs + t, deltas + lo, ps + t);
+    }
+    for (int t = 0; t < nt; t++) {
+      int lo, hi;
+      threadBlock(l, t, nt, &lo, &hi);
+      L += Ls[t];
+      R += Rs[t];
+      if (lo != p) 
+        memmove(deltas + p, deltas + lo, sizeof(Delta)*ps[t]);
+      p += ps[t];
     }
+    delete[] Ls;
+    delete[] Rs;
+    delete[] ps;
   }
-  sort(deltas, deltas + p);
+  // walk the breakpoints in increasing order until the derivative becomes nonnegative; the walk 
+  // usually stops early, so breakpoints are popped from a min-heap (built in O(p)) rather than sorted
+  make_heap(deltas, deltas + p, greaterDelta);
   double delta_prime = 0.0;
-  for (i = 0; i < p; i++) {
-    delta_prime = L + deltas[i].delta * (R - L);
+  for (i = p; i > 0; i--) {
+    pop_heap(deltas, deltas + i, greaterDelta);
+    const Delta& next = deltas[i - 1];
+    delta_prime = L + next.delta * (R - L);
     if (delta_prime >= 0) {
       break;
     }
-    ii = deltas[i].index;
-    diff = (deltas[i].s) * ((Y[ii]==1)? cpos : cneg) * (o_bar[ii] - o[ii]);
+    ii = next.index;
+    diff = (next.s) * ((Y[ii]==1)? cpos : cneg) * (o_bar[ii] - o[ii]);
     L += diff * (o[ii] - Y[ii]);
     R += diff * (o_bar[ii] - Y[ii]);
   }
-  delete[] deltas;
   return (-L / (R - L));
 } 
 
@@ -574,16 +697,109 @@ void call_L2_SVM_MFN(struct data *Data,
 		     struct options *Options, 
 		     struct vector_double *Weights,
 		     struct vector_double *Outputs,
-		     int verbose, double cpos, double cneg)
+		     int verbose, double cpos, double cneg,
+		     const double *initWeights, const double *initOutputs,
+		     struct workspace *Work)
 {
   // initialize 
-  init_vec_double(Weights,Data->n,0.0);
-  init_vec_double(Outputs,Data->m,0.0);
+  if (Weights->vec == NULL)
+    init_vec_double(Weights,Data->n,0.0);
+  else
+    fill(Weights->vec, Weights->vec + Data->n, 0.0);
+  if (Outputs->vec == NULL)
+    init_vec_double(Outputs,Data->m,0.0);
+  else
+    fill(Outputs->vec, Outputs->vec + Data->m, 0.0);
+  struct workspace *localWork = NULL;
+  if (Work == NULL) {
+    localWork = new_workspace();
+    Work = localWork;
+  }
+  reserve_workspace(Work, Data->m, Data->n, Options->numThreads);
+  if (initWeights != NULL) {
+    // warm start from the given weights; the loose first pass of CGLS is kept, 
+    // since initWeights are generally the solution of a different (cpos, cneg) pair
+    memcpy(Weights->vec, initWeights, sizeof(double)*Data->n);
+    if (initOutputs != NULL) {
+      memcpy(Outputs->vec, initOutputs, sizeof(double)*Data->m);
+    } else {
+      for (int i = 0; i < Data->m; i++) {
+	Outputs->vec[i] = exampleOutput(Data, i, Weights->vec);
+      }
+    }
+  }
   // call L2-SVM-MFn
   int optimality = 0;
-  optimality=L2_SVM_MFN(Data,Options,Weights,Outputs,verbose, cpos, cneg);
+  optimality=L2_SVM_MFN(Data,Options,Weights,Outputs,verbose, cpos, cneg, Work);
+  if (localWork != NULL)
+    free_workspace(localWork);
   return;
 } 
+struct workspace *new_workspace()
+{
+  struct workspace *Work = new workspace;
+  Work->m = 0;
+  Work->n = 0;
+  Work->numThreads = 0;
+  Work->active = NULL;
+  Work->w_bar = NULL;
+  Work->o_bar = NULL;
+  Work->deltas = NULL;
+  Work->z = NULL;
+  Work->q = NULL;
+  Work->r = NULL;
+  Work->p = NULL;
+  Work->rPartial = NULL;
+  return Work;
+}
+void reserve_workspace(struct workspace *Work, int m, int n, int numThreads)
+{
+  if (m > Work->m) {
+    // leave room for training sets which grow slightly between iterations
+    int capacity = max(m, Work->m + Work->m / 4);
+    delete[] Work->active;
+    delete[] Work->o_bar;
+    delete[] Work->deltas;
+    delete[] Work->z;
+    delete[] Work->q;
+    Work->active = new int[capacity];
+    Work->o_bar = new double[capacity];
+    Work->deltas = new Delta[capacity];
+    Work->z = new double[capacity];
+    Work->q = new double[capacity];
+    Work->m = capacity;
+  }
+  if (n > Work->n) {
+    delete[] Work->w_bar;
+    delete[] Work->r;
+    delete[] Work->p;
+    delete[] Work->rPartial;
+    Work->w_bar = new double[n];
+    Work->r = new double[n];
+    Work->p = new double[n];
+    Work->rPartial = NULL;
+    Work->numThreads = 0;
+    Work->n = n;
+  }
+  if (numThreads > 1 && numThreads > Work->numThreads) {
+    delete[] Work->rPartial;
+    Work->rPartial = new double[(long)numThreads * Work->n];
+    Work->numThreads = numThreads;
+  }
+}
+void free_workspace(struct workspace *Work)
+{
+  delete[] Work->active;
+  delete[] Work->w_bar;
+  delete[] Work->o_bar;
+  delete[] Work->deltas;
+  delete[] Work->z;
+  delete[] Work->q;
+  delete[] Work->r;
+  delete[] Work->p;
+  delete[] Work->rPartial;
+  delete Work;
+}
 void clear_vec_double(struct vector_double *c)
 { delete[] c->vec; return;}
 void clear_vec_int(struct vector_int *c)
@@ -32,6 +32,7 @@ using namespace std;
 #define BIG_EPSILON 0.01 /* for heuristic 2 in reference [2] */
 #define RELATIVE_STOP_EPS 1e-9 /* for L2-SVM-MFN relative stopping criterion */
 #define MFNITERMAX 50 /* maximum number of MFN iterations */
+#define MIN_ROWS_PER_THREAD 2048 /* loops over fewer examples per thread are run single-threaded */
 
 #define VERBOSE_CGLS 0
 
@@ -41,6 +42,7 @@ extern "C" struct data
   int m; /* number of examples */
   int n; /* number of features */ 
   double* X; // flattened dense feature matrix
+  float* Xf; // single-precision feature matrix, used instead of X if not NULL (accumulation is in double precision)
   double *Y;   /* labels */
 };
 
@@ -72,6 +74,7 @@ extern "C" struct options
   double epsilon; /* all tolerances */
   int cgitermax;  /* max iterations for CGLS */
   int mfnitermax; /* max iterations for L2_SVM_MFN */
+  int numThreads; /* OpenMP threads for the CGLS and line search loops over examples */
 		
 };
 
@@ -99,6 +102,29 @@ class Delta { /* used in line search */
   int s;   
 };
 inline bool operator<(const Delta& a , const Delta& b) { return (a.delta < b.delta);};
+inline bool greaterDelta(const Delta& a , const Delta& b) { return (a.delta > b.delta);}; /* min-heap order */
+
+/* Buffers of L2_SVM_MFN and CGLS, allocated once and reused by repeated solves */
+extern "C" struct workspace
+{
+  int m; /* number of examples the buffers hold */
+  int n; /* number of features (including the bias) the buffers hold */
+  int numThreads; /* number of threads rPartial holds partial sums for */
+  int *active; /* indices of the active subset, followed by the inactive examples (m) */
+  double *w_bar; /* weights of the Newton step (n) */
+  double *o_bar; /* outputs of the Newton step (m) */
+  Delta *deltas; /* line search breakpoints (m) */
+  double *z; /* CGLS residuals of the active examples (m) */
+  double *q; /* CGLS outputs of the search direction on the active examples (m) */
+  double *r; /* CGLS gradient (n) */
+  double *p; /* CGLS search direction (n) */
+  double *rPartial; /* per-thread partial sums of the gradient (numThreads x n), or NULL */
+};
+
+extern "C" struct workspace *new_workspace(); /* returns an empty workspace, grown by reserve_workspace */
+extern "C" void reserve_workspace(struct workspace *Work, int m, int n, int numThreads); 
+/* grows the buffers of Work, if needed, for m examples of n features solved with numThreads threads */
+extern "C" void free_workspace(struct workspace *Work); /* deletes Work and its buffers */
 
 //extern "C" void init_data(struct data *Data, )
 extern "C" void init_vec_double(struct vector_double *A, int k, double a);  
@@ -112,8 +138,13 @@ extern "C" void clear_vec_int(struct vector_int *a); /* deletes a */
 extern "C" void call_L2_SVM_MFN(struct data *Data, 
 				struct options *Options,
 				struct vector_double *W, /* weight vector */
-				struct vector_double *O,
-				int verbose, double cpos, double cneg); /* output vector */
+				struct vector_double *O, /* output vector */
+				int verbose, double cpos, double cneg,
+				const double *initWeights, /* initial weights (warm start), or NULL */
+				const double *initOutputs, /* outputs of initWeights, or NULL to compute them */
+				struct workspace *Work); /* buffers reused over solves, or NULL to allocate them for this solve */
+/* W and O are allocated if their vec is NULL (delete with clear_vec_double), otherwise they must hold 
+   Data->n and Data->m elements, respectively */
 
 /* svmlin algorithms and their subroutines */
  
@@ -126,7 +157,8 @@ int CGLS(const struct data *Data,
 	 const struct vector_int *Subset,
 	 struct vector_double *Weights,
 	 struct vector_double *Outputs,
-	 int verbose, double cpos, double cneg);
+	 int verbose, double cpos, double cneg, int numThreads,
+	 struct workspace *Work);
 
 /* Linear Modified Finite Newton L2-SVM*/
 /* Solves: min_w 0.5*Options->lamda*w'*w + 0.5*sum_i Data->C[i] max(0,1 - Y[i] w' x_i)^2 */
@@ -134,11 +166,13 @@ int L2_SVM_MFN(const struct data *Data,
 	       struct options *Options, 
 	       struct vector_double *Weights,
 	       struct vector_double *Outputs,
-	       int verbose,  double cpos, double cneg); /* use ini=0 if no good starting guess for Weights, else 1 */
+	       int verbose,  double cpos, double cneg, /* use ini=0 if no good starting guess for Weights, else 1 */
+	       struct workspace *Work);
 double line_search(double *w, double *w_bar,
 		   double lambda,
 		   double *o, double *o_bar, 
-		   double *Y, int d, int l, double cpos, double cneg);
+		   double *Y, int d, int l, double cpos, double cneg, int numThreads,
+		   Delta *deltas); /* workspace of l breakpoints */
 
 
 #endif
@@ -5,7 +5,7 @@ if (sys.version_info[0] == 3 and sys.version_info[1] < 0):
     print("PRISM requires Python version 3.0 or later")
     sys.exit(1)
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
 from Cython.Build import cythonize
 from os import path
 import subprocess
@@ -40,8 +40,19 @@ def build_solvers():
         except:
             print("Could not build ProteoTorch SVM solver library")
 
+def openmp_flags():
+    """ Compiler and linker flags enabling OpenMP.  Where OpenMP is not readily available
+        (e.g., the default macOS compiler), parallel loops run serially.
+    """
+    if sys.platform.startswith('linux'):
+        return ['-fopenmp'], ['-fopenmp']
+    if sys.platform == 'win32':
+        return ['/openmp'], []
+    return [], []
+
 def main():
     build_solvers()
+    ompCompile, ompLink = openmp_flags()
     setup(
         name=DISTNAME,
         version=VERSION,
@@ -61,10 +72,13 @@ def main():
         ],
         package_data={'proteoTorch_solvers': ['libssl.so']},
         classifiers=CLASSIFIERS,
-        ext_modules = cythonize("proteoTorch/cylibs/proteoTorch_qvalues.pyx",
+        ext_modules = cythonize(["proteoTorch/cylibs/proteoTorch_qvalues.pyx",
+                                 Extension("proteoTorch_qvalues_np", ["proteoTorch/cylibs/proteoTorch_qvalues_np.pyx"],
+                                           extra_compile_args=ompCompile, extra_link_args=ompLink)],
                                 build_dir="build"),
         entry_points = {'console_scripts': ['proteoTorch = proteoTorch.analyze:main',
-                                            'proteoTorchPlot = proteoTorch.plotQvals:main']}
+                                            'proteoTorchPlot = proteoTorch.plotQvals:main',
+                                            'proteoTorchBenchmark = proteoTorch.benchmark:main']}
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,26 @@
+"""
+Checks that L2-SVM-MFN trained on features stored in single precision identifies as many
+targets at q = 0.01 as the double precision solver, up to a small tolerance.
+"""
+import numpy as np
+import pytest
+
+l2_svm_mfn = pytest.importorskip('proteoTorch_solvers.l2_svm_mfn')
+
+from proteoTorch.benchmark import syntheticFeatures
+from proteoTorch.pyfiles.qvalsBase import numTargetsAtQ
+
+q = 0.01
+tolerance = 0.01
+
+@pytest.mark.parametrize('numPsms, numFeatures, seed', [(20000, 20, 1), (50000, 40, 7)])
+def test_float32_solver_identifications(numPsms, numFeatures, seed):
+    X, labels = syntheticFeatures(numPsms, numFeatures, seed = seed)
+    Cn = float(np.sum(labels == 1)) / float(np.sum(labels == -1))
+    numIdentified = {}
+    for dtype in [np.float64, np.float32]:
+        features = X.astype(dtype)
+        clf = l2_svm_mfn.solver(features, labels, 0, Cp = 1., Cn = Cn, dtype = dtype)
+        numIdentified[dtype] = numTargetsAtQ(np.dot(X, clf[:-1]) + clf[-1], labels, q)
+    assert numIdentified[np.float64] > 0
+    assert abs(numIdentified[np.float32] - numIdentified[np.float64]) <= tolerance * numIdentified[np.float64]